@@ -5,15 +5,28 @@ import os
 from decouple import config
 
 # Import routers
-from .routers import auth, machines, requests, admin, customer, recommendations, health_score, orders
+from .routers import auth, machines, requests, admin, customer, recommendations, health_score, orders, exports, telemetry
+from .services import events, indexes, health_scoring, health_history, scheduler, dealer_stats, revenue, response_cache, fleet_feed, ai_cache, ai_recommendations, customer_recommendations, dealer_recommendations, barcode
+from .services import telemetry as telemetry_service, telemetry_rollup
+from .services.serialization import FastJSONResponse
+from .services.compression import CompressionMiddleware
 
 # Create FastAPI instance
 app = FastAPI(
     title="CatRental",
     description="API for managing CatRental machine rentals and tracking",
-    version="1.0.0"
+    version="1.0.0",
+    default_response_class=FastJSONResponse
 )
 
+# Periodic jobs (cron specs in UTC)
+HEALTH_SCORE_CRON = config("HEALTH_SCORE_CRON", default="0 2 * * *")
+RECOMMENDATION_REFRESH_CRON = config("RECOMMENDATION_REFRESH_CRON", default="30 3 * * *")
+DEALER_STATS_RECONCILE_CRON = config("DEALER_STATS_RECONCILE_CRON", default="15 * * * *")
+REVENUE_BACKFILL_CRON = config("REVENUE_BACKFILL_CRON", default="45 1 * * *")
+TELEMETRY_ROLLUP_CRON = config("TELEMETRY_ROLLUP_CRON", default="*/15 * * * *")
+CUSTOMER_RECOMMENDATION_CRON = config("CUSTOMER_RECOMMENDATION_CRON", default="0 4 * * *")
+
 # CORS middleware configuration
 app.add_middleware(
     CORSMiddleware,
@@ -23,6 +36,9 @@ app.add_middleware(
     allow_headers=["*"],
 )
 
+# gzip/brotli for large JSON and streamed responses
+app.add_middleware(CompressionMiddleware)
+
 # Include routers
 app.include_router(auth.router, prefix="/api/auth", tags=["Authentication"])
 app.include_router(machines.router, prefix="/api/machines", tags=["Machines"])
@@ -32,6 +48,81 @@ app.include_router(customer.router, prefix="/api/customer", tags=["Customer"])
 app.include_router(recommendations.router, prefix="/api/recommendations", tags=["Recommendations"])
 app.include_router(health_score.router, prefix="/api/health-score", tags=["Health Score"])
 app.include_router(orders.router, prefix="/api/orders", tags=["Orders"])
+app.include_router(exports.router, prefix="/api/exports", tags=["Exports"])
+app.include_router(telemetry.router, prefix="/api/telemetry", tags=["Telemetry"])
+
+@app.on_event("startup")
+async def start_background_services():
+    try:
+        await indexes.ensure_indexes()
+    except Exception as e:
+        print(f"Error preparing machine and request indexes: {str(e)}")
+    try:
+        await health_history.ensure_collections()
+    except Exception as e:
+        print(f"Error preparing health score history collections: {str(e)}")
+    try:
+        await telemetry_service.ensure_collections()
+    except Exception as e:
+        print(f"Error preparing telemetry collections: {str(e)}")
+    try:
+        await telemetry_rollup.ensure_indexes()
+    except Exception as e:
+        print(f"Error preparing telemetry rollup indexes: {str(e)}")
+    try:
+        await revenue.ensure_indexes()
+    except Exception as e:
+        print(f"Error preparing revenue rollup indexes: {str(e)}")
+    try:
+        await ai_cache.ensure_indexes()
+    except Exception as e:
+        print(f"Error preparing AI recommendation cache indexes: {str(e)}")
+    try:
+        await dealer_recommendations.ensure_indexes()
+    except Exception as e:
+        print(f"Error preparing transfer recommendation indexes: {str(e)}")
+    
+    health_scoring.register()
+    dealer_stats.register()
+    revenue.register()
+    response_cache.register()
+    fleet_feed.register()
+    events.start()
+    
+    scheduler.register_task(
+        "nightly-health-scoring", HEALTH_SCORE_CRON,
+        health_scoring.run_batch_scoring, timeout_seconds=1800
+    )
+    scheduler.register_task(
+        "recommendation-refresh", RECOMMENDATION_REFRESH_CRON,
+        dealer_recommendations.run_refresh, timeout_seconds=3600
+    )
+    scheduler.register_task(
+        "dealer-stats-reconcile", DEALER_STATS_RECONCILE_CRON,
+        dealer_stats.reconcile, timeout_seconds=600
+    )
+    scheduler.register_task(
+        "revenue-daily-backfill", REVENUE_BACKFILL_CRON,
+        revenue.backfill_revenue_daily, timeout_seconds=1800
+    )
+    scheduler.register_task(
+        "telemetry-rollup", TELEMETRY_ROLLUP_CRON,
+        telemetry_rollup.run_rollup, timeout_seconds=600
+    )
+    scheduler.register_task(
+        "customer-recommendation-batch", CUSTOMER_RECOMMENDATION_CRON,
+        customer_recommendations.run_batch, timeout_seconds=7200
+    )
+    scheduler.start()
+
+@app.on_event("shutdown")
+async def stop_background_services():
+    await scheduler.stop()
+    await fleet_feed.stop()
+    await events.stop()
+    await ai_recommendations.stop()
+    await customer_recommendations.stop()
+    barcode.stop()
 
 # Create uploads directory if it doesn't exist
 uploads_dir = "uploads"
@@ -216,6 +216,18 @@ class MachineUsageStats(BaseModel):
     idle_percentage: float
     efficiency_score: float
 
+# Telemetry Models
+class TelemetryReading(BaseModel):
+    machine_id: str = Field(..., min_length=1)
+    engine_hours_per_day: float = Field(..., ge=0, le=24)
+    idle_hours: float = Field(..., ge=0, le=24)
+    operating_days: Optional[int] = Field(default=None, ge=0)
+    timestamp: Optional[datetime] = None
+
+class TelemetryBatch(BaseModel):
+    # Validated one by one so a bad reading doesn't reject the whole batch
+    readings: List[dict]
+
 # Transfer Models
 class TransferBase(BaseModel):
     order_id: str
@@ -1,81 +1,139 @@
-from fastapi import APIRouter, HTTPException, Depends, Query
+from fastapi import APIRouter, HTTPException, Depends, Query, Request
+import asyncio
 import motor.motor_asyncio
-import math
 from decouple import config
 from datetime import datetime, timedelta
-from typing import Optional, List
+from typing import Optional
 from ..models.database import APIResponse, DashboardStats
 from .auth import get_current_user
+from ..services.events import emit_request_change
+from ..services.serialization import api_response
+from ..services.dealer_stats import get_dealer_stats
+from ..services.revenue import MACHINE_TYPES, get_revenue_snapshot, get_daily_revenue
+from ..services.response_cache import cached_response, dealer_tag
+from ..services import compression, ai_cache, single_flight, customer_recommendations, barcode
 
 router = APIRouter()
 
-MACHINE_TYPES = {
-    'Excavator': {'hourlyRate': 150, 'dailyRate': 1200, 'category': 'Heavy Construction'},
-    'Bulldozer': {'hourlyRate': 180, 'dailyRate': 1440, 'category': 'Heavy Construction'},
-    'Loader': {'hourlyRate': 120, 'dailyRate': 960, 'category': 'Material Handling'},
-    'Grader': {'hourlyRate': 140, 'dailyRate': 1120, 'category': 'Road Construction'},
-    'Compactor': {'hourlyRate': 100, 'dailyRate': 800, 'category': 'Compaction'},
-    'Crane': {'hourlyRate': 220, 'dailyRate': 1760, 'category': 'Heavy Lifting'},
-    'Dump Truck': {'hourlyRate': 80, 'dailyRate': 640, 'category': 'Transportation'},
-    'Backhoe': {'hourlyRate': 130, 'dailyRate': 1040, 'category': 'General Construction'}
-}
-
 # MongoDB connection
 MONGODB_URL = config("MONGODB_URL")
 client = motor.motor_asyncio.AsyncIOMotorClient(MONGODB_URL)
 db = client.caterpillar_db
 
-def calculate_machine_revenue(machine_type: str, duration_hours: float, billing_type: str = 'hourly') -> float:
-    """Calculate revenue for a single machine based on type and duration"""
-    machine = MACHINE_TYPES.get(machine_type)
-    
-    if not machine:
-        return duration_hours * 100  # Default fallback rate
-    
-    if billing_type == 'daily':
-        days = math.ceil(duration_hours / 24)
-        return days * machine['dailyRate']
-    else:
-        return duration_hours * machine['hourlyRate']
-
-def calculate_occupied_duration(start_time: datetime, end_time: datetime = None) -> float:
-    """Calculate duration in hours for occupied machines"""
-    if end_time is None:
-        end_time = datetime.utcnow()
-    
-    duration = end_time - start_time
-    return duration.total_seconds() / 3600
-
 async def get_revenue_from_occupied_machines(dealer_id: str) -> float:
     """Calculate total revenue from currently occupied machines"""
     try:
-        occupied_machines = await db.machines.find({
-            "dealerID": dealer_id,
-            "status": "Occupied"
-        }).to_list(length=None)
-        
-        total_revenue = 0.0
-        
-        for machine in occupied_machines:
-            machine_type = machine.get('machineType', 'Unknown')
-            
-            # Try to get when machine became occupied, fallback to updatedAt
-            start_time = machine.get('occupiedSince') or machine.get('updatedAt')
-            
-            if start_time:
-                duration_hours = calculate_occupied_duration(start_time)
-                billing_type = machine.get('billingType', 'hourly')
-                machine_revenue = calculate_machine_revenue(machine_type, duration_hours, billing_type)
-                total_revenue += machine_revenue
-        
-        return round(total_revenue, 2)
+        snapshot = await get_revenue_snapshot(dealer_id)
+        return snapshot["occupied_revenue"]
         
     except Exception as e:
         print(f"Error calculating revenue: {str(e)}")
         return 0.0
 
+async def get_maintenance_alerts(dealer_id: str, limit: int = 5) -> list:
+    """Machines in maintenance for dashboard alerts; counts come from dealer_stats"""
+    return await db.machines.find(
+        {"dealerID": dealer_id, "status": "Maintenance"},
+        {"_id": 0, "machineID": 1}
+    ).to_list(length=limit)
+
+async def get_pending_request_facets(dealer_id: str, recent_limit: int = 5) -> dict:
+    """Count and most recent pending requests on a dealer's machines"""
+    facets = {"count": [{"$count": "total"}]}
+    if recent_limit:
+        facets["recent"] = [
+            {"$sort": {"requestDate": -1}},
+            {"$limit": recent_limit},
+            {"$project": {"_id": 0, "requestType": 1, "requestDate": 1}}
+        ]
+    
+    # Requests carry no dealerID; the $in on the dealer's machines keeps the
+    # match off other dealers' requests. Both steps are served by indexes
+    # from services.indexes: machines(dealerID, machineID) and
+    # requests(machineID, status).
+    machine_ids = await db.machines.distinct("machineID", {"dealerID": dealer_id})
+    result = await db.requests.aggregate([
+        {"$match": {"machineID": {"$in": machine_ids}, "status": "In-Progress"}},
+        {"$facet": facets}
+    ]).to_list(length=1)
+    facet = result[0] if result else {}
+    
+    count = facet.get("count", [])
+    return {
+        "total": count[0]["total"] if count else 0,
+        "recent": facet.get("recent", [])
+    }
+
+async def get_completed_revenue(dealer_id: str, since: datetime) -> float:
+    """Revenue from orders completed since a date"""
+    try:
+        daily = await get_daily_revenue(dealer_id, since)
+        return sum(day["daily_revenue"] for day in daily)
+    except:
+        # If the revenue rollup isn't available, skip completed revenue
+        return 0.0
+
+async def build_dashboard(dealer_id: str) -> APIResponse:
+    """Dashboard stats and notifications for a dealer"""
+    thirty_days_ago = datetime.utcnow() - timedelta(days=30)
+    
+    # Counters by primary key plus the alert lists, all fired concurrently
+    dealer_stats, maintenance_machines, request_facets, completed_revenue, occupied_revenue = await asyncio.gather(
+        get_dealer_stats(dealer_id),
+        get_maintenance_alerts(dealer_id, limit=5),
+        get_pending_request_facets(dealer_id, recent_limit=5),
+        get_completed_revenue(dealer_id, thirty_days_ago),
+        get_revenue_from_occupied_machines(dealer_id)
+    )
+    
+    # Total inventory of machines and active orders/occupied machines
+    total_machines = dealer_stats["total"]
+    active_orders = dealer_stats["active"]
+    
+    # Total revenue combines both streams
+    total_revenue = (occupied_revenue + completed_revenue) * 100
+
+    # Get recent notifications/alerts
+    notifications = []
+    
+    # Machines needing maintenance
+    for machine in maintenance_machines:
+        notifications.append({
+            "type": "maintenance",
+            "title": "Machine Maintenance Required",
+            "message": f"Machine {machine.get('machineID', 'Unknown')} requires maintenance",
+            "timestamp": datetime.utcnow(),
+            "priority": "high"
+        })
+    
+    # Pending requests
+    for request in request_facets["recent"]:
+        notifications.append({
+            "type": "request",
+            "title": f"{request.get('requestType', 'Unknown')} Request",
+            "message": f"New {request.get('requestType', 'request').lower()} request pending approval",
+            "timestamp": request.get('requestDate', datetime.utcnow()),
+            "priority": "medium"
+        })
+    
+    # Sort notifications by timestamp (newest first)
+    notifications.sort(key=lambda x: x['timestamp'], reverse=True)
+    
+    dashboard_data = {
+        "total_machines": total_machines,
+        "active_orders": active_orders,
+        "revenue": total_revenue,  # This will now show real calculated revenue!
+        "notifications": notifications[:10]
+    }
+    
+    return APIResponse(
+        success=True,
+        message="Dashboard data retrieved successfully",
+        data=dashboard_data
+    )
+
 @router.get("/dashboard", response_model=APIResponse)
-async def get_dashboard(current_user: dict = Depends(get_current_user)):
+async def get_dashboard(request: Request, current_user: dict = Depends(get_current_user)):
     """
     Get comprehensive dashboard data including stats and notifications
     """
@@ -85,118 +143,146 @@ async def get_dashboard(current_user: dict = Depends(get_current_user)):
         
         dealer_id = current_user["dealershipID"]
         
-        # Total inventory of machines
-        total_machines = await db.machines.count_documents({"dealerID": dealer_id})
-        
-        # Number of active orders/occupied machines
-        active_orders = await db.machines.count_documents({
-            "dealerID": dealer_id,
-            "status": {"$in": ["Occupied", "In-transit"]}
-        })
-        
-        # ===== NEW REVENUE CALCULATION =====
-        # Calculate revenue from occupied machines based on machine types and duration
-        occupied_revenue = await get_revenue_from_occupied_machines(dealer_id)
-        
-        # Optional: Also calculate completed orders revenue for the month
-        thirty_days_ago = datetime.utcnow() - timedelta(days=30)
-        completed_revenue = 0.0
-        
-        try:
-            revenue_pipeline = [
-                {
-                    "$lookup": {
-                        "from": "machines",
-                        "localField": "machineID",
-                        "foreignField": "machineID",
-                        "as": "machine_data"
-                    }
-                },
-                {
-                    "$match": {
-                        "machine_data.dealerID": dealer_id,
-                        "status": "Completed",
-                        "updatedAt": {"$gte": thirty_days_ago}
-                    }
-                },
-                {
-                    "$group": {
-                        "_id": None,
-                        "total_revenue": {"$sum": "$estimatedCost"}
-                    }
-                }
-            ]
-            
-            revenue_result = await db.neworders.aggregate(revenue_pipeline).to_list(length=1)
-            completed_revenue = revenue_result[0]["total_revenue"] if revenue_result else 0.0
-        except:
-            # If orders collection doesn't work, skip completed revenue
-            completed_revenue = 0.0
+        return await cached_response(
+            request,
+            current_user,
+            [
+                dealer_tag(dealer_id, "machines"),
+                dealer_tag(dealer_id, "requests"),
+                dealer_tag(dealer_id, "orders")
+            ],
+            lambda: build_dashboard(dealer_id)
+        )
         
-        # Total revenue combines both streams
-        total_revenue = (occupied_revenue + completed_revenue) * 100
-        # ===== END NEW REVENUE CALCULATION =====
+    except HTTPException:
+        raise
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=f"Internal server error: {str(e)}")
 
-        # Get recent notifications/alerts (unchanged)
-        notifications = []
-        
-        # Check for machines needing maintenance
-        maintenance_machines = await db.machines.find({
-            "dealerID": dealer_id,
-            "status": "Maintenance"
-        }).to_list(length=5)
-        
-        for machine in maintenance_machines:
-            notifications.append({
-                "type": "maintenance",
-                "title": "Machine Maintenance Required",
-                "message": f"Machine {machine.get('machineID', 'Unknown')} requires maintenance",
-                "timestamp": datetime.utcnow(),
-                "priority": "high"
-            })
-        
-        # Check for pending requests
-        dealer_machines = await db.machines.find(
-            {"dealerID": dealer_id},
-            {"machineID": 1}
-        ).to_list(length=None)
-        machine_ids = [m["machineID"] for m in dealer_machines]
+@router.get("/revenue/snapshot", response_model=APIResponse)
+async def get_revenue_snapshot_endpoint(
+    current_user: dict = Depends(get_current_user),
+    refresh: bool = Query(False, description="Bypass the cached snapshot")
+):
+    """
+    Get the occupied-machine revenue snapshot with a per machine type breakdown
+    """
+    try:
+        if current_user["role"] != "admin":
+            raise HTTPException(status_code=403, detail="Admin access required")
         
-        pending_requests = await db.requests.find({
-            "machineID": {"$in": machine_ids},
-            "status": "In-Progress"
-        }).to_list(length=5)
+        snapshot = await get_revenue_snapshot(current_user["dealershipID"], refresh=refresh)
         
-        for request in pending_requests:
-            notifications.append({
-                "type": "request",
-                "title": f"{request.get('requestType', 'Unknown')} Request",
-                "message": f"New {request.get('requestType', 'request').lower()} request pending approval",
-                "timestamp": request.get('requestDate', datetime.utcnow()),
-                "priority": "medium"
-            })
+        return APIResponse(
+            success=True,
+            message="Revenue snapshot retrieved successfully",
+            data=snapshot
+        )
         
-        # Sort notifications by timestamp (newest first)
-        notifications.sort(key=lambda x: x['timestamp'], reverse=True)
+    except HTTPException:
+        raise
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=f"Internal server error: {str(e)}")
+
+@router.get("/compression/stats", response_model=APIResponse)
+async def get_compression_stats(current_user: dict = Depends(get_current_user)):
+    """
+    Get response compression counters and bytes saved since startup
+    """
+    if current_user["role"] != "admin":
+        raise HTTPException(status_code=403, detail="Admin access required")
+    
+    return APIResponse(
+        success=True,
+        message="Compression stats retrieved successfully",
+        data=compression.get_stats()
+    )
+
+@router.get("/ai-cache/stats", response_model=APIResponse)
+async def get_ai_cache_stats(current_user: dict = Depends(get_current_user)):
+    """
+    Get AI recommendation cache hit rate and size since startup
+    """
+    if current_user["role"] != "admin":
+        raise HTTPException(status_code=403, detail="Admin access required")
+    
+    return APIResponse(
+        success=True,
+        message="AI cache stats retrieved successfully",
+        data=ai_cache.get_stats()
+    )
+
+@router.get("/single-flight/stats", response_model=APIResponse)
+async def get_single_flight_stats(current_user: dict = Depends(get_current_user)):
+    """
+    Get per-operation counts of executed vs coalesced calls since startup
+    """
+    if current_user["role"] != "admin":
+        raise HTTPException(status_code=403, detail="Admin access required")
+    
+    return APIResponse(
+        success=True,
+        message="Single-flight stats retrieved successfully",
+        data=single_flight.get_stats()
+    )
+
+@router.post("/customer-recommendations/generate", response_model=APIResponse)
+async def generate_customer_recommendations_batch(current_user: dict = Depends(get_current_user)):
+    """
+    Generate recommendations for every customer of the dealership; AI
+    enrichment continues in the background
+    """
+    try:
+        if current_user["role"] != "admin":
+            raise HTTPException(status_code=403, detail="Admin access required")
         
-        dashboard_data = {
-            "total_machines": total_machines,
-            "active_orders": active_orders,
-            "revenue": total_revenue,  # This will now show real calculated revenue!
-            "notifications": notifications[:10]
-        }
+        dealer_id = current_user["dealershipID"]
+        summary = await single_flight.run(
+            "customer_recommendations_batch", dealer_id, None,
+            lambda: customer_recommendations.generate_for_dealer(dealer_id, wait_for_enrichment=False)
+        )
         
-        return APIResponse(
+        return api_response(
             success=True,
-            message="Dashboard data retrieved successfully",
-            data=dashboard_data
+            message=f"Generated recommendations for {summary['customers']} customers",
+            data=summary
         )
         
     except HTTPException:
         raise
+    except asyncio.TimeoutError:
+        raise HTTPException(status_code=504, detail="Customer recommendation batch timed out")
     except Exception as e:
         raise HTTPException(status_code=500, detail=f"Internal server error: {str(e)}")
 
+@router.get("/customer-recommendations/stats", response_model=APIResponse)
+async def get_customer_recommendation_batch_stats(current_user: dict = Depends(get_current_user)):
+    """
+    Get AI budget settings and the last batch run per dealership
+    """
+    if current_user["role"] != "admin":
+        raise HTTPException(status_code=403, detail="Admin access required")
+    
+    return api_response(
+        success=True,
+        message="Customer recommendation batch stats retrieved successfully",
+        data=customer_recommendations.get_stats()
+    )
+
+@router.get("/barcode/stats", response_model=APIResponse)
+async def get_barcode_stats(current_user: dict = Depends(get_current_user)):
+    """
+    Get barcode decoding counts and which fallback strategies succeeded
+    """
+    if current_user["role"] != "admin":
+        raise HTTPException(status_code=403, detail="Admin access required")
+    
+    return APIResponse(
+        success=True,
+        message="Barcode stats retrieved successfully",
+        data=barcode.get_stats()
+    )
+
 @router.get("/dashboard/stats", response_model=APIResponse)
 async def get_dashboard_stats(current_user: dict = Depends(get_current_user)):
     """
@@ -208,32 +294,14 @@ async def get_dashboard_stats(current_user: dict = Depends(get_current_user)):
         
         dealer_id = current_user["dealershipID"]
         
-        # Count machines by status
-        total_machines = await db.machines.count_documents({"dealerID": dealer_id})
-        active_machines = await db.machines.count_documents({
-            "dealerID": dealer_id,
-            "status": {"$in": ["Occupied", "In-transit"]}
-        })
-        maintenance_machines = await db.machines.count_documents({
-            "dealerID": dealer_id,
-            "status": "Maintenance"
-        })
-        ready_machines = await db.machines.count_documents({
-            "dealerID": dealer_id,
-            "status": "Ready"
-        })
-        
-        # Count pending requests
-        dealer_machines = await db.machines.find(
-            {"dealerID": dealer_id},
-            {"machineID": 1}
-        ).to_list(length=None)
-        machine_ids = [m["machineID"] for m in dealer_machines]
+        # Materialized counters, maintained on every machine/request write
+        dealer_stats = await get_dealer_stats(dealer_id)
         
-        pending_requests = await db.requests.count_documents({
-            "machineID": {"$in": machine_ids},
-            "status": "In-Progress"
-        })
+        total_machines = dealer_stats["total"]
+        active_machines = dealer_stats["active"]
+        maintenance_machines = dealer_stats["machines"].get("Maintenance", 0)
+        ready_machines = dealer_stats["machines"].get("Ready", 0)
+        pending_requests = dealer_stats["pending_requests"]
         
         stats = {
             "total_machines": total_machines,
@@ -289,41 +357,22 @@ async def get_recent_machines(current_user: dict = Depends(get_current_user)):
                 detail=f"Database query failed: {str(db_error)}"
             )
         
-        # Convert ObjectId to string and format data
-        formatted_machines = []
+        # Fill in missing timestamps and required fields
+        now = datetime.utcnow()
         for machine in machines:
-            try:
-                machine["_id"] = str(machine["_id"])
-                
-                # Safely handle datetime conversion
-                if "updatedAt" in machine:
-                    if isinstance(machine["updatedAt"], datetime):
-                        machine["updatedAt"] = machine["updatedAt"].isoformat()
-                    elif machine["updatedAt"] is None:
-                        machine["updatedAt"] = datetime.utcnow().isoformat()
-                
-                if "createdAt" in machine:
-                    if isinstance(machine["createdAt"], datetime):
-                        machine["createdAt"] = machine["createdAt"].isoformat()
-                    elif machine["createdAt"] is None:
-                        machine["createdAt"] = datetime.utcnow().isoformat()
-                
-                # Ensure required fields exist
-                machine.setdefault("machineID", "Unknown")
-                machine.setdefault("machineType", "Unknown")
-                machine.setdefault("status", "Unknown")
-                machine.setdefault("location", "Unknown")
-                
-                formatted_machines.append(machine)
-                
-            except Exception as format_error:
-                print(f"DEBUG: Error formatting machine {machine.get('_id', 'unknown')}: {str(format_error)}")
-                continue
+            for field in ("updatedAt", "createdAt"):
+                if field in machine and machine[field] is None:
+                    machine[field] = now
+            
+            machine.setdefault("machineID", "Unknown")
+            machine.setdefault("machineType", "Unknown")
+            machine.setdefault("status", "Unknown")
+            machine.setdefault("location", "Unknown")
         
-        return APIResponse(
+        return api_response(
             success=True,
-            message=f"Recent machines retrieved successfully. Found {len(formatted_machines)} machines.",
-            data={"machines": formatted_machines}
+            message=f"Recent machines retrieved successfully. Found {len(machines)} machines.",
+            data={"machines": machines}
         )
         
     except HTTPException:
@@ -357,7 +406,7 @@ async def get_recent_requests(current_user: dict = Depends(get_current_user)):
         machine_ids = [m["machineID"] for m in dealer_machines]
         
         if not machine_ids:
-            return APIResponse(
+            return api_response(
                 success=True,
                 message="No recent requests found",
                 data=[]
@@ -370,13 +419,7 @@ async def get_recent_requests(current_user: dict = Depends(get_current_user)):
         
         requests = await cursor.to_list(length=10)
         
-        # Convert ObjectId to string and format data
-        for request in requests:
-            request["_id"] = str(request["_id"])
-            if "requestDate" in request and isinstance(request["requestDate"], datetime):
-                request["requestDate"] = request["requestDate"].isoformat()
-        
-        return APIResponse(
+        return api_response(
             success=True,
             message="Recent requests retrieved successfully",
             data=requests
@@ -408,18 +451,10 @@ async def get_all_machines(
         cursor = db.machines.find(query).skip(skip).limit(limit).sort("updatedAt", -1)
         machines = await cursor.to_list(length=limit)
         
-        # Convert ObjectId to string and format dates
-        for machine in machines:
-            machine["_id"] = str(machine["_id"])
-            if "updatedAt" in machine and isinstance(machine["updatedAt"], datetime):
-                machine["updatedAt"] = machine["updatedAt"].isoformat()
-            if "createdAt" in machine and isinstance(machine["createdAt"], datetime):
-                machine["createdAt"] = machine["createdAt"].isoformat()
-        
         # Get total count for pagination
         total_count = await db.machines.count_documents(query)
         
-        return APIResponse(
+        return api_response(
             success=True,
             message=f"Found {len(machines)} machines",
             data={
@@ -461,7 +496,7 @@ async def get_all_requests(
         machine_ids = [m["machineID"] for m in dealer_machines]
         
         if not machine_ids:
-            return APIResponse(
+            return api_response(
                 success=True,
                 message="No requests found",
                 data={
@@ -483,16 +518,10 @@ async def get_all_requests(
         cursor = db.requests.find(query).skip(skip).limit(limit).sort("requestDate", -1)
         requests = await cursor.to_list(length=limit)
         
-        # Convert ObjectId to string and format dates
-        for request in requests:
-            request["_id"] = str(request["_id"])
-            if "requestDate" in request and isinstance(request["requestDate"], datetime):
-                request["requestDate"] = request["requestDate"].isoformat()
-        
         # Get total count for pagination
         total_count = await db.requests.count_documents(query)
         
-        return APIResponse(
+        return api_response(
             success=True,
             message=f"Found {len(requests)} requests",
             data={
@@ -536,14 +565,16 @@ async def update_request(
         if admin_comments:
             update_data["adminComments"] = admin_comments
         
-        result = await db.requests.update_one(
+        previous = await db.requests.find_one_and_update(
             {"requestID": request_id},
             {"$set": update_data}
         )
         
-        if result.matched_count == 0:
+        if not previous:
             raise HTTPException(status_code=404, detail="Request not found")
         
+        await emit_request_change(previous.get("machineID"), previous.get("status"), status, request_id)
+        
         return APIResponse(
             success=True,
             message=f"Request {status.lower()} successfully",
@@ -569,39 +600,16 @@ async def get_analytics(current_user: dict = Depends(get_current_user)):
         # Machine utilization over time (last 30 days)
         thirty_days_ago = datetime.utcnow() - timedelta(days=30)
         
-        # Monthly revenue trend
-        revenue_pipeline = [
-            {
-                "$lookup": {
-                    "from": "machines",
-                    "localField": "machineID",
-                    "foreignField": "machineID",
-                    "as": "machine_data"
-                }
-            },
-            {
-                "$match": {
-                    "machine_data.dealerID": dealer_id,
-                    "status": "Completed",
-                    "updatedAt": {"$gte": thirty_days_ago}
-                }
-            },
-            {
-                "$group": {
-                    "_id": {
-                        "year": {"$year": "$updatedAt"},
-                        "month": {"$month": "$updatedAt"},
-                        "day": {"$dayOfMonth": "$updatedAt"}
-                    },
-                    "daily_revenue": {"$sum": "$estimatedCost"},
-                    "orders_count": {"$sum": 1}
-                }
-            },
-            {"$sort": {"_id.year": 1, "_id.month": 1, "_id.day": 1}}
-        ]
-        
+        # Daily revenue trend from the pre-aggregated rollup
         try:
-            revenue_trend = await db.neworders.aggregate(revenue_pipeline).to_list(length=30)
+            revenue_trend = [
+                {
+                    "_id": {"year": day["_id"].year, "month": day["_id"].month, "day": day["_id"].day},
+                    "daily_revenue": day["daily_revenue"],
+                    "orders_count": day["orders_count"]
+                }
+                for day in await get_daily_revenue(dealer_id, thirty_days_ago)
+            ]
         except:
             revenue_trend = []
         
@@ -650,13 +658,12 @@ async def get_users(current_user: dict = Depends(get_current_user)):
         
         # Add default health score if missing
         for user in users:
-            user["_id"] = str(user["_id"])
             if user.get("health_score") is None:
                 user["health_score"] = 700
             if user.get("score_last_updated") is None:
                 user["score_last_updated"] = user.get("createdAt")
         
-        return APIResponse(
+        return api_response(
             success=True,
             message=f"Found {len(users)} users",
             data={"users": users}
@@ -1,4 +1,4 @@
-from fastapi import APIRouter, HTTPException, Depends, status
+from fastapi import APIRouter, HTTPException, Depends, Query, status
 from fastapi.security import HTTPBearer, HTTPAuthorizationCredentials
 from passlib.context import CryptContext
 from jose import JWTError, jwt
@@ -19,9 +19,13 @@ pwd_context = CryptContext(schemes=["bcrypt"], deprecated="auto")
 SECRET_KEY = config("SECRET_KEY")
 ALGORITHM = config("ALGORITHM", default="HS256")
 ACCESS_TOKEN_EXPIRE_MINUTES = int(config("ACCESS_TOKEN_EXPIRE_MINUTES", default="30"))
+# Lifetime of a Server-Sent Events ticket: long enough to open one connection
+STREAM_TICKET_EXPIRE_SECONDS = int(config("STREAM_TICKET_EXPIRE_SECONDS", default="60"))
+STREAM_SCOPE = "stream"
 
 # Security
 security = HTTPBearer()
+optional_security = HTTPBearer(auto_error=False)
 
 # MongoDB connection
 MONGODB_URL = config("MONGODB_URL")
@@ -57,24 +61,56 @@ async def authenticate_user(email: str, password: str):
     return user
 
 async def get_current_user(credentials: HTTPAuthorizationCredentials = Depends(security)):
+    return await get_user_from_token(credentials.credentials)
+
+async def get_stream_session(
+    credentials: Optional[HTTPAuthorizationCredentials] = Depends(optional_security),
+    ticket: Optional[str] = Query(None, description="Ticket from /api/auth/stream-ticket, for EventSource clients, which cannot send headers")
+) -> dict:
+    """
+    {"user", "expires_at"} from the Authorization header or a stream ticket;
+    the stream must end at expires_at, when the login behind it expires
+    """
+    if credentials is not None:
+        payload = decode_token(credentials.credentials)
+        return {"user": await _token_user(payload), "expires_at": datetime.utcfromtimestamp(payload["exp"])}
+    if ticket:
+        payload = decode_token(ticket, scope=STREAM_SCOPE)
+        return {"user": await _token_user(payload), "expires_at": datetime.utcfromtimestamp(payload["session_exp"])}
+    raise HTTPException(
+        status_code=status.HTTP_401_UNAUTHORIZED,
+        detail="Not authenticated",
+        headers={"WWW-Authenticate": "Bearer"},
+    )
+
+def decode_token(token: str, scope: Optional[str] = None) -> dict:
+    """Claims of a valid token; access tokens have no scope, stream tickets the stream scope"""
     credentials_exception = HTTPException(
         status_code=status.HTTP_401_UNAUTHORIZED,
         detail="Could not validate credentials",
         headers={"WWW-Authenticate": "Bearer"},
     )
     try:
-        payload = jwt.decode(credentials.credentials, SECRET_KEY, algorithms=[ALGORITHM])
-        email: str = payload.get("sub")
-        if email is None:
-            raise credentials_exception
+        payload = jwt.decode(token, SECRET_KEY, algorithms=[ALGORITHM])
     except JWTError:
         raise credentials_exception
-    
-    user = await get_user_by_email(email)
-    if user is None:
+    if payload.get("sub") is None or payload.get("scope") != scope:
         raise credentials_exception
+    return payload
+
+async def _token_user(payload: dict):
+    user = await get_user_by_email(payload["sub"])
+    if user is None:
+        raise HTTPException(
+            status_code=status.HTTP_401_UNAUTHORIZED,
+            detail="Could not validate credentials",
+            headers={"WWW-Authenticate": "Bearer"},
+        )
     return user
 
+async def get_user_from_token(token: str):
+    return await _token_user(decode_token(token))
+
 @router.post("/register", response_model=APIResponse)
 async def register_user(user_data: UserCreate):
     try:
@@ -176,6 +212,31 @@ async def login_user(user_credentials: UserLogin):
             detail=f"Internal server error: {str(e)}"
         )
 
+@router.post("/stream-ticket", response_model=APIResponse)
+async def create_stream_ticket(credentials: HTTPAuthorizationCredentials = Depends(security)):
+    """
+    Short-lived ticket that only opens event streams, so the bearer token
+    never appears in a URL (and in access logs or browser history)
+    """
+    payload = decode_token(credentials.credentials)
+    await _token_user(payload)
+    try:
+        ticket = create_access_token(
+            data={"sub": payload["sub"], "scope": STREAM_SCOPE, "session_exp": payload["exp"]},
+            expires_delta=timedelta(seconds=STREAM_TICKET_EXPIRE_SECONDS)
+        )
+        return APIResponse(
+            success=True,
+            message="Stream ticket issued",
+            data={"ticket": ticket, "expires_in": STREAM_TICKET_EXPIRE_SECONDS}
+        )
+        
+    except Exception as e:
+        raise HTTPException(
+            status_code=status.HTTP_500_INTERNAL_SERVER_ERROR,
+            detail=f"Internal server error: {str(e)}"
+        )
+
 @router.get("/me", response_model=APIResponse)
 async def get_current_user_info(current_user: dict = Depends(get_current_user)):
     try:
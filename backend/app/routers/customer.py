@@ -1,4 +1,5 @@
-from fastapi import APIRouter, HTTPException, Depends
+from fastapi import APIRouter, HTTPException, Depends, Request
+import asyncio
 import motor.motor_asyncio
 from decouple import config
 from datetime import datetime, timedelta
@@ -6,6 +7,13 @@ from typing import Optional
 
 from ..models.database import APIResponse, Recommendation
 from .auth import get_current_user
+from ..services.events import emit_request_change
+from ..services.serialization import api_response
+from ..services.response_cache import cached_response, invalidate, user_tag, MACHINE_TYPES_TAG
+from ..services.ai_recommendations import customer_insight
+from ..services.recommendation_rules import fleet_metrics, recommend
+from ..services.telemetry_rollup import get_machine_usage, with_usage
+from ..services.utilization import UTILIZATION_PROJECTION
 
 router = APIRouter()
 
@@ -14,40 +22,72 @@ MONGODB_URL = config("MONGODB_URL")
 client = motor.motor_asyncio.AsyncIOMotorClient(MONGODB_URL)
 db = client.caterpillar_db
 
+async def count_by_status(collection, user_id: str) -> dict:
+    """Documents of a customer tallied by status in one $group"""
+    groups = await collection.aggregate([
+        {"$match": {"userID": user_id}},
+        {"$group": {"_id": "$status", "count": {"$sum": 1}}}
+    ]).to_list(length=None)
+    return {group["_id"] or "Unknown": group["count"] for group in groups}
+
+async def get_request_facets(user_id: str, since: datetime) -> dict:
+    """Request counts by status and since a date in one round trip"""
+    result = await db.requests.aggregate([
+        {"$match": {"userID": user_id}},
+        {
+            "$facet": {
+                "by_status": [{"$group": {"_id": "$status", "count": {"$sum": 1}}}],
+                "recent": [{"$match": {"requestDate": {"$gte": since}}}, {"$count": "total"}]
+            }
+        }
+    ]).to_list(length=1)
+    
+    facet = result[0] if result else {}
+    recent = facet.get("recent", [])
+    return {
+        "status_counts": {group["_id"] or "Unknown": group["count"] for group in facet.get("by_status", [])},
+        "recent": recent[0]["total"] if recent else 0
+    }
+
+async def build_dashboard_stats(user_id: str) -> APIResponse:
+    """Machine, order and request counts for a customer"""
+    # One aggregation per collection, all fired concurrently
+    machine_counts, order_counts, request_counts = await asyncio.gather(
+        count_by_status(db.machines, user_id),
+        count_by_status(db.neworders, user_id),
+        count_by_status(db.requests, user_id)
+    )
+    
+    stats = {
+        "my_machines": sum(machine_counts.values()),
+        "active_orders": sum(order_counts.get(status, 0) for status in ["Pending", "Approved", "InProgress"]),
+        "pending_requests": request_counts.get("In-Progress", 0),
+        "completed_orders": order_counts.get("Completed", 0)
+    }
+    
+    return APIResponse(
+        success=True,
+        message="Customer dashboard stats retrieved successfully",
+        data=stats
+    )
+
 @router.get("/dashboard/stats", response_model=APIResponse)
-async def get_customer_dashboard_stats(current_user: dict = Depends(get_current_user)):
+async def get_customer_dashboard_stats(request: Request, current_user: dict = Depends(get_current_user)):
     try:
         if current_user["role"] != "customer":
             raise HTTPException(status_code=403, detail="Customer access required")
         
         user_id = current_user["userID"]
         
-        # Count user's machines
-        my_machines = await db.machines.count_documents({"userID": user_id})
-        active_orders = await db.neworders.count_documents({
-            "userID": user_id,
-            "status": {"$in": ["Pending", "Approved", "InProgress"]}
-        })
-        pending_requests = await db.requests.count_documents({
-            "userID": user_id,
-            "status": "In-Progress"
-        })
-        completed_orders = await db.neworders.count_documents({
-            "userID": user_id,
-            "status": "Completed"
-        })
-        
-        stats = {
-            "my_machines": my_machines,
-            "active_orders": active_orders,
-            "pending_requests": pending_requests,
-            "completed_orders": completed_orders
-        }
-        
-        return APIResponse(
-            success=True,
-            message="Customer dashboard stats retrieved successfully",
-            data=stats
+        return await cached_response(
+            request,
+            current_user,
+            [
+                user_tag(user_id, "machines"),
+                user_tag(user_id, "orders"),
+                user_tag(user_id, "requests")
+            ],
+            lambda: build_dashboard_stats(user_id)
         )
         
     except HTTPException:
@@ -73,14 +113,10 @@ async def get_my_machines(
         cursor = db.machines.find(query).skip(skip).limit(limit).sort("updatedAt", -1)
         machines = await cursor.to_list(length=limit)
         
-        # Convert ObjectId to string
-        for machine in machines:
-            machine["_id"] = str(machine["_id"])
-        
         # Get total count for pagination
         total_count = await db.machines.count_documents(query)
         
-        return APIResponse(
+        return api_response(
             success=True,
             message=f"Found {len(machines)} machines",
             data={
@@ -114,14 +150,10 @@ async def get_my_requests(
         cursor = db.requests.find(query).skip(skip).limit(limit).sort("requestDate", -1)
         requests = await cursor.to_list(length=limit)
         
-        # Convert ObjectId to string
-        for request in requests:
-            request["_id"] = str(request["_id"])
-        
         # Get total count for pagination
         total_count = await db.requests.count_documents(query)
         
-        return APIResponse(
+        return api_response(
             success=True,
             message=f"Found {len(requests)} requests",
             data={
@@ -184,6 +216,7 @@ async def create_request(
         }
         
         result = await db.requests.insert_one(new_request)
+        await emit_request_change(new_request["machineID"], None, new_request["status"], new_request["requestID"])
         
         return APIResponse(
             success=True,
@@ -204,61 +237,23 @@ async def get_recommendations(current_user: dict = Depends(get_current_user)):
         
         user_id = current_user["userID"]
         
-        # Get user's machines for analysis
-        user_machines = await db.machines.find({"userID": user_id}).to_list(length=None)
+        # Get user's machines and health score for analysis
+        user_machines, user = await asyncio.gather(
+            db.machines.find({"userID": user_id}, UTILIZATION_PROJECTION).to_list(length=None),
+            db.users.find_one({"userID": user_id}, {"health_score": 1})
+        )
+        usage = await get_machine_usage(m["machineID"] for m in user_machines)
+        user_machines = [with_usage(m, usage) for m in user_machines]
         
-        # Generate smart recommendations based on user's machine usage
-        recommendations = []
+        # Smart recommendations from the rules engine; no model call on this path
+        metrics = fleet_metrics(user_machines, user.get("health_score") if user else None)
+        recommendations = recommend(metrics, "customer")
         
+        # AI insight is included once generated in the background for these metrics
         if user_machines:
-            # Check for machines needing maintenance
-            maintenance_machines = [m for m in user_machines if m.get("status") == "Maintenance"]
-            if maintenance_machines:
-                recommendations.append({
-                    "type": "maintenance",
-                    "title": "Schedule Maintenance",
-                    "description": f"You have {len(maintenance_machines)} machine(s) requiring maintenance attention.",
-                    "priority": "high",
-                    "suggested_action": "Contact support to schedule maintenance"
-                })
-            
-            # Check for underutilized machines
-            ready_machines = [m for m in user_machines if m.get("status") == "Ready"]
-            if len(ready_machines) > 2:
-                recommendations.append({
-                    "type": "efficiency",
-                    "title": "Optimize Machine Usage",
-                    "description": f"You have {len(ready_machines)} machines in ready state that could be utilized.",
-                    "priority": "medium",
-                    "suggested_action": "Consider creating new work orders"
-                })
-            
-            # Cost optimization recommendation
-            recommendations.append({
-                "type": "cost_saving",
-                "title": "Reduce Transportation Costs",
-                "description": "Optimize your machine locations to reduce transportation costs by up to 15%.",
-                "priority": "low",
-                "suggested_action": "Review machine deployment locations"
-            })
-        else:
-            # Default recommendations for new users
-            recommendations.extend([
-                {
-                    "type": "getting_started",
-                    "title": "Get Started with CatRental",
-                    "description": "Create your first request to get machines assigned to your projects.",
-                    "priority": "medium",
-                    "suggested_action": "Create a new request"
-                },
-                {
-                    "type": "training",
-                    "title": "Training Resources",
-                    "description": "Access our training materials to maximize equipment efficiency.",
-                    "priority": "low",
-                    "suggested_action": "Visit the help center"
-                }
-            ])
+            insight = await customer_insight(user_id, user_machines, metrics)
+            if insight:
+                recommendations.insert(0, insight)
         
         return APIResponse(
             success=True,
@@ -289,14 +284,10 @@ async def get_my_orders(
         cursor = db.neworders.find(query).skip(skip).limit(limit).sort("orderDate", -1)
         orders = await cursor.to_list(length=limit)
         
-        # Convert ObjectId to string
-        for order in orders:
-            order["_id"] = str(order["_id"])
-        
         # Get total count for pagination
         total_count = await db.neworders.count_documents(query)
         
-        return APIResponse(
+        return api_response(
             success=True,
             message=f"Found {len(orders)} orders",
             data={
@@ -329,9 +320,7 @@ async def get_machine_details(
         if not machine:
             raise HTTPException(status_code=404, detail="Machine not found or access denied")
         
-        machine["_id"] = str(machine["_id"])
-        
-        return APIResponse(
+        return api_response(
             success=True,
             message="Machine details retrieved successfully",
             data=machine
@@ -422,6 +411,8 @@ async def cancel_request(
         if result.modified_count == 0:
             raise HTTPException(status_code=404, detail="Request not found or not cancelled")
         
+        await emit_request_change(request_doc.get("machineID"), request_doc["status"], "Cancelled", request_id)
+        
         return APIResponse(
             success=True,
             message="Request cancelled successfully",
@@ -447,9 +438,8 @@ async def get_customer_profile(current_user: dict = Depends(get_current_user)):
         
         # Remove sensitive information
         user.pop("password", None)
-        user["_id"] = str(user["_id"])
         
-        return APIResponse(
+        return api_response(
             success=True,
             message="Profile retrieved successfully",
             data=user
@@ -513,38 +503,29 @@ async def get_customer_analytics(current_user: dict = Depends(get_current_user))
         
         user_id = current_user["userID"]
         
-        # Get machine utilization data
-        machines = await db.machines.find({"userID": user_id}).to_list(length=None)
-        
-        # Calculate analytics
-        total_machines = len(machines)
-        status_breakdown = {}
-        for machine in machines:
-            status = machine.get("status", "Unknown")
-            status_breakdown[status] = status_breakdown.get(status, 0) + 1
-        
-        # Get request statistics
-        total_requests = await db.requests.count_documents({"userID": user_id})
-        approved_requests = await db.requests.count_documents({
-            "userID": user_id, 
-            "status": "Approved"
-        })
-        denied_requests = await db.requests.count_documents({
-            "userID": user_id, 
-            "status": "Denied"
-        })
+        thirty_days_ago = datetime.utcnow() - timedelta(days=30)
+        
+        # Status tallies for machines and requests, queried concurrently
+        status_breakdown, request_facets = await asyncio.gather(
+            count_by_status(db.machines, user_id),
+            get_request_facets(user_id, thirty_days_ago)
+        )
+        
+        total_machines = sum(status_breakdown.values())
+        
+        # Request statistics
+        request_counts = request_facets["status_counts"]
+        total_requests = sum(request_counts.values())
+        approved_requests = request_counts.get("Approved", 0)
+        denied_requests = request_counts.get("Denied", 0)
         
         # Calculate success rate
         success_rate = 0
         if total_requests > 0:
             success_rate = (approved_requests / total_requests) * 100
         
-        # Get recent activity (last 30 days)
-        thirty_days_ago = datetime.utcnow() - timedelta(days=30)
-        recent_requests = await db.requests.count_documents({
-            "userID": user_id,
-            "requestDate": {"$gte": thirty_days_ago}
-        })
+        # Recent activity (last 30 days)
+        recent_requests = request_facets["recent"]
         
         analytics = {
             "machine_stats": {
@@ -625,6 +606,7 @@ async def create_order(
         }
         
         result = await db.neworders.insert_one(new_order)
+        await invalidate(user_tag(current_user["userID"], "orders"))
         
         return APIResponse(
             success=True,
@@ -641,8 +623,44 @@ async def create_order(
     except Exception as e:
         raise HTTPException(status_code=500, detail=f"Internal server error: {str(e)}")
 
+async def build_machine_types() -> APIResponse:
+    """Machine types in the fleet merged with the standard catalogue"""
+    # Get unique machine types from machines collection
+    machine_types = await db.machines.distinct("machineType")
+    
+    # Common machine types that are available
+    common_machine_types = [
+        "Excavators",
+        "Bulldozers", 
+        "Wheel Loaders",
+        "Motor Graders",
+        "Articulated Trucks",
+        "Backhoe Loaders",
+        "Skid Steer Loaders",
+        "Track Loaders",
+        "Compactors",
+        "Road Reclaimers",
+        "Rock Trucks",
+        "Forestry Equipment",
+        "Mining Equipment",
+        "Agricultural Equipment"
+    ]
+    
+    # Combine and deduplicate
+    all_types = list(set(machine_types + common_machine_types))
+    all_types.sort()
+    
+    return APIResponse(
+        success=True,
+        message="Machine types retrieved successfully",
+        data={
+            "machine_types": all_types
+        }
+    )
+
 @router.get("/machine-types", response_model=APIResponse)
 async def get_available_machine_types(
+    request: Request,
     current_user: dict = Depends(get_current_user)
 ):
     """Get available machine types for orders"""
@@ -650,38 +668,7 @@ async def get_available_machine_types(
         if current_user["role"] != "customer":
             raise HTTPException(status_code=403, detail="Customer access required")
         
-        # Get unique machine types from machines collection
-        machine_types = await db.machines.distinct("machineType")
-        
-        # Common machine types that are available
-        common_machine_types = [
-            "Excavators",
-            "Bulldozers", 
-            "Wheel Loaders",
-            "Motor Graders",
-            "Articulated Trucks",
-            "Backhoe Loaders",
-            "Skid Steer Loaders",
-            "Track Loaders",
-            "Compactors",
-            "Road Reclaimers",
-            "Rock Trucks",
-            "Forestry Equipment",
-            "Mining Equipment",
-            "Agricultural Equipment"
-        ]
-        
-        # Combine and deduplicate
-        all_types = list(set(machine_types + common_machine_types))
-        all_types.sort()
-        
-        return APIResponse(
-            success=True,
-            message="Machine types retrieved successfully",
-            data={
-                "machine_types": all_types
-            }
-        )
+        return await cached_response(request, current_user, [MACHINE_TYPES_TAG], build_machine_types, shared=True)
         
     except HTTPException:
         raise
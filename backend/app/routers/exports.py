@@ -0,0 +1,199 @@
+from fastapi import APIRouter, HTTPException, Depends, Query
+from fastapi.responses import StreamingResponse
+import csv
+import io
+import motor.motor_asyncio
+from decouple import config
+from datetime import datetime
+from typing import Optional
+from bson import ObjectId
+from ..services.serialization import dumps
+from .auth import get_current_user
+
+router = APIRouter()
+
+# MongoDB connection
+MONGODB_URL = config("MONGODB_URL")
+client = motor.motor_asyncio.AsyncIOMotorClient(MONGODB_URL)
+db = client.caterpillar_db
+
+# Documents fetched per cursor round trip and rows written per response chunk
+EXPORT_BATCH_SIZE = int(config("EXPORT_BATCH_SIZE", default="500"))
+
+EXPORT_FORMATS = "^(ndjson|csv)$"
+
+MACHINE_COLUMNS = [
+    "_id", "machineID", "machineType", "status", "dealerID", "userID", "location", "siteID",
+    "engineHoursPerDay", "idleHours", "operatingDays", "checkInDate", "checkOutDate",
+    "createdAt", "updatedAt"
+]
+REQUEST_COLUMNS = [
+    "_id", "requestID", "requestType", "status", "machineID", "userID", "requestDate",
+    "comments", "adminComments", "updatedAt"
+]
+TRANSFER_COLUMNS = [
+    "_id", "transferID", "orderID", "machineID", "dealerID", "userID1", "userID2",
+    "location1", "location2", "status", "adminComments", "createdAt", "updatedAt"
+]
+CUSTOMER_COLUMNS = [
+    "_id", "userID", "name", "emailID", "health_score", "score_last_updated", "createdAt", "updatedAt"
+]
+
+def require_admin(current_user: dict):
+    if current_user["role"] != "admin":
+        raise HTTPException(status_code=403, detail="Admin access required")
+
+def resume_filter(query: dict, after: Optional[str]) -> dict:
+    """Continue an export after the last _id the client received"""
+    if after:
+        if not ObjectId.is_valid(after):
+            raise HTTPException(status_code=400, detail="Invalid 'after' cursor")
+        query["_id"] = {"$gt": ObjectId(after)}
+    return query
+
+def csv_value(value):
+    if value is None:
+        return ""
+    if isinstance(value, datetime):
+        return value.isoformat()
+    if isinstance(value, (dict, list)):
+        return dumps(value).decode()
+    return str(getattr(value, "value", value))
+
+async def stream_rows(cursor, export_format: str, columns: list):
+    """Yield NDJSON lines or CSV rows in chunks of EXPORT_BATCH_SIZE documents"""
+    buffer = io.StringIO()
+    writer = csv.writer(buffer)
+    lines = []
+    pending = 0
+
+    if export_format == "csv":
+        writer.writerow(columns)
+
+    try:
+        async for doc in cursor:
+            if export_format == "csv":
+                writer.writerow([csv_value(doc.get(column)) for column in columns])
+            else:
+                lines.append(dumps(doc))
+            pending += 1
+
+            if pending >= EXPORT_BATCH_SIZE:
+                yield flush_chunk(buffer, lines)
+                pending = 0
+
+        yield flush_chunk(buffer, lines)
+    except Exception as e:
+        # Headers are already sent: re-raising aborts the connection so the
+        # truncated export is not mistaken for a complete one; the client
+        # resumes from the last _id it got
+        print(f"Export stream interrupted: {str(e)}")
+        raise
+    finally:
+        await cursor.close()
+
+def flush_chunk(buffer: io.StringIO, lines: list) -> bytes:
+    """Drain the buffered CSV text or NDJSON lines"""
+    if lines:
+        data = b"\n".join(lines) + b"\n"
+        lines.clear()
+        return data
+    data = buffer.getvalue().encode()
+    buffer.seek(0)
+    buffer.truncate()
+    return data
+
+def export_response(collection, query: dict, projection: Optional[dict], export_format: str, columns: list, name: str):
+    cursor = collection.find(query, projection).sort("_id", 1).batch_size(EXPORT_BATCH_SIZE)
+    media_type = "text/csv" if export_format == "csv" else "application/x-ndjson"
+    filename = f"{name}-{datetime.utcnow().strftime('%Y%m%d%H%M%S')}.{export_format}"
+    return StreamingResponse(
+        stream_rows(cursor, export_format, columns),
+        media_type=media_type,
+        headers={"Content-Disposition": f'attachment; filename="{filename}"'}
+    )
+
+@router.get("/machines")
+async def export_machines(
+    current_user: dict = Depends(get_current_user),
+    format: str = Query("ndjson", pattern=EXPORT_FORMATS),
+    status: Optional[str] = Query(None, description="Filter by machine status"),
+    machine_type: Optional[str] = Query(None, description="Filter by machine type"),
+    updated_since: Optional[datetime] = Query(None, description="Only machines updated at or after this time"),
+    after: Optional[str] = Query(None, description="Resume after this _id")
+):
+    """
+    Stream the dealer's fleet as NDJSON or CSV
+    """
+    require_admin(current_user)
+
+    query = {"dealerID": current_user["dealershipID"]}
+    if status:
+        query["status"] = status
+    if machine_type:
+        query["machineType"] = machine_type
+    if updated_since:
+        query["updatedAt"] = {"$gte": updated_since}
+
+    return export_response(db.machines, resume_filter(query, after), None, format, MACHINE_COLUMNS, "machines")
+
+@router.get("/requests")
+async def export_requests(
+    current_user: dict = Depends(get_current_user),
+    format: str = Query("ndjson", pattern=EXPORT_FORMATS),
+    status: Optional[str] = Query(None, description="Filter by request status"),
+    request_type: Optional[str] = Query(None, description="Filter by request type"),
+    since: Optional[datetime] = Query(None, description="Only requests made at or after this time"),
+    after: Optional[str] = Query(None, description="Resume after this _id")
+):
+    """
+    Stream requests for the dealer's machines as NDJSON or CSV
+    """
+    require_admin(current_user)
+
+    machine_ids = await db.machines.distinct("machineID", {"dealerID": current_user["dealershipID"]})
+
+    query = {"machineID": {"$in": machine_ids}}
+    if status:
+        query["status"] = status
+    if request_type:
+        query["requestType"] = request_type
+    if since:
+        query["requestDate"] = {"$gte": since}
+
+    return export_response(db.requests, resume_filter(query, after), None, format, REQUEST_COLUMNS, "requests")
+
+@router.get("/transfers")
+async def export_transfers(
+    current_user: dict = Depends(get_current_user),
+    format: str = Query("ndjson", pattern=EXPORT_FORMATS),
+    status: Optional[str] = Query(None, description="Filter by transfer status"),
+    since: Optional[datetime] = Query(None, description="Only transfers created at or after this time"),
+    after: Optional[str] = Query(None, description="Resume after this _id")
+):
+    """
+    Stream the dealer's transfers as NDJSON or CSV
+    """
+    require_admin(current_user)
+
+    query = {"dealerID": current_user["dealershipID"]}
+    if status:
+        query["status"] = status
+    if since:
+        query["createdAt"] = {"$gte": since}
+
+    return export_response(db.transfers, resume_filter(query, after), None, format, TRANSFER_COLUMNS, "transfers")
+
+@router.get("/customers")
+async def export_customers(
+    current_user: dict = Depends(get_current_user),
+    format: str = Query("ndjson", pattern=EXPORT_FORMATS),
+    after: Optional[str] = Query(None, description="Resume after this _id")
+):
+    """
+    Stream customer accounts (without credentials) as NDJSON or CSV
+    """
+    require_admin(current_user)
+
+    query = resume_filter({"role": "customer"}, after)
+    return export_response(db.users, query, {"password": 0, "password_hash": 0}, format, CUSTOMER_COLUMNS, "customers")
@@ -1,10 +1,14 @@
-from fastapi import APIRouter, HTTPException, Depends
+from fastapi import APIRouter, HTTPException, Depends, Query
 import motor.motor_asyncio
 from decouple import config
-from datetime import datetime
-from typing import List
+from datetime import datetime, timedelta, timezone
+from typing import List, Optional
 from ..models.database import APIResponse, HealthScoreUpdate, HealthScoreResponse
 from .auth import get_current_user
+from ..services.serialization import api_response
+from ..services.health_scoring import apply_score_update, get_user_utilization
+from ..services.utilization import fleet_stats, RATIO, UTILIZATION_PROJECTION
+from ..services.health_history import get_history, GRANULARITIES
 
 router = APIRouter()
 
@@ -13,10 +17,11 @@ MONGODB_URL = config("MONGODB_URL")
 client = motor.motor_asyncio.AsyncIOMotorClient(MONGODB_URL)
 db = client.caterpillar_db
 
-# Scoring parameters
-BASE_SCORE = 700
-MAX_SCORE = 850
-MIN_SCORE = 300
+def to_naive_utc(value: Optional[datetime]) -> Optional[datetime]:
+    """Stored timestamps are naive UTC; convert tz-aware query values to match"""
+    if value is not None and value.tzinfo is not None:
+        return value.astimezone(timezone.utc).replace(tzinfo=None)
+    return value
 
 def get_score_category(score: int) -> str:
     """Convert numeric score to category"""
@@ -60,88 +65,37 @@ async def calculate_user_health_score(
         raise HTTPException(status_code=403, detail="Admin access required")
     
     # Step 1: Find all machines currently occupied by the user
-    user_machines_cursor = db.machines.find({
-        "userID": user_id,
-        "status": "Occupied"
-    })
-    user_machines = await user_machines_cursor.to_list(length=None)
+    user_machines = await db.machines.find(
+        {"userID": user_id, "status": "Occupied"},
+        UTILIZATION_PROJECTION
+    ).to_list(length=None)
     
     if not user_machines:
         raise HTTPException(status_code=404, detail="No occupied machines found for this user to calculate a score.")
     
-    # Step 2: Calculate the utilization for each machine and find the average
-    utilization_percentages = []
-    machine_ids = []
-    
-    for machine in user_machines:
-        machine_ids.append(machine["machineID"])
-        engine_hours = machine.get("engineHoursPerDay", 0.0)
-        idle_hours = machine.get("idleHours", 0.0)
-        total_hours = engine_hours + idle_hours
-        
-        if total_hours > 0:
-            utilization = (engine_hours / total_hours) * 100
-            utilization_percentages.append(utilization)
-    
-    if not utilization_percentages:
+    # Step 2: Average the utilization of machines with usage data
+    stats = fleet_stats(user_machines, RATIO)
+    machine_ids = [machine["machineID"] for machine in user_machines]
+    
+    if not stats["scored_count"]:
         return APIResponse(
             success=False,
             message="Could not calculate score: no usage data on occupied machines."
         )
     
-    average_utilization = sum(utilization_percentages) / len(utilization_percentages)
+    average_utilization = stats["mean"]
     
-    # Step 3: Find the user to get their current score
-    user = await db.users.find_one({"userID": user_id})
-    if not user:
-        raise HTTPException(status_code=404, detail="User not found")
-    
-    current_score = user.get("health_score", BASE_SCORE)
-    
-    # Step 4: Calculate the new score based on the average utilization
-    delta = 0
-    reason = ""
-    
-    if 10 <= average_utilization <= 80:
-        delta = 5
-        reason = f"Good utilization ({average_utilization:.1f}%) - score increased"
-    elif average_utilization < 10:
-        delta = -2
-        reason = f"Low utilization ({average_utilization:.1f}%) - score decreased slightly"
-    else:  # average_utilization > 80
-        delta = -8
-        reason = f"High utilization ({average_utilization:.1f}%) - risk of overuse, score decreased"
-    
-    new_score = max(MIN_SCORE, min(MAX_SCORE, current_score + delta))
-    
-    # Step 5: Update the user's document in the database
-    result = await db.users.update_one(
-        {"userID": user_id},
-        {
-            "$set": {
-                "health_score": new_score,
-                "score_last_updated": datetime.utcnow()
-            }
-        }
+    # Step 3: Apply the score change and log it
+    score_update_log = await apply_score_update(
+        user_id, average_utilization, machine_ids, current_user["userID"]
     )
+    if not score_update_log:
+        raise HTTPException(status_code=404, detail="User not found")
     
-    if result.modified_count == 0:
-        raise HTTPException(status_code=500, detail="Failed to update user score.")
-    
-    # Step 6: Log the score change
-    score_update_log = {
-        "user_id": user_id,
-        "old_score": current_score,
-        "new_score": new_score,
-        "delta": delta,
-        "reason": reason,
-        "average_utilization": average_utilization,
-        "affected_machines": machine_ids,
-        "updated_by": current_user["userID"],
-        "timestamp": datetime.utcnow()
-    }
-    
-    await db.health_score_logs.insert_one(score_update_log)
+    current_score = score_update_log["old_score"]
+    new_score = score_update_log["new_score"]
+    delta = score_update_log["delta"]
+    reason = score_update_log["reason"]
     
     return APIResponse(
         success=True,
@@ -176,24 +130,9 @@ async def get_user_health_score(
     current_score = user.get("health_score", 700) or 700
     last_updated = user.get("score_last_updated") or user.get("createdAt")
     
-    # Get recent utilization for recommendations
-    user_machines = await db.machines.find({
-        "userID": user_id,
-        "status": "Occupied"
-    }).to_list(length=None)
-    
-    avg_utilization = 0.0
-    if user_machines:
-        utilizations = []
-        for machine in user_machines:
-            engine_hours = machine.get("engineHoursPerDay", 0.0)
-            idle_hours = machine.get("idleHours", 0.0)
-            total_hours = engine_hours + idle_hours
-            if total_hours > 0:
-                utilizations.append((engine_hours / total_hours) * 100)
-        
-        if utilizations:
-            avg_utilization = sum(utilizations) / len(utilizations)
+    # Precomputed utilization, kept current by machine change events
+    utilization = await get_user_utilization(user_id)
+    avg_utilization = utilization["average_utilization"]
     
     return APIResponse(
         success=True,
@@ -205,7 +144,7 @@ async def get_user_health_score(
             "category": get_score_category(current_score),
             "last_updated": last_updated,
             "current_utilization": round(avg_utilization, 2),
-            "active_machines": len(user_machines),
+            "active_machines": utilization["active_machines"],
             "recommendations": get_score_recommendations(current_score, avg_utilization)
         }
     )
@@ -225,12 +164,37 @@ async def get_score_history(
         {"user_id": user_id}
     ).sort("timestamp", -1).limit(limit).to_list(length=limit)
     
-    # Convert ObjectId to string
-    for log in logs:
-        log["_id"] = str(log["_id"])
-    
-    return APIResponse(
+    return api_response(
         success=True,
         message=f"Found {len(logs)} score history entries",
         data={"logs": logs, "user_id": user_id}
-    )
\ No newline at end of file
+    )
+
+@router.get("/history/{user_id}", response_model=APIResponse)
+async def get_score_history_series(
+    user_id: str,
+    current_user: dict = Depends(get_current_user),
+    start: Optional[datetime] = Query(None, description="Range start (defaults to one year ago)"),
+    end: Optional[datetime] = Query(None, description="Range end (defaults to now)"),
+    granularity: str = Query("auto", description="auto, raw, day, week or month")
+):
+    """Get a downsampled health score series for charting"""
+    
+    if current_user.get("role") != "admin" and current_user.get("userID") != user_id:
+        raise HTTPException(status_code=403, detail="Access denied")
+    
+    if granularity not in GRANULARITIES:
+        raise HTTPException(status_code=400, detail=f"Invalid granularity. Must be one of: {GRANULARITIES}")
+    
+    end = to_naive_utc(end) or datetime.utcnow()
+    start = to_naive_utc(start) or end - timedelta(days=365)
+    if start >= end:
+        raise HTTPException(status_code=400, detail="Range start must be before range end")
+    
+    history = await get_history(user_id, start, end, granularity)
+    
+    return APIResponse(
+        success=True,
+        message=f"Found {len(history['points'])} score history points",
+        data=history
+    )
@@ -1,9 +1,10 @@
-from fastapi import APIRouter, HTTPException, Depends, UploadFile, File, Form
+from fastapi import APIRouter, HTTPException, Depends, UploadFile, File, Form, Request
+from fastapi.responses import StreamingResponse
 from typing import List, Optional
+import asyncio
 import motor.motor_asyncio
 from decouple import config
 from datetime import datetime
-import uuid
 import os
 
 from ..models.database import (
@@ -11,6 +12,9 @@ from ..models.database import (
     BarcodeData, MachineStatus
 )
 from .auth import get_current_user
+from ..services.events import emit_machine_change
+from ..services.serialization import api_response, dumps
+from ..services import barcode, scan_uploads
 
 router = APIRouter()
 
@@ -55,6 +59,7 @@ async def create_machine(
         result = await db.machines.insert_one(machine_doc)
         
         if result.inserted_id:
+            await emit_machine_change(None, machine_doc)
             return APIResponse(
                 success=True,
                 message="Machine created successfully",
@@ -68,6 +73,130 @@ async def create_machine(
     except Exception as e:
         raise HTTPException(status_code=500, detail=f"Internal server error: {str(e)}")
 
+def parse_symbols(symbols: list) -> list:
+    """(symbol, BarcodeData fields) for each distinct decoded payload naming a machine"""
+    parsed = []
+    seen = set()
+    for symbol in symbols:
+        if symbol["data"] in seen:
+            continue
+        seen.add(symbol["data"])
+        fields = barcode.parse_payload(symbol["data"])
+        if fields.get("machine_id"):
+            parsed.append((symbol, fields))
+    return parsed
+
+async def lookup_machines(machine_ids) -> dict:
+    """Machines already on record, by machineID, in one $in query"""
+    return {
+        machine["machineID"]: machine
+        async for machine in db.machines.find(
+            {"machineID": {"$in": list(set(machine_ids))}},
+            {"_id": 0, "machineID": 1, "machineType": 1, "status": 1, "userID": 1}
+        )
+    }
+
+def barcode_result(symbol: dict, fields: dict, machine: Optional[dict]) -> dict:
+    """BarcodeData for one symbol, filling gaps from the machine on record"""
+    if not fields.get("machine_type"):
+        fields = {**fields, "machine_type": machine["machineType"] if machine else "Unknown"}
+    return {
+        **BarcodeData(**fields).model_dump(),
+        "raw": symbol["data"],
+        "symbology": symbol["symbology"],
+        "existing_machine": machine is not None
+    }
+
+async def resolve_barcodes(symbols: list) -> list:
+    """BarcodeData for decoded symbols, filling gaps from machines already on record"""
+    parsed = parse_symbols(symbols)
+    known = await lookup_machines(fields["machine_id"] for _, fields in parsed)
+    return [barcode_result(symbol, fields, known.get(fields["machine_id"])) for symbol, fields in parsed]
+
+async def decode_upload(index: int, filename: str, content_type: str, data: bytes) -> dict:
+    """Outcome of decoding one image of a batch scan"""
+    outcome = {"index": index, "filename": filename, "status": "error"}
+    if not content_type.startswith("image/"):
+        return {**outcome, "error": "File must be an image"}
+    try:
+        result = await barcode.decode(data)
+    except barcode.BarcodeImageError as e:
+        return {**outcome, "error": str(e)}
+    except Exception as e:
+        return {**outcome, "error": f"Decoding failed: {str(e)}"}
+    
+    parsed = parse_symbols(result["symbols"])
+    return {
+        **outcome,
+        "status": "decoded" if parsed else "not_found",
+        "strategy": result["strategy"],
+        "stage": result["stage"],
+        "timings_ms": result["timings_ms"],
+        "parsed": parsed
+    }
+
+async def stream_scan_results(tasks: list):
+    """
+    Yield one NDJSON line per image as its decode finishes, then a summary
+    resolving every found machine ID with a single lookup
+    """
+    outcomes = []
+    try:
+        for next_done in asyncio.as_completed(tasks):
+            outcome = await next_done
+            outcomes.append(outcome)
+            yield dumps({
+                "type": "image",
+                "index": outcome["index"],
+                "filename": outcome["filename"],
+                "status": outcome["status"],
+                "strategy": outcome.get("strategy"),
+                "stage": outcome.get("stage"),
+                "timings_ms": outcome.get("timings_ms"),
+                "error": outcome.get("error"),
+                "barcodes": [
+                    {**fields, "raw": symbol["data"], "symbology": symbol["symbology"]}
+                    for symbol, fields in outcome.get("parsed", [])
+                ]
+            }) + b"\n"
+        
+        outcomes.sort(key=lambda outcome: outcome["index"])
+        known = await lookup_machines(
+            fields["machine_id"] for outcome in outcomes for _, fields in outcome.get("parsed", [])
+        )
+        machines = {}
+        for outcome in outcomes:
+            for symbol, fields in outcome.get("parsed", []):
+                machine = known.get(fields["machine_id"])
+                entry = machines.get(fields["machine_id"])
+                if entry is None:
+                    entry = machines[fields["machine_id"]] = {
+                        **barcode_result(symbol, fields, machine),
+                        "status": machine.get("status") if machine else None,
+                        "images": []
+                    }
+                entry["images"].append(outcome["index"])
+        
+        statuses = [outcome["status"] for outcome in outcomes]
+        yield dumps({
+            "type": "summary",
+            "images": len(outcomes),
+            "decoded": statuses.count("decoded"),
+            "not_found": statuses.count("not_found"),
+            "errors": statuses.count("error"),
+            "machines": list(machines.values()),
+            "unknown_machine_ids": [
+                machine_id for machine_id, entry in machines.items() if not entry["existing_machine"]
+            ]
+        }) + b"\n"
+    except Exception as e:
+        # Headers are already sent; report the failure in-band
+        print(f"Batch scan stream interrupted: {str(e)}")
+        yield dumps({"type": "error", "error": str(e)}) + b"\n"
+    finally:
+        for task in tasks:
+            task.cancel()
+
 @router.post("/scan-barcode", response_model=APIResponse)
 async def scan_barcode(
     file: UploadFile = File(...),
@@ -82,22 +211,34 @@ async def scan_barcode(
         if not file.content_type.startswith('image/'):
             raise HTTPException(status_code=400, detail="File must be an image")
         
-        # For now, return a placeholder response until we fix the OpenCV issue
-        # TODO: Implement barcode scanning once dependencies are resolved
+        data = await file.read()
+        if len(data) > barcode.BARCODE_MAX_BYTES:
+            raise HTTPException(status_code=413, detail="Image is too large")
         
-        # Mock barcode data for testing
-        barcode_info = {
-            "machine_id": f"CAT-MOCK-{uuid.uuid4().hex[:8].upper()}",
-            "machine_type": "Caterpillar Excavator",
-            "manufacturer": "CAT",
-            "model": "320",
-            "year": "2024"
-        }
+        try:
+            result = await barcode.decode(data)
+        except barcode.BarcodeImageError as e:
+            raise HTTPException(status_code=400, detail=str(e))
+        
+        if not result["symbols"]:
+            return APIResponse(
+                success=False,
+                message="No barcode found in the image. Please try a clearer image.",
+                data={"barcodes": [], "timings_ms": result["timings_ms"]}
+            )
+        
+        barcodes = await resolve_barcodes(result["symbols"])
         
         return APIResponse(
             success=True,
-            message="Barcode scanning temporarily disabled - using mock data",
-            data={"barcodes": [barcode_info]}
+            message=f"Decoded {len(barcodes)} barcode(s)",
+            data={
+                "barcodes": barcodes,
+                "strategy": result["strategy"],
+                "stage": result["stage"],
+                "decoder": result["decoder"],
+                "timings_ms": result["timings_ms"]
+            }
         )
         
     except HTTPException:
@@ -105,6 +246,50 @@ async def scan_barcode(
     except Exception as e:
         raise HTTPException(status_code=500, detail=f"Internal server error: {str(e)}")
 
+@router.post("/scan-barcodes")
+async def scan_barcodes(request: Request, current_user: dict = Depends(get_current_user)):
+    """
+    Scan many images in one upload (multipart/form-data with any number of
+    files, or a zip archive). Images are decoded while later ones are still
+    uploading; outcomes stream back as NDJSON, one line per image in
+    completion order, followed by a summary line with the resolved machines.
+    """
+    if current_user["role"] != "admin":
+        raise HTTPException(status_code=403, detail="Only admins can scan barcodes")
+    
+    content_type = request.headers.get("content-type", "")
+    if content_type.startswith("multipart/form-data"):
+        images = scan_uploads.multipart_images(request.stream(), content_type)
+    elif content_type.split(";")[0].strip() in scan_uploads.ZIP_CONTENT_TYPES:
+        images = scan_uploads.zip_images(request.stream())
+    else:
+        raise HTTPException(status_code=415, detail="Upload multipart/form-data images or a zip archive")
+    
+    # Each image goes to the decode pool as soon as it has arrived. The body
+    # is fully read before responding: the response stream listens on the
+    # same channel for client disconnects.
+    tasks = []
+    try:
+        async for filename, image_type, data in images:
+            tasks.append(asyncio.create_task(decode_upload(len(tasks), filename, image_type, data)))
+    except scan_uploads.UploadError as e:
+        for task in tasks:
+            task.cancel()
+        raise HTTPException(status_code=400, detail=str(e))
+    except Exception as e:
+        for task in tasks:
+            task.cancel()
+        raise HTTPException(status_code=500, detail=f"Internal server error: {str(e)}")
+    
+    if not tasks:
+        raise HTTPException(status_code=400, detail="No images uploaded")
+    
+    return StreamingResponse(
+        stream_scan_results(tasks),
+        media_type="application/x-ndjson",
+        headers={"X-Image-Count": str(len(tasks))}
+    )
+
 @router.get("/", response_model=APIResponse)
 async def get_machines(
     status: Optional[str] = None,
@@ -129,16 +314,10 @@ async def get_machines(
         cursor = db.machines.find(query).sort("updatedAt", -1)
         machines = await cursor.to_list(length=100)
         
-        # Convert ObjectId to string and format response
-        machines_data = []
-        for machine in machines:
-            machine["_id"] = str(machine["_id"])
-            machines_data.append(machine)
-        
-        return APIResponse(
+        return api_response(
             success=True,
-            message=f"Found {len(machines_data)} machines",
-            data={"machines": machines_data}
+            message=f"Found {len(machines)} machines",
+            data={"machines": machines}
         )
         
     except Exception as e:
@@ -163,9 +342,7 @@ async def get_machine(
         if not machine:
             raise HTTPException(status_code=404, detail="Machine not found")
         
-        machine["_id"] = str(machine["_id"])
-        
-        return APIResponse(
+        return api_response(
             success=True,
             message="Machine retrieved successfully",
             data={"machine": machine}
@@ -220,6 +397,7 @@ async def update_machine(
         )
         
         if result.modified_count:
+            await emit_machine_change(machine, {**machine, **update_data})
             return APIResponse(
                 success=True,
                 message="Machine updated successfully"
@@ -264,6 +442,7 @@ async def delete_machine(
         result = await db.machines.delete_one(query)
         
         if result.deleted_count:
+            await emit_machine_change(machine, None)
             return APIResponse(
                 success=True,
                 message="Machine deleted successfully"
@@ -318,6 +497,7 @@ async def assign_machine(
         result = await db.machines.update_one(query, {"$set": update_data})
         
         if result.modified_count:
+            await emit_machine_change(machine, {**machine, **update_data})
             return APIResponse(
                 success=True,
                 message="Machine assigned successfully"
@@ -5,8 +5,12 @@ from datetime import datetime
 from bson import ObjectId
 from math import radians, sin, cos, sqrt, atan2
 from typing import List
-from ..models.database import APIResponse, NewOrderForm, TransferStatus, UserRole
+from pymongo import ReturnDocument
+from ..models.database import APIResponse, NewOrderForm, TransferStatus, UserRole, OrderStatus
 from .auth import get_current_user
+from ..services.events import emit_machine_change
+from ..services.response_cache import invalidate, dealer_tag, user_tag
+from ..services.revenue import calculate_machine_revenue, calculate_occupied_duration, record_completed_order
 
 router = APIRouter()
 
@@ -58,6 +62,7 @@ async def place_order_and_create_transfers(
     
     inserted_order = await db.neworders.insert_one(order_doc)
     order_id = inserted_order.inserted_id
+    await invalidate(user_tag(current_user["userID"], "orders"))
     
     # Find available machines
     available_machines = await db.machines.find({
@@ -163,27 +168,30 @@ async def approve_transfer_request(
         raise HTTPException(status_code=404, detail="Original order not found")
     
     # Atomically update the machine if it's still "Ready"
-    result = await db.machines.update_one(
+    machine_update = {
+        "status": "In-transit",
+        "userID": transfer["userID2"],
+        "checkInDate": order["checkInDate"],
+        "checkOutDate": order["checkOutDate"],
+        "location": f"{transfer['location2']['lat']}, {transfer['location2']['lon']}",
+        "engineHoursPerDay": 0.0,
+        "idleHours": 0.0,
+        "operatingDays": 0,
+        "updatedAt": datetime.utcnow()
+    }
+    machine = await db.machines.find_one_and_update(
         {"machineID": transfer["machineID"], "status": "Ready"},
-        {"$set": {
-            "status": "In-transit",
-            "userID": transfer["userID2"],
-            "checkInDate": order["checkInDate"],
-            "checkOutDate": order["checkOutDate"],
-            "location": f"{transfer['location2']['lat']}, {transfer['location2']['lon']}",
-            "engineHoursPerDay": 0.0,
-            "idleHours": 0.0,
-            "operatingDays": 0,
-            "updatedAt": datetime.utcnow()
-        }}
+        {"$set": machine_update}
     )
     
-    if result.modified_count == 0:
+    if not machine:
         raise HTTPException(
             status_code=409, 
             detail="Machine is no longer available. It may have been allocated to another order."
         )
     
+    await emit_machine_change(machine, {**machine, **machine_update})
+    
     # Update the transfer request status to "approved"
     await db.transfers.update_one(
         {"transferID": transfer_id},
@@ -239,4 +247,77 @@ async def decline_transfer_request(
         success=True,
         message="Transfer request declined.",
         data={"transfer_id": transfer_id, "reason": reason}
-    )
\ No newline at end of file
+    )
+
+@router.patch("/{order_id}/complete", response_model=APIResponse)
+async def complete_order(
+    order_id: str,
+    current_user: dict = Depends(get_current_user)
+):
+    """Complete an approved order, bill it and release its machine"""
+    
+    if current_user["role"] != UserRole.ADMIN.value:
+        raise HTTPException(status_code=403, detail="Only admins can complete orders")
+    
+    order_filter = {"orderID": order_id}
+    if ObjectId.is_valid(order_id):
+        order_filter = {"$or": [order_filter, {"_id": ObjectId(order_id)}]}
+    
+    order = await db.neworders.find_one(order_filter)
+    if not order:
+        raise HTTPException(status_code=404, detail="Order not found")
+    
+    if order["status"] != OrderStatus.APPROVED.value:
+        raise HTTPException(status_code=400, detail=f"Order is {order['status']}, only approved orders can be completed")
+    
+    machine_id = order.get("assignedMachineID") or order.get("machineID")
+    machine = await db.machines.find_one({"machineID": machine_id}) if machine_id else None
+    if not machine:
+        raise HTTPException(status_code=404, detail="Assigned machine not found")
+    
+    if machine["dealerID"] != current_user["dealershipID"]:
+        raise HTTPException(status_code=403, detail="Not authorized to complete this order")
+    
+    completed_at = datetime.utcnow()
+    duration_hours = calculate_occupied_duration(order.get("checkInDate") or order["createdAt"], completed_at)
+    estimated_cost = round(calculate_machine_revenue(order.get("machineType") or machine.get("machineType"), max(duration_hours, 0)), 2)
+    
+    # Only one caller can move the order out of Approved, so revenue is counted once
+    completed_order = await db.neworders.find_one_and_update(
+        {"_id": order["_id"], "status": OrderStatus.APPROVED.value},
+        {"$set": {
+            "status": OrderStatus.COMPLETED.value,
+            "dealerID": machine["dealerID"],
+            "estimatedCost": estimated_cost,
+            "completedAt": completed_at,
+            "updatedAt": completed_at
+        }},
+        return_document=ReturnDocument.AFTER
+    )
+    if not completed_order:
+        raise HTTPException(status_code=409, detail="Order was updated by another request")
+    
+    await record_completed_order(completed_order)
+    await invalidate(user_tag(completed_order.get("userID"), "orders"), dealer_tag(machine["dealerID"], "orders"))
+    
+    # Return the machine to the dealer's available fleet
+    machine_update = {
+        "status": "Ready",
+        "userID": None,
+        "checkInDate": None,
+        "checkOutDate": None,
+        "updatedAt": completed_at
+    }
+    await db.machines.update_one({"machineID": machine_id}, {"$set": machine_update})
+    await emit_machine_change(machine, {**machine, **machine_update})
+    
+    return APIResponse(
+        success=True,
+        message="Order completed successfully.",
+        data={
+            "order_id": order_id,
+            "machine_id": machine_id,
+            "estimated_cost": estimated_cost,
+            "completed_at": completed_at.isoformat()
+        }
+    )
@@ -7,6 +7,9 @@ import uuid
 from bson import ObjectId
 from ..models.database import RequestCreate, RequestUpdate, APIResponse, RequestStatus
 from .auth import get_current_user
+from ..services.events import emit_machine_change, emit_request_change
+from ..services.serialization import api_response
+from ..services.response_cache import invalidate, user_tag
 
 router = APIRouter()
 
@@ -62,6 +65,7 @@ async def create_request(
         result = await db.requests.insert_one(request_doc)
         
         if result.inserted_id:
+            await emit_request_change(request_data.machine_id, None, RequestStatus.IN_PROGRESS, request_id)
             return APIResponse(
                 success=True,
                 message="Request created successfully",
@@ -132,7 +136,6 @@ async def get_requests_and_orders(
         
         # Enhanced: Enrich requests with user health scores and details
         for request in requests_list:
-            request["_id"] = str(request["_id"])
             request["source"] = "requests"
             
             # Get user details including health score
@@ -162,8 +165,6 @@ async def get_requests_and_orders(
         # Enhanced: Enrich orders with user health scores and availability info
         enriched_orders = []
         for order in orders_list:
-            order["_id"] = str(order["_id"])
-            
             # Get user details including health score
             user = await db.users.find_one({"userID": order["userID"]})
             if user:
@@ -252,7 +253,7 @@ async def get_requests_and_orders(
             if item.get("user_details", {}).get("health_score", 700) < 550
         )
         
-        return APIResponse(
+        return api_response(
             success=True,
             message=f"Found {total_items} items ({len(requests_list)} requests, {len(enriched_orders)} pending orders)",
             data={
@@ -322,9 +323,6 @@ async def get_requests_and_orders(
         # Check machine availability for each order
         enriched_orders = []
         for order in orders_list:
-            # Convert ObjectId to string
-            order["_id"] = str(order["_id"])
-            
             # Check if machine type is available during the specified time period
             availability_query = {
                 "machineType": {"$regex": order["machineType"], "$options": "i"},
@@ -360,7 +358,6 @@ async def get_requests_and_orders(
         
         # Convert requests ObjectId to string and add source
         for request in requests_list:
-            request["_id"] = str(request["_id"])
             request["source"] = "requests"
             request["isAvailable"] = True  # Existing requests are always considered "available" for processing
         
@@ -376,7 +373,7 @@ async def get_requests_and_orders(
             if item.get("requestType"):
                 request_types.add(item["requestType"])
         
-        return APIResponse(
+        return api_response(
             success=True,
             message=f"Found {len(combined_list)} items ({len(requests_list)} requests, {len(enriched_orders)} pending orders)",
             data={
@@ -501,6 +498,7 @@ async def handle_request_approval(request_doc, approval_data, dealership_id, cur
         {"requestID": request_doc["requestID"]},
         {"$set": update_data}
     )
+    await emit_request_change(request_doc["machineID"], request_doc.get("status"), "Approved", request_doc["requestID"])
     
     return APIResponse(
         success=True,
@@ -530,17 +528,19 @@ async def handle_order_approval(order_doc, approval_data, dealership_id, current
         raise HTTPException(status_code=400, detail="Machine not available for assignment")
     
     # Assign machine to user
+    machine_update = {
+        "userID": order_doc.get("userID"),
+        "siteID": order_doc.get("siteID"),
+        "checkOutDate": order_doc.get("checkOutDate"),
+        "checkInDate": order_doc.get("checkInDate"),
+        "status": "Occupied",
+        "updatedAt": current_time
+    }
     await db.machines.update_one(
         {"machineID": machine_id, "dealerID": dealership_id},
-        {"$set": {
-            "userID": order_doc.get("userID"),
-            "siteID": order_doc.get("siteID"),
-            "checkOutDate": order_doc.get("checkOutDate"),
-            "checkInDate": order_doc.get("checkInDate"),
-            "status": "Occupied",
-            "updatedAt": current_time
-        }}
+        {"$set": machine_update}
     )
+    await emit_machine_change(machine, {**machine, **machine_update})
     
     # Update order status
     await db.neworders.update_one(
@@ -552,6 +552,7 @@ async def handle_order_approval(order_doc, approval_data, dealership_id, current
             "updatedAt": current_time
         }}
     )
+    await invalidate(user_tag(order_doc.get("userID"), "orders"))
     
     return APIResponse(
         success=True,
@@ -606,6 +607,7 @@ async def reject_request(
                     "updatedAt": current_time
                 }}
             )
+            await emit_request_change(request_doc["machineID"], request_doc.get("status"), "CANCELLED", request_doc["requestID"])
             
             return APIResponse(
                 success=True,
@@ -627,6 +629,7 @@ async def reject_request(
                     "updatedAt": current_time
                 }}
             )
+            await invalidate(user_tag(order_doc.get("userID"), "orders"))
             
             return APIResponse(
                 success=True,
@@ -686,6 +689,7 @@ async def reject_request(
                     "updatedAt": current_time
                 }}
             )
+            await emit_request_change(request_doc["machineID"], request_doc.get("status"), "CANCELLED", request_doc["requestID"])
             
             return APIResponse(
                 success=True,
@@ -707,6 +711,7 @@ async def reject_request(
                     "updatedAt": current_time
                 }}
             )
+            await invalidate(user_tag(order_doc.get("userID"), "orders"))
             
             return APIResponse(
                 success=True,
@@ -747,17 +752,19 @@ async def handle_order_approval(order_doc, approval_data, dealership_id, current
         raise HTTPException(status_code=400, detail="Order missing check-out or check-in dates")
     
     # Assign machine to user
+    machine_update = {
+        "userID": order_doc.get("userID"),
+        "siteID": order_doc.get("siteID"),
+        "checkOutDate": check_out_date,
+        "checkInDate": check_in_date,
+        "status": "OCCUPIED",
+        "updatedAt": current_time
+    }
     await db.machines.update_one(
         {"machineID": machine_id, "dealerID": dealership_id},
-        {"$set": {
-            "userID": order_doc.get("userID"),
-            "siteID": order_doc.get("siteID"),
-            "checkOutDate": check_out_date,
-            "checkInDate": check_in_date,
-            "status": "OCCUPIED",
-            "updatedAt": current_time
-        }}
+        {"$set": machine_update}
     )
+    await emit_machine_change(machine, {**machine, **machine_update})
     
     # Update order status
     await db.neworders.update_one(
@@ -769,6 +776,7 @@ async def handle_order_approval(order_doc, approval_data, dealership_id, current
             "updatedAt": current_time
         }}
     )
+    await invalidate(user_tag(order_doc.get("userID"), "orders"))
     
     return APIResponse(
         success=True,
@@ -825,6 +833,7 @@ async def reject_request(
                     "updatedAt": current_time
                 }}
             )
+            await emit_request_change(request_doc["machineID"], request_doc.get("status"), "CANCELLED", request_doc["requestID"])
             
             return APIResponse(
                 success=True,
@@ -846,6 +855,7 @@ async def reject_request(
                     "updatedAt": current_time
                 }}
             )
+            await invalidate(user_tag(order_doc.get("userID"), "orders"))
             
             return APIResponse(
                 success=True,
@@ -910,11 +920,7 @@ async def get_available_machines_for_assignment(
         cursor = db.machines.find(query)
         machines = await cursor.to_list(length=100)
         
-        # Convert ObjectId to string
-        for machine in machines:
-            machine["_id"] = str(machine["_id"])
-        
-        return APIResponse(
+        return api_response(
             success=True,
             message=f"Found {len(machines)} available machines",
             data={
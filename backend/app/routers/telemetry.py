@@ -0,0 +1,115 @@
+from fastapi import APIRouter, HTTPException, Depends, Security, Query
+from fastapi.security import APIKeyHeader, HTTPBearer, HTTPAuthorizationCredentials
+import hmac
+import motor.motor_asyncio
+from decouple import config
+from datetime import datetime, timedelta
+from typing import Optional
+from ..models.database import APIResponse, TelemetryBatch
+from .auth import get_current_user
+from ..services.telemetry import ingest_readings, TELEMETRY_MAX_BATCH
+from ..services.telemetry_rollup import get_buckets
+from ..services.serialization import api_response
+
+router = APIRouter()
+
+# MongoDB connection
+MONGODB_URL = config("MONGODB_URL")
+client = motor.motor_asyncio.AsyncIOMotorClient(MONGODB_URL)
+db = client.caterpillar_db
+
+# Shared secret for the telematics gateway; empty disables key access
+TELEMETRY_API_KEY = config("TELEMETRY_API_KEY", default="")
+
+api_key_header = APIKeyHeader(name="X-API-Key", auto_error=False)
+optional_bearer = HTTPBearer(auto_error=False)
+
+async def get_ingest_scope(
+    api_key: Optional[str] = Security(api_key_header),
+    credentials: Optional[HTTPAuthorizationCredentials] = Depends(optional_bearer)
+) -> dict:
+    """Gateway key covers every machine; an admin token only the admin's dealership"""
+    if api_key:
+        if TELEMETRY_API_KEY and hmac.compare_digest(api_key, TELEMETRY_API_KEY):
+            return {"dealer_id": None}
+        raise HTTPException(status_code=401, detail="Invalid API key")
+
+    if credentials is None:
+        raise HTTPException(status_code=401, detail="API key or bearer token required")
+
+    current_user = await get_current_user(credentials)
+    if current_user["role"] != "admin":
+        raise HTTPException(status_code=403, detail="Admin access required")
+    return {"dealer_id": current_user["dealershipID"]}
+
+@router.post("/readings", response_model=APIResponse)
+async def ingest_telemetry(
+    batch: TelemetryBatch,
+    scope: dict = Depends(get_ingest_scope)
+):
+    """
+    Ingest a batch of engine/idle hour readings, reporting per-reading errors
+    """
+    try:
+        if len(batch.readings) > TELEMETRY_MAX_BATCH:
+            raise HTTPException(
+                status_code=413,
+                detail=f"Batch too large: {len(batch.readings)} readings (max {TELEMETRY_MAX_BATCH})"
+            )
+
+        result = await ingest_readings(batch.readings, dealer_id=scope["dealer_id"])
+
+        return APIResponse(
+            success=result["rejected"] == 0,
+            message=f"Accepted {result['accepted']} of {result['received']} readings",
+            data=result
+        )
+
+    except HTTPException:
+        raise
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=f"Internal server error: {str(e)}")
+
+@router.get("/usage/{scope}/{key}", response_model=APIResponse)
+async def get_usage_buckets(
+    scope: str,
+    key: str,
+    period: str = Query("day", pattern="^(day|week)$"),
+    days: int = Query(30, ge=1, le=730),
+    current_user: dict = Depends(get_current_user)
+):
+    """
+    Daily or weekly utilization buckets for a machine or customer
+    """
+    try:
+        if scope not in ("machine", "user"):
+            raise HTTPException(status_code=400, detail="Scope must be 'machine' or 'user'")
+
+        if current_user["role"] == "admin":
+            if scope == "machine":
+                owner = await db.machines.find_one({"machineID": key, "dealerID": current_user["dealershipID"]})
+            else:
+                owner = await db.users.find_one({"userID": key, "dealershipID": current_user["dealershipID"]})
+            if not owner:
+                raise HTTPException(status_code=404, detail=f"{scope.capitalize()} not found")
+        elif scope == "user":
+            if key != current_user["userID"]:
+                raise HTTPException(status_code=403, detail="Access denied")
+        elif not await db.machines.find_one({"machineID": key, "userID": current_user["userID"]}):
+            raise HTTPException(status_code=403, detail="Access denied")
+
+        buckets = await get_buckets(scope, key, period, datetime.utcnow() - timedelta(days=days))
+        for bucket in buckets:
+            total = bucket["engineHours"] + bucket["idleHours"]
+            bucket["utilization"] = round(bucket["engineHours"] / total * 100, 2) if total > 0 else None
+
+        return api_response(
+            success=True,
+            message="Usage buckets retrieved successfully",
+            data={"scope": scope, "key": key, "period": period, "buckets": buckets}
+        )
+
+    except HTTPException:
+        raise
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=f"Internal server error: {str(e)}")
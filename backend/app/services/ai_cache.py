@@ -0,0 +1,149 @@
+"""
+Cache for generated AI recommendations.
+
+Entries are keyed by a fingerprint of the model name and prompt in which
+the utilization, hour, day and cost statistics are rounded to
+AI_CACHE_SIGNIFICANT_DIGITS significant digits, so a prompt whose
+statistics barely moved (70.8% vs 71.2% utilization, 12,410 vs 12,460
+engine hours) reuses the earlier answer. Machine counts, health scores and
+coordinates are kept exact. Entries live in
+an in-process LRU with a TTL and, when AI_CACHE_PERSIST is on, in the
+`ai_recommendation_cache` collection so restarts and other workers share
+them. Only structured (dict) responses are cached; error strings are not.
+"""
+import hashlib
+import math
+import re
+import time
+import motor.motor_asyncio
+from collections import OrderedDict
+from decouple import config
+from datetime import datetime, timedelta
+from typing import Awaitable, Callable
+
+# MongoDB connection
+MONGODB_URL = config("MONGODB_URL")
+client = motor.motor_asyncio.AsyncIOMotorClient(MONGODB_URL)
+db = client.caterpillar_db
+
+AI_CACHE_TTL_SECONDS = float(config("AI_CACHE_TTL_SECONDS", default="21600"))
+AI_CACHE_MAX_ENTRIES = int(config("AI_CACHE_MAX_ENTRIES", default="500"))
+AI_CACHE_PERSIST = config("AI_CACHE_PERSIST", default=True, cast=bool)
+AI_CACHE_SIGNIFICANT_DIGITS = int(config("AI_CACHE_SIGNIFICANT_DIGITS", default="2"))
+
+NUMBER = re.compile(r"\d[\d,]*(?:\.\d+)?")
+# "- <label>: <value>" prompt lines whose value is a bucketable statistic
+STAT_LINE = re.compile(
+    r"^(\s*- [^:\n]*(?:Utilization|Idle Hours|engine hours|Operating Days|Variance|Cost)[^:\n]*:)([^\n]*)$",
+    re.MULTILINE
+)
+
+_entries = OrderedDict()
+_stats = {"hits": 0, "persistent_hits": 0, "misses": 0, "stores": 0, "evictions": 0, "expired": 0}
+
+def quantize(value: float, digits: int = AI_CACHE_SIGNIFICANT_DIGITS) -> float:
+    """Round to `digits` significant digits (12,460 -> 12,000 at 2 digits)"""
+    if value == 0 or not math.isfinite(value):
+        return value
+    return round(value, digits - 1 - int(math.floor(math.log10(abs(value)))))
+
+def _quantize_match(match: re.Match) -> str:
+    value = quantize(float(match.group(0).replace(",", "")))
+    return f"{value:g}"
+
+def _quantize_stat(match: re.Match) -> str:
+    return match.group(1) + NUMBER.sub(_quantize_match, match.group(2))
+
+def fingerprint(model: str, prompt: str) -> str:
+    """Stable key for a prompt with whitespace collapsed and statistics bucketed"""
+    normalized = " ".join(STAT_LINE.sub(_quantize_stat, prompt).split())
+    return hashlib.sha256(f"{model}\0{normalized}".encode()).hexdigest()
+
+async def ensure_indexes():
+    if AI_CACHE_PERSIST:
+        await db.ai_recommendation_cache.create_index("expiresAt", expireAfterSeconds=0)
+
+def _remember(key: str, result: dict, expires: float):
+    _entries.pop(key, None)
+    _entries[key] = {"result": result, "expires": expires}
+    while len(_entries) > AI_CACHE_MAX_ENTRIES:
+        _entries.popitem(last=False)
+        _stats["evictions"] += 1
+
+def _lookup(key: str):
+    entry = _entries.get(key)
+    if entry is None:
+        return None
+    if entry["expires"] <= time.monotonic():
+        del _entries[key]
+        _stats["expired"] += 1
+        return None
+    _entries.move_to_end(key)
+    return entry["result"]
+
+async def _load(key: str):
+    if not AI_CACHE_PERSIST:
+        return None
+    try:
+        stored = await db.ai_recommendation_cache.find_one(
+            {"_id": key, "expiresAt": {"$gt": datetime.utcnow()}}
+        )
+    except Exception as e:
+        print(f"AI cache lookup failed: {str(e)}")
+        return None
+    if not stored:
+        return None
+    remaining = (stored["expiresAt"] - datetime.utcnow()).total_seconds()
+    _remember(key, stored["result"], time.monotonic() + remaining)
+    return stored["result"]
+
+async def _save(key: str, model: str, result: dict):
+    _remember(key, result, time.monotonic() + AI_CACHE_TTL_SECONDS)
+    _stats["stores"] += 1
+    if not AI_CACHE_PERSIST:
+        return
+    now = datetime.utcnow()
+    try:
+        await db.ai_recommendation_cache.replace_one(
+            {"_id": key},
+            {
+                "model": model,
+                "result": result,
+                "createdAt": now,
+                "expiresAt": now + timedelta(seconds=AI_CACHE_TTL_SECONDS)
+            },
+            upsert=True
+        )
+    except Exception as e:
+        print(f"AI cache write failed: {str(e)}")
+
+async def get_or_generate(model: str, prompt: str, generate: Callable[[], Awaitable]):
+    """Cached result for an equivalent prompt, else call `generate` and cache it"""
+    key = fingerprint(model, prompt)
+
+    result = _lookup(key)
+    if result is not None:
+        _stats["hits"] += 1
+        return result
+
+    result = await _load(key)
+    if result is not None:
+        _stats["persistent_hits"] += 1
+        return result
+
+    _stats["misses"] += 1
+    result = await generate()
+    if isinstance(result, dict):
+        await _save(key, model, result)
+    return result
+
+def get_stats() -> dict:
+    lookups = _stats["hits"] + _stats["persistent_hits"] + _stats["misses"]
+    return {
+        **_stats,
+        "entries": len(_entries),
+        "max_entries": AI_CACHE_MAX_ENTRIES,
+        "ttl_seconds": AI_CACHE_TTL_SECONDS,
+        "persistent": AI_CACHE_PERSIST,
+        "hit_rate": round((_stats["hits"] + _stats["persistent_hits"]) / lookups, 4) if lookups else 0.0
+    }
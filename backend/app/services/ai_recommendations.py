@@ -0,0 +1,208 @@
+"""
+Gemini recommendation generation and background enrichment.
+
+Rule-based recommendations (services.recommendation_rules) are returned to
+the caller immediately; `enrich_in_background` then asks Gemini for a
+richer recommendation off the request path and hands the result to an
+`apply` callback that merges it into the stored recommendation. At most
+one enrichment runs per key at a time.
+"""
+import asyncio
+import json
+import math
+import motor.motor_asyncio
+from datetime import datetime
+from decouple import config
+from typing import Awaitable, Callable, Optional
+
+from . import ai_cache
+from .gemini import GEMINI_API_KEY, get_model
+from .recommendation_prompts import build_usage_prompt, build_transfer_prompt, build_customer_prompt
+
+FLEET_MODEL = 'gemini-2.5-flash-lite'
+CUSTOMER_MODEL = 'gemini-pro'
+
+# MongoDB connection
+MONGODB_URL = config("MONGODB_URL")
+client = motor.motor_asyncio.AsyncIOMotorClient(MONGODB_URL)
+db = client.caterpillar_db
+
+_enrichments = {}
+
+async def generate_ai_recommendation(machine_data, utilization_stats, recommendation_type="usage"):
+    """Generate AI-powered recommendations using Gemini"""
+    if not GEMINI_API_KEY:
+        return "AI recommendations unavailable - API key not configured"
+
+    if recommendation_type == "transfer":
+        prompt = build_transfer_prompt(machine_data, utilization_stats)
+    else:
+        prompt = build_usage_prompt(machine_data, utilization_stats)
+
+    async def generate():
+        model = get_model(FLEET_MODEL)
+        response = await model.generate_content_async(prompt)
+
+        # Try to parse as JSON, fall back to plain text
+        try:
+            return json.loads(response.text)
+        except:
+            return {"recommendation": response.text, "priority": "medium", "ai_generated": True}
+
+    try:
+        # Near-identical fleet stats reuse the previous answer
+        return await ai_cache.get_or_generate(FLEET_MODEL, prompt, generate)
+    except Exception as e:
+        return f"AI recommendation generation failed: {str(e)}"
+
+async def generate_customer_ai_recommendation(customer_data, utilization_stats):
+    """Generate customer-specific AI recommendations using Gemini"""
+    if not GEMINI_API_KEY:
+        return "AI recommendations unavailable - API key not configured"
+
+    prompt = build_customer_prompt(customer_data, utilization_stats)
+
+    async def generate():
+        model = get_model(CUSTOMER_MODEL)
+        response = await model.generate_content_async(prompt)
+
+        # Try to parse as JSON, fall back to structured response
+        try:
+            return json.loads(response.text)
+        except:
+            # Create structured response from text
+            return {
+                "recommendation": "Optimize Your Machine Fleet Performance",
+                "priority": "Medium",
+                "potential_savings": "Reduce operational costs through better utilization",
+                "action_steps": [
+                    "Review machine utilization reports weekly",
+                    "Minimize idle time during operations",
+                    "Schedule preventive maintenance during low-demand periods",
+                    "Consider consolidating underutilized machines",
+                    "Contact your dealer for optimization consultation"
+                ],
+                "ai_generated": True,
+                "full_ai_response": response.text
+            }
+
+    try:
+        return await ai_cache.get_or_generate(CUSTOMER_MODEL, prompt, generate)
+    except Exception as e:
+        return f"AI recommendation generation failed: {str(e)}"
+
+def customer_prompt_inputs(machines: list, metrics: dict) -> tuple:
+    """(customer_data, utilization_stats) for the customer prompt, from rule metrics"""
+    avg_utilization = 0 if math.isnan(metrics["avg_utilization"]) else metrics["avg_utilization"]
+    health_score = 700 if math.isnan(metrics["health_score"]) else metrics["health_score"]
+    customer_data = {
+        "total_machines": metrics["machine_count"],
+        "active_machines": metrics["occupied_count"],
+        "ready_machines": metrics["ready_count"],
+        "maintenance_machines": metrics["maintenance_count"],
+        "machine_types": sorted(set(m.get("machineType", "Unknown") for m in machines)),
+        "avg_utilization": avg_utilization,
+        "overutilized_machines": metrics["overutilized_count"],
+        "underutilized_machines": metrics["underutilized_count"],
+        "current_health_score": health_score,
+        "estimated_monthly_costs": metrics["estimated_monthly_cost"],
+        "avg_operating_days": metrics["avg_operating_days"],
+        "total_idle_hours": metrics["total_idle_hours"]
+    }
+    utilization_stats = {
+        "avg_utilization": avg_utilization,
+        "total_idle_hours": metrics["total_idle_hours"],
+        "total_engine_hours": metrics["total_engine_hours"],
+        "avg_operating_days": metrics["avg_operating_days"],
+        "overutilized_count": metrics["overutilized_count"],
+        "underutilized_count": metrics["underutilized_count"],
+        "monthly_cost_estimate": metrics["estimated_monthly_cost"]
+    }
+    return customer_data, utilization_stats
+
+def customer_prompt_fingerprint(customer_data: dict, utilization_stats: dict) -> str:
+    """Cache fingerprint of the customer prompt, to tell whether an enrichment is current"""
+    return ai_cache.fingerprint(CUSTOMER_MODEL, build_customer_prompt(customer_data, utilization_stats))
+
+def enrichment_fields(result: dict) -> dict:
+    """Recommendation document fields taken from an AI result"""
+    return {
+        "recommendation": result.get("recommendation", "Optimize your machine usage based on current patterns"),
+        "priority": str(result.get("priority", "medium")).lower(),
+        "potential_savings": result.get("potential_savings", "Monitor usage patterns for cost optimization"),
+        "action_steps": result.get("action_steps", []),
+        "ai_generated": True
+    }
+
+def enrich_in_background(
+    key: str,
+    generate: Callable[[], Awaitable],
+    apply: Callable[[dict], Awaitable]
+) -> str:
+    """
+    Start `generate` in the background unless one is already running for
+    key; `apply` receives a structured result. Returns the enrichment status.
+    """
+    if not GEMINI_API_KEY:
+        return "unavailable"
+    if key in _enrichments:
+        return "pending"
+
+    async def run():
+        try:
+            result = await generate()
+            if isinstance(result, dict):
+                await apply(result)
+            else:
+                print(f"AI enrichment {key} skipped: {result}")
+        except Exception as e:
+            print(f"AI enrichment {key} failed: {str(e)}")
+        finally:
+            _enrichments.pop(key, None)
+
+    _enrichments[key] = asyncio.create_task(run())
+    return "pending"
+
+async def customer_insight(user_id: str, machines: list, metrics: dict) -> Optional[dict]:
+    """
+    Stored AI insight for a customer when it was generated from the current
+    metrics; otherwise starts generating one and returns None
+    """
+    customer_data, utilization_stats = customer_prompt_inputs(machines, metrics)
+    fingerprint = customer_prompt_fingerprint(customer_data, utilization_stats)
+
+    stored = await db.recommendation_enrichments.find_one({"_id": f"customer:{user_id}"})
+    if stored and stored.get("fingerprint") == fingerprint:
+        fields = enrichment_fields(stored["result"])
+        return {
+            "rule_id": None,
+            "type": "ai_insight",
+            "title": "AI Insight",
+            "description": fields["recommendation"],
+            "priority": fields["priority"],
+            "suggested_action": fields["action_steps"][0] if fields["action_steps"] else "Review your machine usage",
+            "potential_savings": fields["potential_savings"],
+            "action_steps": fields["action_steps"],
+            "ai_generated": True
+        }
+
+    async def apply(result: dict):
+        await db.recommendation_enrichments.replace_one(
+            {"_id": f"customer:{user_id}"},
+            {"fingerprint": fingerprint, "result": result, "generatedAt": datetime.utcnow()},
+            upsert=True
+        )
+
+    enrich_in_background(
+        f"customer:{user_id}",
+        lambda: generate_customer_ai_recommendation(customer_data, utilization_stats),
+        apply
+    )
+    return None
+
+async def stop():
+    """Cancel enrichments still running at shutdown"""
+    tasks = list(_enrichments.values())
+    for task in tasks:
+        task.cancel()
+    await asyncio.gather(*tasks, return_exceptions=True)
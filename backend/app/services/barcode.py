@@ -0,0 +1,424 @@
+"""
+Barcode decoding for machine scans.
+
+Uploads are decoded with OpenCV and scanned with pyzbar, retrying on
+progressively more processed variants of the image (grayscale, Otsu and
+adaptive thresholds, contrast equalization, rotations) until a symbol is
+found. When the zbar shared library is not installed, OpenCV's own QR and
+1D barcode detectors are used instead.
+
+Large photos go coarse to fine: candidate regions are found by gradient
+and morphology analysis at a working resolution, only those crops are
+scanned, and the full frame is scanned exhaustively only when no region
+decodes. Every decode reports per-stage timings for tuning.
+
+Decoding is CPU-bound, so it runs in a ProcessPoolExecutor and never
+blocks the event loop; cv2, numpy, PIL and pyzbar are only imported inside
+the worker processes.
+"""
+import asyncio
+import json
+import multiprocessing
+import os
+import re
+import statistics
+import time
+from collections import defaultdict, deque
+from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+from decouple import config
+
+BARCODE_WORKERS = int(config("BARCODE_WORKERS", default=str(min(4, os.cpu_count() or 1))))
+BARCODE_MAX_BYTES = int(config("BARCODE_MAX_BYTES", default=str(10 * 1024 * 1024)))
+# Larger images are scaled down before a full-frame scan; barcodes stay readable
+BARCODE_MAX_DIMENSION = int(config("BARCODE_MAX_DIMENSION", default="1600"))
+# Coarse-to-fine: find candidate regions at the working resolution and
+# decode only those crops before falling back to the full frame
+BARCODE_PYRAMID = config("BARCODE_PYRAMID", default="true").lower() == "true"
+BARCODE_WORKING_DIMENSION = int(config("BARCODE_WORKING_DIMENSION", default="800"))
+BARCODE_ROI_DIMENSION = int(config("BARCODE_ROI_DIMENSION", default="320"))
+BARCODE_MAX_REGIONS = int(config("BARCODE_MAX_REGIONS", default="4"))
+
+# Payload keys accepted for each BarcodeData field
+PAYLOAD_KEYS = {
+    "machine_id": ["machine_id", "machineid", "id", "serial", "sn"],
+    "machine_type": ["machine_type", "machinetype", "type"],
+    "manufacturer": ["manufacturer", "mfr", "make", "brand"],
+    "model": ["model"],
+    "year": ["year", "yr"]
+}
+
+# Recent decodes kept for the per-stage timing percentiles
+BARCODE_TIMING_WINDOW = int(config("BARCODE_TIMING_WINDOW", default="500"))
+
+_pool = None
+_stats = {"images": 0, "decoded": 0, "not_found": 0, "errors": 0, "strategies": {}, "stages": {}}
+_timings = defaultdict(lambda: deque(maxlen=BARCODE_TIMING_WINDOW))
+
+class BarcodeImageError(ValueError):
+    """The upload is not a readable image"""
+
+# --- Worker side (runs in the process pool) ---
+
+_zbar = None
+
+def _pyzbar():
+    """pyzbar's decode function, or None when libzbar is missing"""
+    global _zbar
+    if _zbar is None:
+        try:
+            from pyzbar import pyzbar
+            _zbar = pyzbar.decode
+        except (ImportError, OSError):
+            _zbar = False
+    return _zbar or None
+
+def _variants(gray, exhaustive: bool = True):
+    """
+    (strategy, image) pairs from cheapest to most processed; candidate
+    regions, already cropped and scaled, only get the two cheapest
+    """
+    import cv2
+
+    yield "grayscale", gray
+    blurred = cv2.GaussianBlur(gray, (5, 5), 0)
+    _, otsu = cv2.threshold(blurred, 0, 255, cv2.THRESH_BINARY + cv2.THRESH_OTSU)
+    yield "otsu_threshold", otsu
+    if not exhaustive:
+        return
+    yield "equalized", cv2.equalizeHist(gray)
+    yield "adaptive_threshold", cv2.adaptiveThreshold(
+        blurred, 255, cv2.ADAPTIVE_THRESH_GAUSSIAN_C, cv2.THRESH_BINARY, 31, 10
+    )
+    yield "rotated_90", cv2.rotate(gray, cv2.ROTATE_90_CLOCKWISE)
+    for angle in (45, -45):
+        height, width = gray.shape
+        matrix = cv2.getRotationMatrix2D((width / 2, height / 2), angle, 1.0)
+        yield f"rotated_{angle}", cv2.warpAffine(gray, matrix, (width, height), borderValue=255)
+
+def _scan_zbar(decode, image) -> list:
+    return [
+        {
+            "data": symbol.data.decode("utf-8", errors="replace"),
+            "symbology": symbol.type,
+            "rect": list(symbol.rect)
+        }
+        for symbol in decode(image)
+    ]
+
+def _scan_opencv(image) -> list:
+    import cv2
+
+    results = []
+    found, texts, points, _ = cv2.QRCodeDetector().detectAndDecodeMulti(image)
+    if found:
+        for text, corners in zip(texts, points):
+            if text:
+                x, y, w, h = cv2.boundingRect(corners.astype("float32"))
+                results.append({"data": text, "symbology": "QRCODE", "rect": [x, y, w, h]})
+
+    found, texts, types, points = cv2.barcode.BarcodeDetector().detectAndDecodeWithType(image)
+    if found:
+        for text, symbology, corners in zip(texts, types, points):
+            if text:
+                x, y, w, h = cv2.boundingRect(corners.astype("float32"))
+                results.append({"data": text, "symbology": symbology, "rect": [x, y, w, h]})
+    return results
+
+class _Pyramid:
+    """
+    Grayscale levels of one upload, decoded on demand. JPEG levels 2, 4
+    and 8 come straight from a reduced-size decode, which skips most of
+    the work of decoding a full-size photo.
+    """
+    FLAGS = {1: "IMREAD_GRAYSCALE", 2: "IMREAD_REDUCED_GRAYSCALE_2",
+             4: "IMREAD_REDUCED_GRAYSCALE_4", 8: "IMREAD_REDUCED_GRAYSCALE_8"}
+
+    def __init__(self, data: bytes):
+        import numpy as np
+
+        self.buffer = np.frombuffer(data, dtype=np.uint8)
+        self.levels = {}
+        self.size = _image_size(data)
+
+    def level(self, factor: int):
+        import cv2
+
+        if factor not in self.levels:
+            image = cv2.imdecode(self.buffer, getattr(cv2, self.FLAGS[factor]))
+            if image is None:
+                raise BarcodeImageError("File is not a readable image")
+            self.levels[factor] = image
+            if self.size is None:
+                self.size = (image.shape[1] * factor, image.shape[0] * factor)
+        return self.levels[factor]
+
+    def factor_for(self, full_length: float, target: int) -> int:
+        """Coarsest level at which full_length pixels still span target pixels"""
+        factor = 1
+        while factor < 8 and full_length / (factor * 2) >= target:
+            factor *= 2
+        return factor
+
+def _image_size(data: bytes):
+    """
+    (width, height) from the image header without decoding pixels, as
+    oriented by imdecode: EXIF orientations 5-8 transpose the image
+    """
+    try:
+        import io
+        from PIL import Image
+        with Image.open(io.BytesIO(data)) as header:
+            width, height = header.size
+            if header.getexif().get(0x0112, 1) in (5, 6, 7, 8):
+                return height, width
+            return width, height
+    except Exception:
+        return None
+
+def _candidate_regions(image) -> list:
+    """
+    Padded bounds (x0, y0, x1, y1) of high-gradient, barcode-like areas as
+    fractions of the image width and height, largest first, found on a copy
+    scaled to the working resolution
+    """
+    import cv2
+
+    scale = min(1.0, BARCODE_WORKING_DIMENSION / max(image.shape))
+    small = cv2.resize(image, None, fx=scale, fy=scale, interpolation=cv2.INTER_AREA)
+
+    # Bars and QR modules produce dense strong edges; close them into blobs
+    gradient = cv2.magnitude(
+        cv2.Sobel(small, cv2.CV_32F, 1, 0, ksize=3),
+        cv2.Sobel(small, cv2.CV_32F, 0, 1, ksize=3)
+    )
+    gradient = cv2.convertScaleAbs(gradient, alpha=255.0 / max(float(gradient.max()), 1.0))
+    gradient = cv2.blur(gradient, (7, 7))
+    _, mask = cv2.threshold(gradient, 0, 255, cv2.THRESH_BINARY + cv2.THRESH_OTSU)
+    size = max(small.shape) // 40 | 1
+    kernel = cv2.getStructuringElement(cv2.MORPH_RECT, (size, size))
+    mask = cv2.morphologyEx(mask, cv2.MORPH_CLOSE, kernel)
+    mask = cv2.dilate(cv2.erode(mask, None, iterations=3), None, iterations=3)
+
+    contours, _ = cv2.findContours(mask, cv2.RETR_EXTERNAL, cv2.CHAIN_APPROX_SIMPLE)
+    frame_area = small.shape[0] * small.shape[1]
+    boxes = []
+    for contour in contours:
+        x, y, w, h = cv2.boundingRect(contour)
+        # Specks are noise, thin strips are lines of text, and a box covering
+        # most of the frame is no better than the full frame
+        if not 0.002 * frame_area <= w * h <= 0.6 * frame_area:
+            continue
+        if max(w, h) > 4 * min(w, h):
+            continue
+        boxes.append((x, y, w, h))
+    boxes.sort(key=lambda box: box[2] * box[3], reverse=True)
+
+    regions = []
+    height, width = image.shape
+    for x, y, w, h in boxes[:BARCODE_MAX_REGIONS]:
+        # Pad for the quiet zone and for edges lost to the closing
+        pad_x, pad_y = int(w * 0.15) + 2, int(h * 0.15) + 2
+        x0, y0 = max(0, (x - pad_x) / scale), max(0, (y - pad_y) / scale)
+        x1, y1 = min(width, (x + w + pad_x) / scale), min(height, (y + h + pad_y) / scale)
+        regions.append((x0 / width, y0 / height, x1 / width, y1 / height))
+    return regions
+
+def _scan(decode, image, exhaustive: bool = True) -> tuple:
+    """(strategy, symbols) from the first image variant that decodes"""
+    for strategy, variant in _variants(image, exhaustive):
+        symbols = _scan_zbar(decode, variant) if decode else _scan_opencv(variant)
+        if symbols:
+            return strategy, symbols
+    return None, []
+
+def _scan_at(decode, image, factor: int, exhaustive: bool = True, offset: tuple = (0, 0)) -> tuple:
+    """
+    _scan on an image no larger than the target for its stage, with symbol
+    rects mapped back to full-resolution coordinates
+    """
+    import cv2
+
+    target = BARCODE_MAX_DIMENSION if exhaustive else BARCODE_ROI_DIMENSION
+    scale = min(1.0, target / max(image.shape))
+    if scale < 1:
+        image = cv2.resize(image, None, fx=scale, fy=scale, interpolation=cv2.INTER_AREA)
+    strategy, symbols = _scan(decode, image, exhaustive)
+    for symbol in symbols:
+        rx, ry, rw, rh = symbol["rect"]
+        symbol["rect"] = [
+            int(offset[0] + rx * factor / scale), int(offset[1] + ry * factor / scale),
+            int(rw * factor / scale), int(rh * factor / scale)
+        ]
+    return strategy, symbols
+
+def _scan_regions(decode, pyramid: _Pyramid, regions: list, base_factor: int) -> tuple:
+    """
+    (strategy, symbols) from the candidate regions, largest first, each
+    cropped from the already decoded base level unless the region needs a
+    finer one to span BARCODE_ROI_DIMENSION pixels (small, distant labels).
+    Stops at the first region that decodes: a scan photographs one label.
+    """
+    width, height = pyramid.size
+    for left, top, right, bottom in regions:
+        region_length = max((right - left) * width, (bottom - top) * height)
+        factor = min(base_factor, pyramid.factor_for(region_length, BARCODE_ROI_DIMENSION))
+        level = pyramid.level(factor)
+        level_height, level_width = level.shape
+        x0, y0 = int(left * level_width), int(top * level_height)
+        crop = level[y0:int(bottom * level_height), x0:int(right * level_width)]
+        if crop.size == 0:
+            continue
+        strategy, symbols = _scan_at(
+            decode, crop, factor, exhaustive=False, offset=(x0 * factor, y0 * factor)
+        )
+        if symbols:
+            return strategy, symbols
+    return None, []
+
+def decode_image(data: bytes, pyramid: bool = None) -> dict:
+    """
+    Decode every barcode in an encoded image; runs in a worker process.
+
+    The image is decoded once at the coarsest level that still covers
+    BARCODE_MAX_DIMENSION. With the pyramid on, candidate regions are
+    located on a working-resolution copy and only those crops are scanned,
+    going to a finer level just for small regions; the whole frame is
+    scanned exhaustively only when no region decodes.
+    """
+    use_pyramid = BARCODE_PYRAMID if pyramid is None else pyramid
+    timings = {}
+    started = time.perf_counter()
+
+    levels = _Pyramid(data)
+    longest = max(levels.size) if levels.size else None
+    base_factor = levels.factor_for(longest, BARCODE_MAX_DIMENSION) if longest else 1
+    base = levels.level(base_factor)
+    longest = max(levels.size)
+    timings["load"] = time.perf_counter() - started
+
+    decode = _pyzbar()
+    result = {"symbols": [], "strategy": None, "stage": None, "regions": 0,
+              "decoder": "pyzbar" if decode else "opencv"}
+
+    # Images already at the working resolution gain nothing from a pyramid
+    if use_pyramid and longest > BARCODE_WORKING_DIMENSION:
+        stage_started = time.perf_counter()
+        regions = _candidate_regions(base)
+        timings["detect"] = time.perf_counter() - stage_started
+        result["regions"] = len(regions)
+
+        stage_started = time.perf_counter()
+        strategy, symbols = _scan_regions(decode, levels, regions, base_factor)
+        timings["roi"] = time.perf_counter() - stage_started
+        if symbols:
+            result.update(symbols=symbols, strategy=strategy, stage="roi")
+
+    if not result["symbols"]:
+        stage_started = time.perf_counter()
+        strategy, symbols = _scan_at(decode, base, base_factor)
+        timings["full_frame"] = time.perf_counter() - stage_started
+        if symbols:
+            result.update(symbols=symbols, strategy=strategy, stage="full_frame")
+
+    timings["total"] = time.perf_counter() - started
+    result["timings_ms"] = {stage: round(seconds * 1000, 2) for stage, seconds in timings.items()}
+    return result
+
+# --- Payload parsing ---
+
+def _normalize_key(key: str) -> str:
+    return re.sub(r"[\s\-]", "_", key.strip().lower())
+
+def parse_payload(text: str) -> dict:
+    """
+    BarcodeData fields from a barcode payload: a JSON object, `key=value`
+    pairs separated by `;`, `|` or newlines, or a bare machine ID
+    """
+    text = text.strip()
+    pairs = {}
+    if text.startswith("{"):
+        try:
+            pairs = {_normalize_key(k): str(v) for k, v in json.loads(text).items() if v is not None}
+        except (ValueError, AttributeError):
+            pairs = {}
+    elif "=" in text or ":" in text:
+        for part in re.split(r"[;|\n]", text):
+            key, sep, value = part.replace(":", "=", 1).partition("=")
+            if sep and value.strip():
+                pairs[_normalize_key(key)] = value.strip()
+
+    fields = {}
+    for field, keys in PAYLOAD_KEYS.items():
+        for key in keys:
+            if pairs.get(key):
+                fields[field] = pairs[key]
+                break
+    if not fields:
+        # Plain codes (as printed on machine plates) are the machine ID
+        fields["machine_id"] = text
+    return fields
+
+# --- Event loop side ---
+
+def _get_pool() -> ProcessPoolExecutor:
+    global _pool
+    if _pool is None:
+        # Spawned workers do not inherit the server's sockets or event loop
+        _pool = ProcessPoolExecutor(
+            max_workers=BARCODE_WORKERS,
+            mp_context=multiprocessing.get_context("spawn")
+        )
+    return _pool
+
+async def decode(data: bytes) -> dict:
+    """Decoded symbols of an image, computed in the process pool"""
+    loop = asyncio.get_running_loop()
+    _stats["images"] += 1
+    try:
+        result = await loop.run_in_executor(_get_pool(), decode_image, data)
+    except BarcodeImageError:
+        _stats["errors"] += 1
+        raise
+    except BrokenProcessPool:
+        # A worker died; start a fresh pool on the next call
+        _stats["errors"] += 1
+        stop()
+        raise
+    if result["symbols"]:
+        _stats["decoded"] += 1
+        strategies, stages = _stats["strategies"], _stats["stages"]
+        strategies[result["strategy"]] = strategies.get(result["strategy"], 0) + 1
+        stages[result["stage"]] = stages.get(result["stage"], 0) + 1
+    else:
+        _stats["not_found"] += 1
+    for stage, ms in result["timings_ms"].items():
+        _timings[stage].append(ms)
+    return result
+
+def _percentiles(values) -> dict:
+    values = sorted(values)
+    return {
+        "runs": len(values),
+        "p50_ms": round(statistics.median(values), 2),
+        "p95_ms": values[min(len(values) - 1, int(len(values) * 0.95))]
+    }
+
+def get_stats() -> dict:
+    return {
+        "workers": BARCODE_WORKERS,
+        "pool_started": _pool is not None,
+        "pyramid": BARCODE_PYRAMID,
+        "working_dimension": BARCODE_WORKING_DIMENSION,
+        "roi_dimension": BARCODE_ROI_DIMENSION,
+        "max_regions": BARCODE_MAX_REGIONS,
+        **_stats,
+        "timings": {stage: _percentiles(values) for stage, values in _timings.items() if values}
+    }
+
+def stop():
+    """Shut the worker processes down"""
+    global _pool
+    if _pool is not None:
+        _pool.shutdown(wait=False, cancel_futures=True)
+        _pool = None
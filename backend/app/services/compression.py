@@ -0,0 +1,209 @@
+"""
+ASGI response compression negotiated through Accept-Encoding.
+
+Brotli is used when the client accepts it and the `brotli` package is
+installed, otherwise gzip. Buffered bodies below the size threshold go out
+unchanged; streamed bodies are compressed chunk by chunk with a flush after
+each one so NDJSON/SSE consumers still receive data as it is produced.
+"""
+import zlib
+from decouple import config
+from starlette.datastructures import Headers, MutableHeaders
+
+try:
+    import brotli
+except ImportError:  # Optional: gzip only
+    brotli = None
+
+COMPRESSION_ENABLED = config("COMPRESSION_ENABLED", default=True, cast=bool)
+COMPRESSION_MINIMUM_SIZE = int(config("COMPRESSION_MINIMUM_SIZE", default="1024"))
+GZIP_LEVEL = int(config("GZIP_LEVEL", default="6"))
+BROTLI_QUALITY = int(config("BROTLI_QUALITY", default="4"))
+
+# Content types worth compressing; images and archives are already compressed
+COMPRESSIBLE_TYPES = (
+    "application/json",
+    "application/x-ndjson",
+    "application/javascript",
+    "application/xml",
+    "text/",
+    "image/svg+xml"
+)
+
+_stats = {
+    "compressed": 0,
+    "skipped": 0,
+    "bytes_in": 0,
+    "bytes_out": 0,
+    "by_encoding": {}
+}
+
+def get_stats() -> dict:
+    """Compression counters and bytes saved since startup"""
+    return {
+        **_stats,
+        "by_encoding": {encoding: dict(counts) for encoding, counts in _stats["by_encoding"].items()},
+        "bytes_saved": _stats["bytes_in"] - _stats["bytes_out"],
+        "ratio": round(_stats["bytes_out"] / _stats["bytes_in"], 4) if _stats["bytes_in"] else None,
+        "brotli_available": brotli is not None
+    }
+
+def _record(encoding: str, bytes_in: int, bytes_out: int):
+    _stats["compressed"] += 1
+    _stats["bytes_in"] += bytes_in
+    _stats["bytes_out"] += bytes_out
+    counts = _stats["by_encoding"].setdefault(encoding, {"responses": 0, "bytes_in": 0, "bytes_out": 0})
+    counts["responses"] += 1
+    counts["bytes_in"] += bytes_in
+    counts["bytes_out"] += bytes_out
+
+def negotiate_encoding(accept_encoding: str):
+    """Pick br or gzip from an Accept-Encoding header, honouring q-values"""
+    weights = {}
+    for part in accept_encoding.lower().split(","):
+        name, _, params = part.strip().partition(";")
+        quality = 1.0
+        params = params.strip()
+        if params.startswith("q="):
+            try:
+                quality = float(params[2:])
+            except ValueError:
+                quality = 0.0
+        if name:
+            weights[name] = quality
+
+    candidates = ["br", "gzip"] if brotli is not None else ["gzip"]
+    best, best_quality = None, 0.0
+    for encoding in candidates:
+        quality = weights.get(encoding, weights.get("*", 0.0))
+        if quality > best_quality:
+            best, best_quality = encoding, quality
+    return best
+
+class _Compressor:
+    def __init__(self, encoding: str, gzip_level: int, brotli_quality: int):
+        self.encoding = encoding
+        if encoding == "br":
+            self._compressor = brotli.Compressor(quality=brotli_quality)
+        else:
+            # wbits 31: zlib stream with a gzip header and trailer
+            self._compressor = zlib.compressobj(gzip_level, zlib.DEFLATED, 31)
+
+    def chunk(self, data: bytes) -> bytes:
+        """Compress data and flush it so the client can decode it right away"""
+        if self.encoding == "br":
+            return self._compressor.process(data) + self._compressor.flush()
+        return self._compressor.compress(data) + self._compressor.flush(zlib.Z_SYNC_FLUSH)
+
+    def finish(self, data: bytes = b"") -> bytes:
+        if self.encoding == "br":
+            return self._compressor.process(data) + self._compressor.finish()
+        return self._compressor.compress(data) + self._compressor.flush(zlib.Z_FINISH)
+
+class CompressionMiddleware:
+    """Compress HTTP responses with brotli or gzip"""
+    def __init__(
+        self,
+        app,
+        minimum_size: int = COMPRESSION_MINIMUM_SIZE,
+        gzip_level: int = GZIP_LEVEL,
+        brotli_quality: int = BROTLI_QUALITY
+    ):
+        self.app = app
+        self.minimum_size = minimum_size
+        self.gzip_level = gzip_level
+        self.brotli_quality = brotli_quality
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http" or not COMPRESSION_ENABLED:
+            await self.app(scope, receive, send)
+            return
+
+        encoding = negotiate_encoding(Headers(scope=scope).get("accept-encoding", ""))
+        if encoding is None:
+            await self.app(scope, receive, send)
+            return
+
+        responder = _CompressionResponder(self, encoding, send)
+        await self.app(scope, receive, responder.send)
+
+def _weaken_etag(headers: MutableHeaders):
+    """
+    The encoded body differs byte for byte from the identity one, so it
+    may not share its strong validator (RFC 9110 8.8.3)
+    """
+    etag = headers.get("etag")
+    if etag and not etag.startswith("W/"):
+        headers["ETag"] = "W/" + etag
+
+class _CompressionResponder:
+    def __init__(self, middleware: CompressionMiddleware, encoding: str, send):
+        self.middleware = middleware
+        self.encoding = encoding
+        self.downstream = send
+        self.start_message = None
+        self.compressor = None
+        self.passthrough = False
+        self.bytes_in = 0
+        self.bytes_out = 0
+
+    def _compressible(self, headers: Headers) -> bool:
+        if "content-encoding" in headers:
+            return False
+        content_type = headers.get("content-type", "")
+        return content_type.startswith(COMPRESSIBLE_TYPES)
+
+    async def send(self, message):
+        if message["type"] == "http.response.start":
+            # Hold the start message until the first body chunk shows the size
+            self.start_message = message
+            return
+
+        if message["type"] != "http.response.body" or self.passthrough:
+            await self.downstream(message)
+            return
+
+        body = message.get("body", b"")
+        more_body = message.get("more_body", False)
+
+        if self.compressor is None:
+            headers = MutableHeaders(scope=self.start_message)
+            small = not more_body and len(body) < self.middleware.minimum_size
+            if small or not self._compressible(headers):
+                self.passthrough = True
+                _stats["skipped"] += 1
+                # A 304 stands in for the encoded 200 this client would get
+                if self.start_message["status"] == 304:
+                    _weaken_etag(headers)
+                await self.downstream(self.start_message)
+                await self.downstream(message)
+                return
+
+            self.compressor = _Compressor(self.encoding, self.middleware.gzip_level, self.middleware.brotli_quality)
+            headers["Content-Encoding"] = self.encoding
+            headers.add_vary_header("Accept-Encoding")
+            _weaken_etag(headers)
+
+            if not more_body:
+                # Whole body in one message: compress it and send a fixed length
+                compressed = self.compressor.finish(body)
+                headers["Content-Length"] = str(len(compressed))
+                await self.downstream(self.start_message)
+                await self.downstream({"type": "http.response.body", "body": compressed})
+                _record(self.encoding, len(body), len(compressed))
+                return
+
+            # Streaming: the compressed length is unknown up front
+            del headers["Content-Length"]
+            await self.downstream(self.start_message)
+
+        self.bytes_in += len(body)
+        if more_body:
+            compressed = self.compressor.chunk(body)
+            self.bytes_out += len(compressed)
+            await self.downstream({"type": "http.response.body", "body": compressed, "more_body": True})
+        else:
+            compressed = self.compressor.finish(body)
+            self.bytes_out += len(compressed)
+            await self.downstream({"type": "http.response.body", "body": compressed})
+            _record(self.encoding, self.bytes_in, self.bytes_out)
@@ -0,0 +1,275 @@
+"""
+Fleet-wide batch generation of customer recommendations.
+
+Loads every assigned machine of a dealership with one aggregation grouped
+by userID, evaluates the recommendation rules for all customers in a
+single vectorized pass and bulk-inserts one recommendation per customer,
+so customer dashboards are populated before anyone opens them. Gemini
+enrichment of those recommendations then runs with a concurrency limit
+and a calls-per-minute budget, and the results are applied with one
+bulk_write. The scheduled batch stores every dealership's rule output
+before it spends that budget once across all of them.
+"""
+import asyncio
+import uuid
+from collections import Counter
+import motor.motor_asyncio
+from decouple import config
+from datetime import datetime
+from typing import Optional
+from pymongo import UpdateOne
+
+from .ai_recommendations import (
+    generate_customer_ai_recommendation, customer_prompt_inputs, enrichment_fields
+)
+from .gemini import GEMINI_API_KEY
+from .recommendation_rules import fleet_metrics, evaluate, summarize, PRIORITY_ORDER
+from .telemetry_rollup import get_machine_usage, with_usage
+from .utilization import UTILIZATION_PROJECTION
+
+# MongoDB connection
+MONGODB_URL = config("MONGODB_URL")
+client = motor.motor_asyncio.AsyncIOMotorClient(MONGODB_URL)
+db = client.caterpillar_db
+
+AI_BATCH_CONCURRENCY = int(config("AI_BATCH_CONCURRENCY", default="4"))
+AI_BATCH_CALLS_PER_MINUTE = float(config("AI_BATCH_CALLS_PER_MINUTE", default="30"))
+# Most AI calls one batch run may make; the most urgent customers go first
+AI_BATCH_MAX_CALLS = int(config("AI_BATCH_MAX_CALLS", default="200"))
+
+BATCH_SOURCE = "batch"
+
+_enrichment_tasks = {}
+_last_runs = {}
+
+def customer_recommendation_doc(user_id: str, rules: list, source: str) -> dict:
+    """Stored customer recommendation built from rule output"""
+    now = datetime.utcnow()
+    return {
+        "recommendationID": str(uuid.uuid4()),
+        "type": "customer_optimization",
+        "userID": user_id,
+        "targetUserType": "customer",
+        **summarize(rules),
+        "rules": rules,
+        "ai_generated": False,
+        "source": source,
+        "status": "active",
+        "dateTime": now,
+        "createdAt": now,
+        "updatedAt": now
+    }
+
+async def load_customer_fleets(dealer_id: str, user_id: Optional[str] = None) -> list:
+    """(user_id, machines, health_score) for every customer (or one) with machines at a dealership"""
+    fields = {name: f"${name}" for name in UTILIZATION_PROJECTION if name != "_id"}
+    groups = await db.machines.aggregate([
+        {"$match": {"dealerID": dealer_id, "userID": user_id or {"$ne": None}}},
+        {"$group": {"_id": "$userID", "machines": {"$push": fields}}}
+    ]).to_list(length=None)
+
+    user_ids = [group["_id"] for group in groups]
+    customers, usage = await asyncio.gather(
+        db.users.find(
+            {"userID": {"$in": user_ids}, "role": "customer"},
+            {"_id": 0, "userID": 1, "health_score": 1}
+        ).to_list(length=None),
+        get_machine_usage(
+            machine["machineID"] for group in groups for machine in group["machines"]
+        )
+    )
+    health_scores = {customer["userID"]: customer.get("health_score", 700) for customer in customers}
+
+    return [
+        (group["_id"], [with_usage(machine, usage) for machine in group["machines"]], health_scores[group["_id"]])
+        for group in groups
+        if group["_id"] in health_scores
+    ]
+
+async def _rate_limited(calls: list) -> list:
+    """Run coroutine factories with bounded concurrency and evenly spaced starts"""
+    loop = asyncio.get_running_loop()
+    semaphore = asyncio.Semaphore(AI_BATCH_CONCURRENCY)
+    interval = 60.0 / AI_BATCH_CALLS_PER_MINUTE
+    next_start = loop.time()
+
+    async def run(call):
+        nonlocal next_start
+        async with semaphore:
+            now = loop.time()
+            delay = next_start - now
+            next_start = max(now, next_start) + interval
+            if delay > 0:
+                await asyncio.sleep(delay)
+            try:
+                return await call()
+            except Exception as e:
+                return f"AI recommendation generation failed: {str(e)}"
+
+    return await asyncio.gather(*(run(call) for call in calls))
+
+async def enrich_batch(targets: list) -> int:
+    """
+    Ask Gemini about each (recommendation_id, machines, metrics) target
+    within the batch budget; returns the number of recommendations updated
+    """
+    targets = targets[:AI_BATCH_MAX_CALLS]
+    calls = []
+    for _, machines, metrics in targets:
+        customer_data, utilization_stats = customer_prompt_inputs(machines, metrics)
+        calls.append(lambda c=customer_data, u=utilization_stats: generate_customer_ai_recommendation(c, u))
+
+    results = await _rate_limited(calls)
+
+    now = datetime.utcnow()
+    operations = [
+        UpdateOne(
+            {"recommendationID": recommendation_id},
+            {"$set": {**enrichment_fields(result), "enrichedAt": now, "updatedAt": now}}
+        )
+        for (recommendation_id, _, _), result in zip(targets, results)
+        if isinstance(result, dict)
+    ]
+    if operations:
+        await db.recommendations.bulk_write(operations, ordered=False)
+    return len(operations)
+
+async def _store_rule_recommendations(dealer_id: str) -> tuple:
+    """
+    Replace a dealer's batch recommendations with fresh rule output; returns
+    the run summary and (priority, enrichment target) pairs, most urgent first
+    """
+    started = datetime.utcnow()
+    fleets = await load_customer_fleets(dealer_id)
+    if not fleets:
+        summary = {"dealer_id": dealer_id, "customers": 0, "recommendations_generated": 0,
+                   "ai_enrichment": "skipped", "started_at": started}
+        return summary, []
+
+    metrics_rows = [fleet_metrics(machines, health_score) for _, machines, health_score in fleets]
+    rules_per_customer = evaluate(metrics_rows, "customer")
+
+    docs = [
+        customer_recommendation_doc(user_id, rules, BATCH_SOURCE)
+        for (user_id, _, _), rules in zip(fleets, rules_per_customer)
+    ]
+    # The latest batch replaces the previous one on each customer's dashboard
+    await db.recommendations.delete_many({
+        "source": BATCH_SOURCE,
+        "userID": {"$in": [user_id for user_id, _, _ in fleets]}
+    })
+    await db.recommendations.insert_many(docs, ordered=False)
+
+    # Customers with the most urgent findings are enriched first
+    ranked = sorted(
+        zip(docs, fleets, metrics_rows),
+        key=lambda entry: PRIORITY_ORDER[entry[0]["priority"]]
+    )
+    targets = [
+        (doc["priority"], (doc["recommendationID"], machines, metrics))
+        for doc, (_, machines, _), metrics in ranked
+        if machines
+    ]
+
+    summary = {
+        "dealer_id": dealer_id,
+        "customers": len(fleets),
+        "recommendations_generated": len(docs),
+        "ai_enrichment": "unavailable",
+        "ai_calls_planned": min(len(targets), AI_BATCH_MAX_CALLS),
+        "started_at": started
+    }
+    return summary, targets
+
+async def generate_for_dealer(dealer_id: str, wait_for_enrichment: bool = True) -> dict:
+    """
+    Store fresh rule-based recommendations for every customer of a dealer.
+    AI enrichment is awaited, or left running in the background when
+    wait_for_enrichment is False.
+    """
+    summary, ranked = await _store_rule_recommendations(dealer_id)
+    targets = [target for _, target in ranked]
+
+    if GEMINI_API_KEY and targets:
+        if wait_for_enrichment:
+            summary["ai_enriched"] = await enrich_batch(targets)
+            summary["ai_enrichment"] = "done"
+        elif dealer_id in _enrichment_tasks:
+            summary["ai_enrichment"] = "already_running"
+        else:
+            task = asyncio.create_task(enrich_batch(targets))
+            _enrichment_tasks[dealer_id] = task
+            task.add_done_callback(lambda done: _finish_enrichment(dealer_id, done))
+            summary["ai_enrichment"] = "pending"
+
+    summary["finished_at"] = datetime.utcnow()
+    _last_runs[dealer_id] = summary
+    return summary
+
+def _finish_enrichment(dealer_id: str, task: asyncio.Task):
+    _enrichment_tasks.pop(dealer_id, None)
+    if task.cancelled():
+        return
+    if task.exception() is not None:
+        print(f"Batch AI enrichment failed for dealer {dealer_id}: {str(task.exception())}")
+    elif dealer_id in _last_runs:
+        _last_runs[dealer_id]["ai_enriched"] = task.result()
+        _last_runs[dealer_id]["ai_enrichment"] = "done"
+
+async def run_batch() -> int:
+    """
+    Generate customer recommendations for every dealership (scheduled off-peak).
+    Rule output is stored for all dealerships first; AI enrichment then runs
+    once across them under the shared batch budget, most urgent customers first.
+    """
+    dealer_ids = await db.users.distinct("dealershipID", {"role": "admin"})
+    generated, pending = 0, []
+    for dealer_id in dealer_ids:
+        if not dealer_id:
+            continue
+        try:
+            summary, ranked = await _store_rule_recommendations(dealer_id)
+        except Exception as e:
+            print(f"Customer recommendation batch failed for dealer {dealer_id}: {str(e)}")
+            continue
+        summary["finished_at"] = datetime.utcnow()
+        _last_runs[dealer_id] = summary
+        generated += summary["recommendations_generated"]
+        pending.extend((priority, dealer_id, target) for priority, target in ranked)
+
+    print(f"Customer recommendation batch stored {generated} recommendations")
+    if not (GEMINI_API_KEY and pending):
+        return generated
+
+    # The most urgent customers of every dealership go first (the sort is stable)
+    pending.sort(key=lambda entry: PRIORITY_ORDER[entry[0]])
+    waiting = {dealer_id for _, dealer_id, _ in pending}
+    pending = pending[:AI_BATCH_MAX_CALLS]
+    planned = Counter(dealer_id for _, dealer_id, _ in pending)
+    for dealer_id in waiting:
+        _last_runs[dealer_id].update(
+            ai_enrichment="batched" if planned[dealer_id] else "skipped",
+            ai_calls_planned=planned[dealer_id]
+        )
+
+    enriched = await enrich_batch([target for _, _, target in pending])
+    for dealer_id in planned:
+        _last_runs[dealer_id]["ai_enrichment"] = "done"
+    print(f"Customer recommendation batch enriched {enriched} recommendations")
+    return generated
+
+def get_stats() -> dict:
+    return {
+        "concurrency": AI_BATCH_CONCURRENCY,
+        "calls_per_minute": AI_BATCH_CALLS_PER_MINUTE,
+        "max_calls_per_run": AI_BATCH_MAX_CALLS,
+        "enrichments_running": sorted(_enrichment_tasks),
+        "last_runs": _last_runs
+    }
+
+async def stop():
+    """Cancel batch enrichments still running at shutdown"""
+    tasks = list(_enrichment_tasks.values())
+    for task in tasks:
+        task.cancel()
+    await asyncio.gather(*tasks, return_exceptions=True)
@@ -0,0 +1,347 @@
+"""
+Transfer and usage recommendation generation for a dealership.
+
+Matches pending orders against nearby occupied machines of the same type,
+pairs overutilized machines with idle ones, and stores a rule-based fleet
+usage recommendation that Gemini refines in the background. Used by the
+admin generate endpoint and the scheduled off-peak refresh.
+"""
+import uuid
+import motor.motor_asyncio
+from decouple import config
+from datetime import datetime, timedelta
+from math import radians, sin, cos, sqrt, atan2
+from pymongo import ReturnDocument
+
+from . import single_flight
+from .ai_recommendations import generate_ai_recommendation, enrich_in_background, enrichment_fields
+from .recommendation_rules import fleet_metrics, recommend, summarize
+from .utilization import fleet_stats, SHIFT
+
+# MongoDB connection
+MONGODB_URL = config("MONGODB_URL")
+client = motor.motor_asyncio.AsyncIOMotorClient(MONGODB_URL)
+db = client.caterpillar_db
+
+GENERATE_OPERATION = "generate-recommendations"
+SCHEDULER_USER = "system:scheduler"
+
+# Per-dealer budget for the scheduled refresh, which has no client waiting on it
+REFRESH_TIMEOUT_SECONDS = float(config("RECOMMENDATION_REFRESH_TIMEOUT_SECONDS", default="900"))
+
+def calculate_distance(lat1, lon1, lat2, lon2):
+    """Calculate distance between two coordinates in kilometers"""
+    R = 6371.0  # Earth radius in kilometers
+    dlat = radians(lat2 - lat1)
+    dlon = radians(lon2 - lon1)
+    a = sin(dlat/2)**2 + cos(radians(lat1)) * cos(radians(lat2)) * sin(dlon/2)**2
+    c = 2 * atan2(sqrt(a), sqrt(1 - a))
+    return R * c
+
+async def ensure_indexes():
+    await db.transfers.create_index([("machineID", 1), ("status", 1)])
+
+async def _upsert_pending_transfer(transfer_doc: dict, identity: tuple) -> dict:
+    """
+    Store a pending transfer, refreshing the pending one with the same
+    identity fields instead of adding a duplicate on every run
+    """
+    query = {field: transfer_doc[field] for field in identity}
+    query["status"] = "pending"
+    fields = {name: value for name, value in transfer_doc.items() if name not in ("transferID", "createdAt")}
+    return await db.transfers.find_one_and_update(
+        query,
+        {
+            "$set": fields,
+            "$setOnInsert": {"transferID": transfer_doc["transferID"], "createdAt": transfer_doc["createdAt"]}
+        },
+        upsert=True,
+        return_document=ReturnDocument.AFTER
+    )
+
+async def generate_for_dealer(dealer_id: str, created_by: str) -> dict:
+    """Store transfer and usage recommendations for a dealership; returns a summary"""
+    # === EXISTING TRANSFER LOGIC INTEGRATION ===
+
+    # Get all pending orders that need machines
+    pending_orders = await db.neworders.find({
+        "status": "Pending"
+    }).to_list(length=None)
+
+    # Get all occupied machines from this dealership
+    occupied_machines = await db.machines.find({
+        "dealerID": dealer_id,
+        "status": "Occupied",
+        "userID": {"$ne": None}
+    }).to_list(length=None)
+
+    # Get ready machines for additional transfer opportunities
+    ready_machines = await db.machines.find({
+        "dealerID": dealer_id,
+        "status": "Ready"
+    }).to_list(length=None)
+
+    all_machines = occupied_machines + ready_machines
+    transfer_opportunities = []
+    max_distance = 100000.0  # km
+
+    # === DISTANCE-BASED TRANSFER OPTIMIZATION ===
+
+    for order in pending_orders:
+        if not order.get("location"):
+            continue
+
+        order_coords = order["location"].split(", ")
+        if len(order_coords) != 2:
+            continue
+
+        try:
+            order_lat, order_lon = float(order_coords[0]), float(order_coords[1])
+        except (ValueError, TypeError):
+            continue
+
+        # Find machines of the same type that could be transferred
+        suitable_machines = [
+            m for m in occupied_machines
+            if order["machineType"].lower() in m.get("machineType", "").lower()
+        ]
+
+        for machine in suitable_machines:
+            if not machine.get("location"):
+                continue
+
+            machine_coords = machine["location"].split(", ")
+            if len(machine_coords) != 2:
+                continue
+
+            try:
+                machine_lat, machine_lon = float(machine_coords[0]), float(machine_coords[1])
+            except (ValueError, TypeError):
+                continue
+
+            # Calculate distance from machine to order location
+            machine_to_order_distance = calculate_distance(
+                machine_lat, machine_lon, order_lat, order_lon
+            )
+
+            # Only consider if within reasonable distance
+            if machine_to_order_distance <= max_distance:
+                # Calculate potential savings
+                cost_per_km = 2.5  # Updated cost per km
+                estimated_dealer_distance = machine_to_order_distance * 1.5  # Rough estimate
+
+                current_cost = estimated_dealer_distance * cost_per_km
+                transfer_cost = machine_to_order_distance * cost_per_km
+                estimated_savings = max(0, current_cost - transfer_cost)
+
+                if estimated_savings > 10:  # Only if savings > $10
+                    # Check if machine will be free soon
+                    machine_free_date = machine.get("checkInDate")
+                    order_needed_date = order.get("checkInDate")
+
+                    time_compatibility = True
+                    if machine_free_date and order_needed_date:
+                        try:
+                            if isinstance(machine_free_date, str):
+                                machine_free = datetime.fromisoformat(machine_free_date.replace('Z', '+00:00'))
+                            else:
+                                machine_free = machine_free_date
+
+                            if isinstance(order_needed_date, str):
+                                order_needed = datetime.fromisoformat(order_needed_date.replace('Z', '+00:00'))
+                            else:
+                                order_needed = order_needed_date
+
+                            # Machine should be free before or close to when order needs it
+                            time_compatibility = machine_free <= order_needed + timedelta(days=2)
+                        except:
+                            time_compatibility = True  # If dates are unclear, assume compatible
+
+                    if time_compatibility:
+                        # Get user details
+                        current_user_doc = await db.users.find_one({"userID": machine["userID"]})
+                        requesting_user_doc = await db.users.find_one({"userID": order["userID"]})
+
+                        # Create transfer recommendation
+                        transfer_doc = {
+                            "transferID": str(uuid.uuid4()),
+                            "machineID": machine["machineID"],
+                            "dealerID": dealer_id,
+                            "userID1": machine["userID"],
+                            "userID2": order["userID"],
+                            "orderID": order.get("orderID"),
+                            "location1": {"lat": machine_lat, "lon": machine_lon},
+                            "location2": {"lat": order_lat, "lon": order_lon},
+                            "status": "pending",
+                            "transferType": "distance_optimized",
+                            "recommendationReason": f"Transfer {machine['machineType']} from {current_user_doc['name'] if current_user_doc else 'Unknown'} to {requesting_user_doc['name'] if requesting_user_doc else 'Unknown'} - Save ${estimated_savings:.2f} in transport costs",
+                            "estimatedSavings": round(estimated_savings, 2),
+                            "distanceSaved": round(estimated_dealer_distance - machine_to_order_distance, 2),
+                            "machineAvailableDate": machine_free_date,
+                            "orderRequiredDate": order_needed_date,
+                            "createdBy": created_by,
+                            "createdAt": datetime.utcnow(),
+                            "updatedAt": datetime.utcnow()
+                        }
+
+                        transfer_opportunities.append(
+                            await _upsert_pending_transfer(transfer_doc, ("machineID", "orderID", "transferType"))
+                        )
+
+    # === UTILIZATION-BASED TRANSFER OPPORTUNITIES ===
+
+    # Shift-based utilization of the whole fleet, computed once
+    fleet = fleet_stats(all_machines, SHIFT, over=80, under=30)
+    machine_utilization = fleet["per_machine"]
+
+    # Find underutilized and overutilized machines for additional transfers
+    for machine1 in occupied_machines:
+        utilization1 = machine_utilization.get(machine1["machineID"])
+
+        # Machines without usage data are neither sources nor targets
+        if utilization1 is not None and utilization1 > 80:  # Overutilized
+            for machine2 in all_machines:
+                if machine2["machineID"] == machine1["machineID"]:
+                    continue
+
+                utilization2 = machine_utilization.get(machine2["machineID"])
+                underutilized = utilization2 is not None and utilization2 < 30
+
+                if (machine2.get("status") == "Ready" or underutilized) and machine1.get("machineType") == machine2.get("machineType"):
+
+                    # Avoid duplicates
+                    existing_transfer = next((
+                        t for t in transfer_opportunities
+                        if t["machineID"] == machine1["machineID"]
+                    ), None)
+
+                    if not existing_transfer:
+                        transfer_doc = {
+                            "transferID": str(uuid.uuid4()),
+                            "machineID": machine1["machineID"],
+                            "dealerID": dealer_id,
+                            "userID1": machine1["userID"],
+                            "userID2": machine2.get("userID", "unassigned"),
+                            "location1": {"lat": 0.0, "lon": 0.0},
+                            "location2": {"lat": 0.0, "lon": 0.0},
+                            "status": "pending",
+                            "transferType": "utilization_optimized",
+                            "recommendationReason": f"Transfer overutilized {machine1['machineType']} ({utilization1:.1f}% utilization) to balance fleet usage",
+                            "estimatedSavings": 200,  # Estimated maintenance savings
+                            "utilizationImprovement": abs(utilization1 - (utilization2 or 0.0)),
+                            "createdBy": created_by,
+                            "createdAt": datetime.utcnow(),
+                            "updatedAt": datetime.utcnow()
+                        }
+
+                        transfer_opportunities.append(
+                            await _upsert_pending_transfer(transfer_doc, ("machineID", "userID2", "transferType"))
+                        )
+                        break  # Only one transfer per overutilized machine
+
+    # === USAGE RECOMMENDATIONS ===
+
+    # Calculate comprehensive statistics
+    total_machines = len(all_machines)
+    active_machines = len(occupied_machines)
+    machine_types = list(set(m.get("machineType", "Unknown") for m in all_machines))
+    locations = list(set(m.get("location", "Unknown") for m in all_machines if m.get("location")))
+
+    machine_data = {
+        "total_machines": total_machines,
+        "active_machines": active_machines,
+        "machine_types": machine_types,
+        "locations": locations
+    }
+
+    utilization_stats = {
+        "avg_utilization": fleet["mean"],
+        "total_idle_hours": fleet["total_idle_hours"],
+        "total_engine_hours": fleet["total_engine_hours"],
+        "avg_operating_days": fleet["avg_operating_days"],
+        "overutilized_count": fleet["overutilized_count"],
+        "underutilized_count": fleet["underutilized_count"],
+        "utilization_variance": fleet["range"],
+        "utilization_percentiles": fleet["percentiles"],
+        "utilization_by_type": fleet["by_type"],
+        "avg_transport_cost": 75
+    }
+
+    # Rule-based usage recommendation, refined by Gemini in the background
+    usage_rules = recommend(fleet_metrics(all_machines), "fleet")
+    usage_rec_id = str(uuid.uuid4())
+    usage_rec_doc = {
+        "recommendationID": usage_rec_id,
+        "type": "usage_optimization",
+        "dealerID": dealer_id,
+        **summarize(usage_rules),
+        "rules": usage_rules,
+        "ai_generated": False,
+        "status": "active",
+        "createdAt": datetime.utcnow(),
+        "updatedAt": datetime.utcnow()
+    }
+
+    # The new fleet recommendation supersedes the previous run's
+    await db.recommendations.update_many(
+        {"type": "usage_optimization", "dealerID": dealer_id, "userID": {"$exists": False}, "status": "active"},
+        {"$set": {"status": "superseded", "updatedAt": datetime.utcnow()}}
+    )
+    usage_result = await db.recommendations.insert_one(usage_rec_doc)
+    usage_generated = 1 if usage_result.inserted_id else 0
+
+    # One enrichment per dealership at a time; it refines the newest fleet
+    # recommendation, including one stored while it was running
+    async def apply_enrichment(usage_recommendation: dict):
+        latest = await db.recommendations.find_one(
+            {"type": "usage_optimization", "dealerID": dealer_id, "userID": {"$exists": False}},
+            {"recommendationID": 1},
+            sort=[("createdAt", -1)]
+        )
+        now = datetime.utcnow()
+        await db.recommendations.update_one(
+            {"recommendationID": latest["recommendationID"] if latest else usage_rec_id},
+            {"$set": {**enrichment_fields(usage_recommendation), "enrichedAt": now, "updatedAt": now}}
+        )
+
+    ai_enrichment = enrich_in_background(
+        f"usage:{dealer_id}",
+        lambda: generate_ai_recommendation(machine_data, utilization_stats, "usage"),
+        apply_enrichment
+    )
+
+    return {
+        "usage_recommendations_generated": usage_generated,
+        "usage_recommendations": usage_rules,
+        "ai_enrichment": ai_enrichment,
+        "transfer_opportunities_generated": len(transfer_opportunities),
+        "machine_analysis": {
+            "total_analyzed": total_machines,
+            "avg_utilization": round(fleet["mean"], 2),
+            "optimization_opportunities": fleet["overutilized_count"] + fleet["underutilized_count"],
+            "pending_orders_analyzed": len(pending_orders),
+            "distance_based_transfers": len([t for t in transfer_opportunities if t["transferType"] == "distance_optimized"]),
+            "utilization_based_transfers": len([t for t in transfer_opportunities if t["transferType"] == "utilization_optimized"])
+        },
+        "transfer_breakdown": {
+            "distance_optimized": len([t for t in transfer_opportunities if t["transferType"] == "distance_optimized"]),
+            "utilization_optimized": len([t for t in transfer_opportunities if t["transferType"] == "utilization_optimized"]),
+            "total_potential_savings": sum(t.get("estimatedSavings", 0) for t in transfer_opportunities)
+        }
+    }
+
+async def run_refresh():
+    """Regenerate recommendations for every dealership (scheduled off-peak)"""
+    dealer_ids = await db.users.distinct("dealershipID", {"role": "admin"})
+    for dealer_id in dealer_ids:
+        if not dealer_id:
+            continue
+        try:
+            # Joins an admin's generate run for the same dealership if one is in flight
+            await single_flight.run(
+                GENERATE_OPERATION, dealer_id, None,
+                lambda: generate_for_dealer(dealer_id, SCHEDULER_USER),
+                timeout_seconds=REFRESH_TIMEOUT_SECONDS
+            )
+        except Exception as e:
+            print(f"Recommendation refresh failed for dealer {dealer_id}: {str(e)}")
@@ -0,0 +1,138 @@
+"""
+Materialized per-dealer machine and request counters.
+
+One `dealer_stats` document per dealer holds the total machine count and
+counts per machine status and per request status. Counters are adjusted
+with $inc from change events; a periodic reconcile recomputes them from
+the source collections to correct any drift.
+"""
+import motor.motor_asyncio
+from collections import defaultdict
+from decouple import config
+from datetime import datetime
+from typing import Optional
+
+from . import events
+
+# MongoDB connection
+MONGODB_URL = config("MONGODB_URL")
+client = motor.motor_asyncio.AsyncIOMotorClient(MONGODB_URL)
+db = client.caterpillar_db
+
+def _status_key(status) -> str:
+    status = getattr(status, "value", status) or "Unknown"
+    return str(status).replace(".", "_")
+
+async def _apply_increments(increments: dict):
+    for dealer_id, fields in increments.items():
+        fields = {field: amount for field, amount in fields.items() if amount}
+        if not fields:
+            continue
+        await db.dealer_stats.update_one(
+            {"_id": dealer_id},
+            {"$inc": fields, "$set": {"updatedAt": datetime.utcnow()}},
+            upsert=True
+        )
+
+async def handle_machine_change(event: dict):
+    """Move a machine between status counters (or in/out of the total)"""
+    increments = defaultdict(lambda: defaultdict(int))
+
+    before = event.get("before")
+    if before and before.get("dealerID"):
+        counters = increments[before["dealerID"]]
+        counters["total"] -= 1
+        counters[f"machines.{_status_key(before.get('status'))}"] -= 1
+
+    after = event.get("after")
+    if after and after.get("dealerID"):
+        counters = increments[after["dealerID"]]
+        counters["total"] += 1
+        counters[f"machines.{_status_key(after.get('status'))}"] += 1
+
+    await _apply_increments(increments)
+
+async def handle_request_change(event: dict):
+    """Move a request between status counters of its machine's dealer"""
+    if event.get("before_status") == event.get("after_status"):
+        return
+
+    machine = await db.machines.find_one(
+        {"machineID": event.get("machineID")},
+        {"dealerID": 1}
+    )
+    if not machine or not machine.get("dealerID"):
+        return
+
+    counters = defaultdict(int)
+    if event.get("before_status") is not None:
+        counters[f"requests.{_status_key(event['before_status'])}"] -= 1
+    if event.get("after_status") is not None:
+        counters[f"requests.{_status_key(event['after_status'])}"] += 1
+
+    await _apply_increments({machine["dealerID"]: counters})
+
+async def reconcile(dealer_id: Optional[str] = None) -> int:
+    """Recompute counters from machines and requests, overwriting any drift"""
+    machine_match = {"dealerID": dealer_id} if dealer_id else {"dealerID": {"$ne": None}}
+    stats = defaultdict(lambda: {"total": 0, "machines": {}, "requests": {}})
+
+    machine_counts = db.machines.aggregate([
+        {"$match": machine_match},
+        {"$group": {"_id": {"dealerID": "$dealerID", "status": "$status"}, "count": {"$sum": 1}}}
+    ])
+    async for group in machine_counts:
+        doc = stats[group["_id"]["dealerID"]]
+        doc["total"] += group["count"]
+        doc["machines"][_status_key(group["_id"].get("status"))] = group["count"]
+
+    request_counts = db.requests.aggregate([
+        {
+            "$lookup": {
+                "from": "machines",
+                "localField": "machineID",
+                "foreignField": "machineID",
+                "as": "machine"
+            }
+        },
+        {"$unwind": "$machine"},
+        {"$match": {f"machine.{field}": value for field, value in machine_match.items()}},
+        {"$group": {"_id": {"dealerID": "$machine.dealerID", "status": "$status"}, "count": {"$sum": 1}}}
+    ])
+    async for group in request_counts:
+        doc = stats[group["_id"]["dealerID"]]
+        doc["requests"][_status_key(group["_id"].get("status"))] = group["count"]
+
+    if dealer_id:
+        # A dealer with no machines still gets an (empty) document
+        stats.setdefault(dealer_id, {"total": 0, "machines": {}, "requests": {}})
+
+    for stats_dealer_id, doc in stats.items():
+        await db.dealer_stats.update_one(
+            {"_id": stats_dealer_id},
+            {"$set": {**doc, "updatedAt": datetime.utcnow(), "reconciledAt": datetime.utcnow()}},
+            upsert=True
+        )
+    return len(stats)
+
+async def get_dealer_stats(dealer_id: str) -> dict:
+    """Counters for a dealer by primary key, built on first access"""
+    stats = await db.dealer_stats.find_one({"_id": dealer_id})
+    if not stats:
+        await reconcile(dealer_id)
+        stats = await db.dealer_stats.find_one({"_id": dealer_id}) or {}
+
+    machines = stats.get("machines", {})
+    requests = stats.get("requests", {})
+    return {
+        "total": stats.get("total", 0),
+        "machines": machines,
+        "requests": requests,
+        "active": machines.get("Occupied", 0) + machines.get("In-transit", 0),
+        "pending_requests": requests.get("In-Progress", 0)
+    }
+
+def register():
+    """Subscribe the counters to machine and request change events"""
+    events.subscribe(events.MACHINE_CHANGED, handle_machine_change)
+    events.subscribe(events.REQUEST_CHANGED, handle_request_change)
@@ -0,0 +1,114 @@
+import asyncio
+from collections import defaultdict
+from typing import Optional
+
+# Event topics
+MACHINE_CHANGED = "machine.changed"
+REQUEST_CHANGED = "request.changed"
+
+# Machine fields carried in change events
+MACHINE_EVENT_FIELDS = [
+    "machineID", "machineType", "dealerID", "userID", "status", "location",
+    "engineHoursPerDay", "idleHours", "operatingDays"
+]
+
+_subscribers = defaultdict(list)
+_inline_subscribers = defaultdict(list)
+_queue: Optional[asyncio.Queue] = None
+_worker: Optional[asyncio.Task] = None
+
+def subscribe(topic: str, handler):
+    """Register an async handler for a topic"""
+    _subscribers[topic].append(handler)
+
+def subscribe_inline(topic: str, handler):
+    """
+    Register an async handler that the writer awaits before it continues,
+    called with a list of events; keep it to a few quick round trips
+    """
+    _inline_subscribers[topic].append(handler)
+
+async def _run_inline(topic: str, payloads: list):
+    for handler in _inline_subscribers.get(topic, []):
+        try:
+            await handler(payloads)
+        except Exception as e:
+            print(f"Error handling {topic} event inline: {str(e)}")
+
+def publish(topic: str, payload: dict):
+    """Queue an event for the background dispatcher without blocking the caller"""
+    if _queue is None:
+        return
+    _queue.put_nowait((topic, payload))
+
+def machine_snapshot(machine: Optional[dict]) -> Optional[dict]:
+    """Reduce a machine document to the fields consumers care about"""
+    if not machine:
+        return None
+    return {field: machine.get(field) for field in MACHINE_EVENT_FIELDS}
+
+def _machine_payload(before: Optional[dict], after: Optional[dict]) -> Optional[dict]:
+    before_snapshot = machine_snapshot(before)
+    after_snapshot = machine_snapshot(after)
+    reference = after_snapshot or before_snapshot
+    if not reference:
+        return None
+    return {
+        "machineID": reference["machineID"],
+        "before": before_snapshot,
+        "after": after_snapshot
+    }
+
+async def emit_machine_change(before: Optional[dict], after: Optional[dict]):
+    """Publish a machine change; pass None as before/after for creates/deletes"""
+    await emit_machine_changes([(before, after)])
+
+async def emit_machine_changes(changes: list):
+    """Publish (before, after) machine changes with one inline handler pass"""
+    payloads = [payload for payload in (_machine_payload(before, after) for before, after in changes) if payload]
+    if not payloads:
+        return
+    await _run_inline(MACHINE_CHANGED, payloads)
+    for payload in payloads:
+        publish(MACHINE_CHANGED, payload)
+
+async def emit_request_change(machine_id: str, before_status, after_status, request_id: Optional[str] = None):
+    """Publish a request status change; None before_status means a new request"""
+    payload = {
+        "requestID": request_id,
+        "machineID": machine_id,
+        "before_status": getattr(before_status, "value", before_status),
+        "after_status": getattr(after_status, "value", after_status)
+    }
+    await _run_inline(REQUEST_CHANGED, [payload])
+    publish(REQUEST_CHANGED, payload)
+
+async def _dispatch():
+    while True:
+        topic, payload = await _queue.get()
+        for handler in _subscribers.get(topic, []):
+            try:
+                await handler(payload)
+            except Exception as e:
+                print(f"Error handling {topic} event: {str(e)}")
+        _queue.task_done()
+
+def start():
+    """Start the background dispatcher on the running event loop"""
+    global _queue, _worker
+    if _worker is not None:
+        return
+    _queue = asyncio.Queue()
+    _worker = asyncio.create_task(_dispatch())
+
+async def stop():
+    """Stop the dispatcher, dropping any events still queued"""
+    global _queue, _worker
+    if _worker is None:
+        return
+    _worker.cancel()
+    try:
+        await _worker
+    except asyncio.CancelledError:
+        pass
+    _queue, _worker = None, None
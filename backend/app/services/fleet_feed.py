@@ -0,0 +1,293 @@
+"""
+Live machine-location feed for the fleet map.
+
+Subscribers (one dealer or one customer scope each) receive an initial
+snapshot followed by per-machine deltas. Deltas come from a Mongo change
+stream on `machines`; against a standalone server without change streams
+the feed falls back to polling `updatedAt` and learns about deletes from
+the in-process event bus.
+"""
+import asyncio
+import motor.motor_asyncio
+from collections import defaultdict
+from decouple import config
+from datetime import datetime
+from typing import Optional
+from pymongo.errors import OperationFailure
+
+from . import events
+from .serialization import dumps
+
+# MongoDB connection
+MONGODB_URL = config("MONGODB_URL")
+client = motor.motor_asyncio.AsyncIOMotorClient(MONGODB_URL)
+db = client.caterpillar_db
+
+FLEET_FEED_POLL_SECONDS = float(config("FLEET_FEED_POLL_SECONDS", default="5"))
+FLEET_FEED_HEARTBEAT_SECONDS = float(config("FLEET_FEED_HEARTBEAT_SECONDS", default="15"))
+FLEET_FEED_QUEUE_SIZE = int(config("FLEET_FEED_QUEUE_SIZE", default="1000"))
+# Delay before restarting the watcher after an unexpected error
+FLEET_FEED_RETRY_SECONDS = float(config("FLEET_FEED_RETRY_SECONDS", default="5"))
+
+# Map position for machines without parseable coordinates (Bangalore center)
+DEFAULT_LATITUDE = 12.9716
+DEFAULT_LONGITUDE = 77.5946
+
+_subscribers = defaultdict(set)
+# Last known scopes and document id of every machine a current subscriber
+# can see; machines no subscriber watches are forgotten
+_owners = {}
+_machine_ids = {}
+_watcher: Optional[asyncio.Task] = None
+_mode = None
+
+def parse_location(machine: dict) -> tuple:
+    """Latitude, longitude and address from a "[address, ]lat, lon" location string"""
+    if not machine.get("location"):
+        return DEFAULT_LATITUDE, DEFAULT_LONGITUDE, machine.get("siteID", "Unknown Location")
+
+    location_parts = machine["location"].split(",")
+    if len(location_parts) < 2:
+        return DEFAULT_LATITUDE, DEFAULT_LONGITUDE, machine.get("location", "Unknown Location")
+
+    try:
+        longitude = float(location_parts[-1].strip())
+        latitude = float(location_parts[-2].strip())
+    except (ValueError, IndexError):
+        return DEFAULT_LATITUDE, DEFAULT_LONGITUDE, machine.get("location", "Unknown Location")
+
+    # Anything before the coordinates is the address
+    if len(location_parts) > 2:
+        address = ",".join(location_parts[:-2]).strip()
+    else:
+        address = machine.get("siteID", "Machine Location")
+    return latitude, longitude, address
+
+async def lookup_users(user_ids) -> dict:
+    """Users by userID in a single $in query"""
+    user_ids = list({user_id for user_id in user_ids if user_id})
+    if not user_ids:
+        return {}
+    users = await db.users.find(
+        {"userID": {"$in": user_ids}},
+        {"userID": 1, "name": 1, "emailID": 1, "email": 1}
+    ).to_list(length=None)
+    return {user["userID"]: user for user in users}
+
+def format_location(machine: dict, users: dict) -> dict:
+    """Map marker for a machine, with the assigned user's details if any"""
+    latitude, longitude, address = parse_location(machine)
+
+    user_info = None
+    machine_user_id = machine.get("userID")
+    if machine_user_id:
+        user = users.get(machine_user_id) or {}
+        user_info = {
+            "userID": machine_user_id,
+            "userName": user.get("name", "Unknown User"),
+            "userEmail": user.get("emailID", user.get("email"))
+        }
+
+    return {
+        "machineID": machine.get("machineID", "Unknown"),
+        "machineType": machine.get("machineType", "Unknown"),
+        "status": machine.get("status", "Unknown"),
+        "latitude": latitude,
+        "longitude": longitude,
+        "address": address,
+        "siteID": machine.get("siteID"),
+        "userInfo": user_info,
+        "dealerID": machine.get("dealerID"),
+        "engineHoursPerDay": machine.get("engineHoursPerDay", 0),
+        "idleHours": machine.get("idleHours", 0),
+        "operatingDays": machine.get("operatingDays", 0),
+        "checkOutDate": machine.get("checkOutDate"),
+        "checkInDate": machine.get("checkInDate"),
+        "lastUpdated": machine.get("updatedAt", machine.get("createdAt"))
+    }
+
+async def format_locations(machines: list) -> list:
+    users = await lookup_users(machine.get("userID") for machine in machines)
+    return [format_location(machine, users) for machine in machines]
+
+def scope_query(current_user: dict) -> dict:
+    """Machines visible to a user: the dealership's fleet or a customer's rentals"""
+    if current_user["role"] == "admin":
+        return {"dealerID": current_user["dealershipID"]}
+    return {"userID": current_user["userID"]}
+
+def user_scope(current_user: dict) -> tuple:
+    if current_user["role"] == "admin":
+        return ("dealer", current_user["dealershipID"])
+    return ("user", current_user["userID"])
+
+def machine_scopes(machine: dict) -> set:
+    scopes = set()
+    if machine.get("dealerID"):
+        scopes.add(("dealer", machine["dealerID"]))
+    if machine.get("userID"):
+        scopes.add(("user", machine["userID"]))
+    return scopes
+
+def sse_event(event: str, data) -> bytes:
+    """Encode one Server-Sent Events message"""
+    return b"event: " + event.encode() + b"\ndata: " + dumps(data) + b"\n\n"
+
+def _remember(machine: dict) -> set:
+    previous = _owners.get(machine.get("machineID"), set())
+    _owners[machine.get("machineID")] = machine_scopes(machine)
+    if machine.get("_id") is not None:
+        _machine_ids[machine["_id"]] = machine.get("machineID")
+    return previous
+
+def _watched(scopes: set) -> bool:
+    return any(scope in _subscribers for scope in scopes)
+
+def _forget(machine: dict):
+    _owners.pop(machine.get("machineID"), None)
+    _machine_ids.pop(machine.get("_id"), None)
+
+def _prune():
+    """Forget machines that no remaining subscriber can see"""
+    for machine_id, scopes in list(_owners.items()):
+        if not _watched(scopes):
+            del _owners[machine_id]
+    for document_id, machine_id in list(_machine_ids.items()):
+        if machine_id not in _owners:
+            del _machine_ids[document_id]
+
+def _send(scope: tuple, delta: dict):
+    for queue in list(_subscribers.get(scope, ())):
+        try:
+            queue.put_nowait(delta)
+        except asyncio.QueueFull:
+            # Slow consumer: drop its backlog and ask it to reload the snapshot
+            while not queue.empty():
+                queue.get_nowait()
+            queue.put_nowait({"type": "resync"})
+
+async def publish_machines(machines: list):
+    """Send upserts for changed machines, and removals to scopes they left"""
+    users = await lookup_users(machine.get("userID") for machine in machines)
+    for machine in machines:
+        if not _watched(machine_scopes(machine) | _owners.get(machine.get("machineID"), set())):
+            _forget(machine)
+            continue
+        previous = _remember(machine)
+        location = format_location(machine, users)
+        for scope in _owners[machine.get("machineID")]:
+            _send(scope, {"type": "upsert", "location": location})
+        for scope in previous - _owners[machine.get("machineID")]:
+            _send(scope, {"type": "remove", "machineID": machine.get("machineID")})
+
+def publish_removal(machine_id: str, scopes: Optional[set] = None):
+    """Tell every scope that could see a machine that it is gone"""
+    for scope in _owners.pop(machine_id, set()) | (scopes or set()):
+        _send(scope, {"type": "remove", "machineID": machine_id})
+
+async def _watch_changes():
+    async with db.machines.watch(full_document="updateLookup") as stream:
+        async for change in stream:
+            operation = change.get("operationType")
+            if operation == "delete":
+                machine_id = _machine_ids.pop(change["documentKey"]["_id"], None)
+                if machine_id:
+                    publish_removal(machine_id)
+            elif change.get("fullDocument"):
+                await publish_machines([change["fullDocument"]])
+
+async def _poll_changes():
+    watermark = datetime.utcnow()
+    seen_at_watermark = set()
+    while True:
+        await asyncio.sleep(FLEET_FEED_POLL_SECONDS)
+        if not _subscribers:
+            watermark, seen_at_watermark = datetime.utcnow(), set()
+            continue
+
+        changed = await db.machines.find(
+            {"updatedAt": {"$gte": watermark}}
+        ).sort("updatedAt", 1).to_list(length=None)
+        changed = [machine for machine in changed if machine["_id"] not in seen_at_watermark]
+        if not changed:
+            continue
+
+        latest = changed[-1]["updatedAt"]
+        if latest > watermark:
+            watermark, seen_at_watermark = latest, set()
+        seen_at_watermark.update(machine["_id"] for machine in changed if machine["updatedAt"] == watermark)
+        await publish_machines(changed)
+
+async def _run():
+    global _mode
+    # Restart on any error: existing subscribers have no other way to get
+    # the watcher back. A restart may miss changes, so they resync.
+    while True:
+        try:
+            if _mode == "poll":
+                await _poll_changes()
+            else:
+                _mode = "change_stream"
+                await _watch_changes()
+        except asyncio.CancelledError:
+            raise
+        except OperationFailure as e:
+            if _mode == "change_stream":
+                # Standalone servers have no change streams
+                print(f"Fleet feed falling back to polling: {str(e)}")
+                _mode = "poll"
+                continue
+            print(f"Fleet feed watcher failed, restarting: {str(e)}")
+        except Exception as e:
+            print(f"Fleet feed watcher failed, restarting: {str(e)}")
+        await asyncio.sleep(FLEET_FEED_RETRY_SECONDS)
+        for scope in list(_subscribers):
+            _send(scope, {"type": "resync"})
+
+def _ensure_watcher():
+    global _watcher
+    if _watcher is None or _watcher.done():
+        _watcher = asyncio.create_task(_run())
+
+async def subscribe(current_user: dict) -> tuple:
+    """Register a subscriber queue and return it with the initial snapshot"""
+    queue = asyncio.Queue(maxsize=FLEET_FEED_QUEUE_SIZE)
+    _subscribers[user_scope(current_user)].add(queue)
+    _ensure_watcher()
+
+    try:
+        machines = await db.machines.find(scope_query(current_user)).to_list(length=None)
+        for machine in machines:
+            _remember(machine)
+        return queue, await format_locations(machines)
+    except BaseException:
+        unsubscribe(current_user, queue)
+        raise
+
+def unsubscribe(current_user: dict, queue: asyncio.Queue):
+    scope = user_scope(current_user)
+    _subscribers[scope].discard(queue)
+    if not _subscribers[scope]:
+        del _subscribers[scope]
+        _prune()
+
+async def handle_machine_change(event: dict):
+    """Deletes are invisible to updatedAt polling; take them from the event bus"""
+    if _mode != "poll" or event.get("after") is not None or not event.get("before"):
+        return
+    before = event["before"]
+    publish_removal(before.get("machineID"), machine_scopes(before))
+
+def register():
+    events.subscribe(events.MACHINE_CHANGED, handle_machine_change)
+
+async def stop():
+    global _watcher
+    if _watcher is None:
+        return
+    _watcher.cancel()
+    try:
+        await _watcher
+    except (asyncio.CancelledError, Exception):
+        pass
+    _watcher = None
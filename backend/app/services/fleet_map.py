@@ -0,0 +1,153 @@
+"""
+Viewport filtering and grid clustering for the fleet map.
+
+Coordinates are parsed from the "[address, ]lat, lon" location string inside
+the aggregation, so only machines in the requested bounding box leave the
+database. Below CLUSTER_MAX_ZOOM machines are grouped into grid cells sized
+to the zoom level; at or above it individual markers are returned.
+"""
+import motor.motor_asyncio
+from decouple import config
+from typing import Optional
+
+from .fleet_feed import DEFAULT_LATITUDE, DEFAULT_LONGITUDE, format_locations
+
+# MongoDB connection
+MONGODB_URL = config("MONGODB_URL")
+client = motor.motor_asyncio.AsyncIOMotorClient(MONGODB_URL)
+db = client.caterpillar_db
+
+# Zoom from which individual machines are returned instead of clusters
+CLUSTER_MAX_ZOOM = int(config("MAP_CLUSTER_MAX_ZOOM", default="13"))
+# Grid cells per 256px map tile edge (about 64px per cell)
+CLUSTER_CELLS_PER_TILE = 4
+MAX_MARKERS = int(config("MAP_MAX_MARKERS", default="2000"))
+
+def parse_bbox(bbox: str) -> tuple:
+    """Parse "minLon,minLat,maxLon,maxLat"; raises ValueError if malformed"""
+    parts = [float(part) for part in bbox.split(",")]
+    if len(parts) != 4:
+        raise ValueError("bbox must have four comma-separated numbers")
+    min_lon, min_lat, max_lon, max_lat = parts
+    if not (-90 <= min_lat <= max_lat <= 90) or not (-180 <= min_lon <= 180 and -180 <= max_lon <= 180):
+        raise ValueError("bbox is outside valid latitude/longitude ranges")
+    return min_lon, min_lat, max_lon, max_lat
+
+def cell_size(zoom: int) -> float:
+    """Grid cell edge in degrees for a web-mercator zoom level"""
+    return 360.0 / (2 ** zoom) / CLUSTER_CELLS_PER_TILE
+
+def _coordinate(index: int) -> dict:
+    return {
+        "$cond": [
+            {"$gte": [{"$size": "$_parts"}, 2]},
+            {
+                "$convert": {
+                    "input": {"$trim": {"input": {"$arrayElemAt": ["$_parts", index]}}},
+                    "to": "double",
+                    "onError": None,
+                    "onNull": None
+                }
+            },
+            None
+        ]
+    }
+
+def _coordinate_stages(scope: dict, bbox: Optional[tuple]) -> list:
+    parsed = {"$and": [{"$ne": ["$_lat", None]}, {"$ne": ["$_lon", None]}]}
+    stages = [
+        {"$match": scope},
+        {"$addFields": {"_parts": {"$split": [{"$ifNull": ["$location", ""]}, ","]}}},
+        {"$addFields": {"_lat": _coordinate(-2), "_lon": _coordinate(-1)}},
+        # Unparseable locations sit at the default position, as on the unfiltered map
+        {
+            "$addFields": {
+                "_latitude": {"$cond": [parsed, "$_lat", DEFAULT_LATITUDE]},
+                "_longitude": {"$cond": [parsed, "$_lon", DEFAULT_LONGITUDE]}
+            }
+        }
+    ]
+
+    if bbox:
+        min_lon, min_lat, max_lon, max_lat = bbox
+        match = {"_latitude": {"$gte": min_lat, "$lte": max_lat}}
+        if min_lon <= max_lon:
+            match["_longitude"] = {"$gte": min_lon, "$lte": max_lon}
+        else:
+            # Viewport crosses the antimeridian
+            match["$or"] = [{"_longitude": {"$gte": min_lon}}, {"_longitude": {"$lte": max_lon}}]
+        stages.append({"$match": match})
+    return stages
+
+async def get_viewport_machines(scope: dict, bbox: Optional[tuple], limit: int = MAX_MARKERS) -> dict:
+    """Individual markers inside the viewport, capped at `limit`"""
+    pipeline = _coordinate_stages(scope, bbox) + [
+        {"$limit": limit + 1},
+        {"$project": {"_parts": 0, "_lat": 0, "_lon": 0, "_latitude": 0, "_longitude": 0}}
+    ]
+    machines = await db.machines.aggregate(pipeline).to_list(length=None)
+    return {
+        "mode": "machines",
+        "locations": await format_locations(machines[:limit]),
+        "truncated": len(machines) > limit
+    }
+
+async def get_viewport_clusters(scope: dict, bbox: Optional[tuple], zoom: int) -> dict:
+    """Grid clusters with count, status breakdown and centroid"""
+    size = cell_size(zoom)
+    pipeline = _coordinate_stages(scope, bbox) + [
+        {
+            "$group": {
+                "_id": {
+                    "x": {"$floor": {"$divide": ["$_longitude", size]}},
+                    "y": {"$floor": {"$divide": ["$_latitude", size]}},
+                    "status": {"$ifNull": ["$status", "Unknown"]}
+                },
+                "count": {"$sum": 1},
+                "latitude": {"$sum": "$_latitude"},
+                "longitude": {"$sum": "$_longitude"},
+                "machineID": {"$first": "$machineID"}
+            }
+        },
+        {
+            "$group": {
+                "_id": {"x": "$_id.x", "y": "$_id.y"},
+                "count": {"$sum": "$count"},
+                "latitude": {"$sum": "$latitude"},
+                "longitude": {"$sum": "$longitude"},
+                "statuses": {"$push": {"status": "$_id.status", "count": "$count"}},
+                "machineID": {"$first": "$machineID"}
+            }
+        }
+    ]
+    cells = await db.machines.aggregate(pipeline).to_list(length=None)
+
+    clusters = []
+    for cell in cells:
+        x, y = cell["_id"]["x"], cell["_id"]["y"]
+        cluster = {
+            "count": cell["count"],
+            "latitude": cell["latitude"] / cell["count"],
+            "longitude": cell["longitude"] / cell["count"],
+            "status_breakdown": {entry["status"]: entry["count"] for entry in cell["statuses"]},
+            "bounds": [x * size, y * size, (x + 1) * size, (y + 1) * size]
+        }
+        if cell["count"] == 1:
+            cluster["machineID"] = cell["machineID"]
+        clusters.append(cluster)
+
+    clusters.sort(key=lambda cluster: cluster["count"], reverse=True)
+    return {
+        "mode": "clusters",
+        "clusters": clusters,
+        "total": sum(cluster["count"] for cluster in clusters),
+        "cell_size": size
+    }
+
+async def get_viewport(scope: dict, bbox: Optional[tuple], zoom: Optional[int]) -> dict:
+    """Clusters when zoomed out, individual machines when zoomed in"""
+    if zoom is not None and zoom < CLUSTER_MAX_ZOOM:
+        result = await get_viewport_clusters(scope, bbox, zoom)
+    else:
+        result = await get_viewport_machines(scope, bbox)
+    return {**result, "zoom": zoom, "bbox": list(bbox) if bbox else None}
@@ -0,0 +1,29 @@
+"""
+Shared Gemini model handles.
+
+google.generativeai is imported and configured on the first model request
+rather than at app startup, and each GenerativeModel is constructed once
+per model name and reused by every later call.
+"""
+from decouple import config
+
+GEMINI_API_KEY = config("GEMINI_API_KEY", default="")
+
+_genai = None
+_models = {}
+
+def _client():
+    global _genai
+    if _genai is None:
+        import google.generativeai as genai
+        genai.configure(api_key=GEMINI_API_KEY)
+        _genai = genai
+    return _genai
+
+def get_model(model_name: str):
+    """Reusable GenerativeModel for a model name"""
+    model = _models.get(model_name)
+    if model is None:
+        model = _client().GenerativeModel(model_name)
+        _models[model_name] = model
+    return model
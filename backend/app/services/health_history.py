@@ -0,0 +1,152 @@
+import motor.motor_asyncio
+from decouple import config
+from datetime import datetime, timedelta
+from typing import Optional
+from pymongo import ASCENDING, UpdateOne
+from pymongo.errors import CollectionInvalid, OperationFailure
+
+# MongoDB connection
+MONGODB_URL = config("MONGODB_URL")
+client = motor.motor_asyncio.AsyncIOMotorClient(MONGODB_URL)
+db = client.caterpillar_db
+
+# Retention policy
+RAW_RETENTION_DAYS = int(config("SCORE_HISTORY_RETENTION_DAYS", default="365"))
+# Change logs are kept indefinitely unless a retention is configured; the
+# TTL index it creates conflicts with any other single-field timestamp index
+LOG_RETENTION_DAYS = int(config("SCORE_LOG_RETENTION_DAYS", default="0"))
+ROLLUP_RETENTION_DAYS = {
+    "day": int(config("SCORE_DAILY_ROLLUP_RETENTION_DAYS", default="730")),
+    "week": int(config("SCORE_WEEKLY_ROLLUP_RETENTION_DAYS", default="1825")),
+    "month": None  # Monthly rollups are kept indefinitely
+}
+
+# Widest range served from each resolution when granularity is "auto"
+AUTO_GRANULARITY = [
+    ("raw", timedelta(days=14)),
+    ("day", timedelta(days=120)),
+    ("week", timedelta(days=730)),
+]
+
+GRANULARITIES = ["auto", "raw", "day", "week", "month"]
+
+def bucket_start(timestamp: datetime, period: str) -> datetime:
+    """Start of the day, ISO week (Monday) or month containing timestamp"""
+    day = timestamp.replace(hour=0, minute=0, second=0, microsecond=0)
+    if period == "day":
+        return day
+    if period == "week":
+        return day - timedelta(days=day.weekday())
+    if period == "month":
+        return day.replace(day=1)
+    raise ValueError(f"Unknown rollup period: {period}")
+
+async def ensure_collections():
+    """Create the time-series history collection and rollup indexes"""
+    try:
+        await db.create_collection(
+            "health_score_history",
+            timeseries={"timeField": "timestamp", "metaField": "user_id", "granularity": "hours"},
+            expireAfterSeconds=RAW_RETENTION_DAYS * 86400
+        )
+    except CollectionInvalid:
+        pass  # Already exists
+    except OperationFailure:
+        # Server without time-series support: plain collection with a TTL index
+        await db.health_score_history.create_index(
+            [("user_id", ASCENDING), ("timestamp", ASCENDING)]
+        )
+        await db.health_score_history.create_index(
+            "timestamp", expireAfterSeconds=RAW_RETENTION_DAYS * 86400
+        )
+
+    await db.health_score_rollups.create_index(
+        [("user_id", ASCENDING), ("period", ASCENDING), ("bucketStart", ASCENDING)],
+        unique=True
+    )
+    await db.health_score_rollups.create_index("expiresAt", expireAfterSeconds=0)
+
+    await db.health_score_logs.create_index([("user_id", ASCENDING), ("timestamp", ASCENDING)])
+    if LOG_RETENTION_DAYS > 0:
+        await db.health_score_logs.create_index(
+            "timestamp", expireAfterSeconds=LOG_RETENTION_DAYS * 86400, name="timestamp_ttl"
+        )
+
+async def record_score(score_update_log: dict):
+    """Append a score change to the raw history and fold it into the rollups"""
+    user_id = score_update_log["user_id"]
+    score = score_update_log["new_score"]
+    timestamp = score_update_log["timestamp"]
+
+    await db.health_score_history.insert_one({
+        "timestamp": timestamp,
+        "user_id": user_id,
+        "score": score,
+        "delta": score_update_log["delta"],
+        "average_utilization": score_update_log["average_utilization"]
+    })
+
+    operations = []
+    for period, retention_days in ROLLUP_RETENTION_DAYS.items():
+        start = bucket_start(timestamp, period)
+        on_insert = {"openScore": score}
+        if retention_days is not None:
+            on_insert["expiresAt"] = start + timedelta(days=retention_days)
+        operations.append(UpdateOne(
+            {"user_id": user_id, "period": period, "bucketStart": start},
+            {
+                "$setOnInsert": on_insert,
+                "$set": {"closeScore": score, "lastAt": timestamp},
+                "$min": {"minScore": score},
+                "$max": {"maxScore": score},
+                "$inc": {"count": 1, "scoreSum": score}
+            },
+            upsert=True
+        ))
+    await db.health_score_rollups.bulk_write(operations, ordered=False)
+
+def resolve_granularity(granularity: str, start: datetime, end: datetime) -> str:
+    if granularity != "auto":
+        return granularity
+    span = end - start
+    for resolution, max_span in AUTO_GRANULARITY:
+        if span <= max_span:
+            return resolution
+    return "month"
+
+async def get_history(
+    user_id: str,
+    start: datetime,
+    end: datetime,
+    granularity: str = "auto"
+) -> dict:
+    """Score series for a range, served by one indexed query at the chosen resolution"""
+    resolution = resolve_granularity(granularity, start, end)
+
+    if resolution == "raw":
+        cursor = db.health_score_history.find(
+            {"user_id": user_id, "timestamp": {"$gte": start, "$lte": end}},
+            {"_id": 0, "timestamp": 1, "score": 1, "delta": 1, "average_utilization": 1}
+        ).sort("timestamp", 1)
+        points = await cursor.to_list(length=None)
+    else:
+        cursor = db.health_score_rollups.find(
+            {
+                "user_id": user_id,
+                "period": resolution,
+                "bucketStart": {"$gte": bucket_start(start, resolution), "$lte": end}
+            },
+            {"_id": 0, "user_id": 0, "period": 0, "expiresAt": 0}
+        ).sort("bucketStart", 1)
+        points = []
+        async for bucket in cursor:
+            bucket["avgScore"] = round(bucket.pop("scoreSum") / bucket["count"], 2)
+            points.append(bucket)
+
+    return {
+        "user_id": user_id,
+        "granularity": resolution,
+        "start": start,
+        "end": end,
+        "points": points
+    }
@@ -0,0 +1,339 @@
+"""
+Incremental health scoring driven by machine change events.
+
+Each user's utilization is kept as a stored aggregate: a map of machine ID
+to utilization plus the summary derived from it. Workers only hold the
+machines that changed; bursts of events for the same user are debounced
+into one update that rewrites just those machines' entries and recomputes
+the summary inside the same atomic update, so flushes from different
+workers merge instead of overwriting each other.
+
+Events only maintain the aggregate; the health score itself moves one step
+per user per night in run_batch_scoring (or on an admin's explicit
+recalculation), so how often machines report does not move the score.
+"""
+import asyncio
+import motor.motor_asyncio
+from decouple import config
+from datetime import datetime
+from typing import Optional, List, Tuple
+from pymongo import ReturnDocument
+from pymongo.errors import DuplicateKeyError
+
+from . import events, health_history
+from .telemetry_rollup import get_machine_usage, with_usage
+
+# MongoDB connection
+MONGODB_URL = config("MONGODB_URL")
+client = motor.motor_asyncio.AsyncIOMotorClient(MONGODB_URL)
+db = client.caterpillar_db
+
+# Scoring parameters
+BASE_SCORE = 700
+MAX_SCORE = 850
+MIN_SCORE = 300
+
+SCORE_DEBOUNCE_SECONDS = float(config("SCORE_DEBOUNCE_SECONDS", default="5"))
+BATCH_UPDATER = "system:nightly"
+
+# Fields whose change can move a user's utilization
+UTILIZATION_FIELDS = ["userID", "status", "engineHoursPerDay", "idleHours"]
+
+# user -> {machineID: (occupied, utilization)} not yet written
+_pending = {}
+_last_event = {}
+_flush_tasks = {}
+
+def machine_utilization(machine: dict) -> Optional[float]:
+    """Utilization percentage of a machine, or None when it has no usage data"""
+    engine_hours = machine.get("engineHoursPerDay") or 0.0
+    idle_hours = machine.get("idleHours") or 0.0
+    total_hours = engine_hours + idle_hours
+    if total_hours > 0:
+        return (engine_hours / total_hours) * 100
+    return None
+
+def score_delta(average_utilization: float) -> Tuple[int, str]:
+    """Score change and reason for an average utilization"""
+    if 10 <= average_utilization <= 80:
+        return 5, f"Good utilization ({average_utilization:.1f}%) - score increased"
+    elif average_utilization < 10:
+        return -2, f"Low utilization ({average_utilization:.1f}%) - score decreased slightly"
+    else:  # average_utilization > 80
+        return -8, f"High utilization ({average_utilization:.1f}%) - risk of overuse, score decreased"
+
+async def apply_score_update(
+    user_id: str,
+    average_utilization: float,
+    machine_ids: List[str],
+    updated_by: str
+) -> Optional[dict]:
+    """Apply one scoring step to a user and log it; returns the log entry"""
+    user = await db.users.find_one({"userID": user_id})
+    if not user:
+        return None
+
+    current_score = user.get("health_score", BASE_SCORE) or BASE_SCORE
+    delta, reason = score_delta(average_utilization)
+    new_score = max(MIN_SCORE, min(MAX_SCORE, current_score + delta))
+
+    await db.users.update_one(
+        {"userID": user_id},
+        {
+            "$set": {
+                "health_score": new_score,
+                "score_last_updated": datetime.utcnow()
+            }
+        }
+    )
+
+    score_update_log = {
+        "user_id": user_id,
+        "old_score": current_score,
+        "new_score": new_score,
+        "delta": delta,
+        "reason": reason,
+        "average_utilization": average_utilization,
+        "affected_machines": machine_ids,
+        "updated_by": updated_by,
+        "timestamp": datetime.utcnow()
+    }
+
+    await db.health_score_logs.insert_one(dict(score_update_log))
+    await health_history.record_score(score_update_log)
+    return score_update_log
+
+def _empty_aggregate() -> dict:
+    return {"machines": {}, "sum": 0.0, "count": 0}
+
+def _set_machine(aggregate: dict, machine_id: str, utilization: Optional[float], occupied: bool = True):
+    """Replace one machine's contribution; idempotent, so replays are harmless"""
+    machines = aggregate["machines"]
+    if machine_id in machines:
+        previous = machines.pop(machine_id)
+        if previous is not None:
+            aggregate["sum"] -= previous
+            aggregate["count"] -= 1
+    if occupied:
+        machines[machine_id] = utilization
+        if utilization is not None:
+            aggregate["sum"] += utilization
+            aggregate["count"] += 1
+
+def _aggregate_summary(aggregate: dict) -> dict:
+    count = aggregate["count"]
+    return {
+        "average_utilization": (aggregate["sum"] / count) if count else 0.0,
+        "active_machines": len(aggregate["machines"]),
+        "scored_machines": count
+    }
+
+async def _scan_user_aggregate(user_id: str) -> dict:
+    """Build an aggregate from the user's occupied machines (seed / reconcile path)"""
+    aggregate = _empty_aggregate()
+    cursor = db.machines.find(
+        {"userID": user_id, "status": "Occupied"},
+        {"machineID": 1, "engineHoursPerDay": 1, "idleHours": 1}
+    )
+    async for machine in cursor:
+        _set_machine(aggregate, machine["machineID"], machine_utilization(machine))
+    return aggregate
+
+def _summary_fields() -> dict:
+    """Pipeline $set recomputing the stored summary from the machine map"""
+    entries = {"$objectToArray": "$machineUtilization"}
+    return {
+        "averageUtilization": {"$ifNull": [{"$avg": {"$map": {"input": entries, "in": "$$this.v"}}}, 0.0]},
+        "activeMachines": {"$size": entries},
+        "scoredMachines": {"$size": {"$filter": {"input": entries, "cond": {"$ne": ["$$this.v", None]}}}},
+        "updatedAt": "$$NOW"
+    }
+
+def _stored_summary(stored: dict) -> dict:
+    return {
+        "average_utilization": stored.get("averageUtilization", 0.0),
+        "active_machines": stored.get("activeMachines", 0),
+        "scored_machines": stored.get("scoredMachines", 0)
+    }
+
+def _aggregate_fields(aggregate: dict) -> dict:
+    summary = _aggregate_summary(aggregate)
+    return {
+        "machineUtilization": dict(aggregate["machines"]),
+        "averageUtilization": summary["average_utilization"],
+        "activeMachines": summary["active_machines"],
+        "scoredMachines": summary["scored_machines"],
+        "updatedAt": datetime.utcnow()
+    }
+
+async def save_aggregate(user_id: str, aggregate: dict) -> dict:
+    """Persist a whole aggregate (rebuild / seed path) with its summary"""
+    await db.utilization_aggregates.update_one(
+        {"_id": user_id},
+        {
+            "$set": _aggregate_fields(aggregate),
+            # Array-shaped aggregates written before the machine map
+            "$unset": {"machines": ""}
+        },
+        upsert=True
+    )
+    return _aggregate_summary(aggregate)
+
+async def apply_machine_changes(user_id: str, changes: dict) -> Optional[dict]:
+    """
+    Write only the changed machines' entries of a stored aggregate and
+    recompute its summary in the same update; returns the summary, or None
+    when the user has no map-shaped aggregate yet
+    """
+    # Keys go through $arrayToObject rather than dotted paths, so machine IDs
+    # containing "." or starting with "$" stay single map entries
+    kept = {
+        "$filter": {
+            "input": {"$objectToArray": "$machineUtilization"},
+            "cond": {"$not": [{"$in": ["$$this.k", {"$literal": list(changes)}]}]}
+        }
+    }
+    occupied = [
+        {"k": {"$literal": machine_id}, "v": {"$literal": utilization}}
+        for machine_id, (is_occupied, utilization) in changes.items()
+        if is_occupied
+    ]
+    stored = await db.utilization_aggregates.find_one_and_update(
+        {"_id": user_id, "machineUtilization": {"$exists": True}},
+        [
+            {"$set": {"machineUtilization": {"$arrayToObject": {"$concatArrays": [kept, occupied]}}}},
+            {"$set": _summary_fields()}
+        ],
+        projection={"averageUtilization": 1, "activeMachines": 1, "scoredMachines": 1},
+        return_document=ReturnDocument.AFTER
+    )
+    return _stored_summary(stored) if stored else None
+
+async def _seed_aggregate(user_id: str) -> bool:
+    """Create a missing or array-shaped aggregate from a scan; False if another worker got there first"""
+    aggregate = await _scan_user_aggregate(user_id)
+    try:
+        await db.utilization_aggregates.update_one(
+            {"_id": user_id, "machineUtilization": {"$exists": False}},
+            {"$set": _aggregate_fields(aggregate), "$unset": {"machines": ""}},
+            upsert=True
+        )
+        return True
+    except DuplicateKeyError:
+        return False
+
+async def _flush(user_id: str):
+    changes = _pending.pop(user_id, None)
+    if not changes:
+        return
+    if await apply_machine_changes(user_id, changes) is None:
+        # The scan already reflects these changes; only a lost seeding race
+        # leaves them to apply on top of the other worker's aggregate
+        if not await _seed_aggregate(user_id):
+            await apply_machine_changes(user_id, changes)
+
+async def _debounced_flush(user_id: str):
+    loop = asyncio.get_running_loop()
+    try:
+        while True:
+            wait = _last_event[user_id] + SCORE_DEBOUNCE_SECONDS - loop.time()
+            if wait > 0:
+                await asyncio.sleep(wait)
+                continue
+            flushed_at = _last_event[user_id]
+            await _flush(user_id)
+            if _last_event[user_id] == flushed_at:
+                break
+    except Exception as e:
+        print(f"Error flushing health score for {user_id}: {str(e)}")
+    finally:
+        _flush_tasks.pop(user_id, None)
+        _last_event.pop(user_id, None)
+
+def _schedule_flush(user_id: str):
+    _last_event[user_id] = asyncio.get_running_loop().time()
+    if user_id not in _flush_tasks:
+        _flush_tasks[user_id] = asyncio.create_task(_debounced_flush(user_id))
+
+async def handle_machine_change(event: dict):
+    """Fold a machine change event into the affected users' aggregates"""
+    before = event.get("before") or {}
+    after = event.get("after") or {}
+    if all(before.get(f) == after.get(f) for f in UTILIZATION_FIELDS):
+        return
+
+    machine_id = event["machineID"]
+    old_user = before.get("userID")
+    new_user = after.get("userID")
+
+    if old_user and old_user != new_user:
+        _pending.setdefault(old_user, {})[machine_id] = (False, None)
+        _schedule_flush(old_user)
+
+    if new_user:
+        _pending.setdefault(new_user, {})[machine_id] = (
+            after.get("status") == "Occupied",
+            machine_utilization(after)
+        )
+        _schedule_flush(new_user)
+
+async def get_user_utilization(user_id: str) -> dict:
+    """Precomputed utilization summary for a user, seeding it on first read"""
+    stored = await db.utilization_aggregates.find_one(
+        {"_id": user_id},
+        {"averageUtilization": 1, "activeMachines": 1, "scoredMachines": 1}
+    )
+    if stored:
+        return _stored_summary(stored)
+
+    aggregate = await _scan_user_aggregate(user_id)
+    return await save_aggregate(user_id, aggregate)
+
+async def run_batch_scoring() -> int:
+    """
+    Rebuild every user's aggregate and apply the day's scoring step, scoring
+    machines on their rolled-up telemetry window where one exists. This is
+    the only scheduled path that moves health scores.
+    """
+    pipeline = [
+        {"$match": {"status": "Occupied", "userID": {"$ne": None}}},
+        {
+            "$group": {
+                "_id": "$userID",
+                "machines": {
+                    "$push": {
+                        "machineID": "$machineID",
+                        "engineHoursPerDay": "$engineHoursPerDay",
+                        "idleHours": "$idleHours"
+                    }
+                }
+            }
+        }
+    ]
+
+    groups = await db.machines.aggregate(pipeline).to_list(length=None)
+    usage = await get_machine_usage(
+        machine["machineID"] for group in groups for machine in group["machines"]
+    )
+
+    scored = 0
+    for group in groups:
+        user_id = group["_id"]
+        aggregate = _empty_aggregate()
+        for machine in group["machines"]:
+            _set_machine(aggregate, machine["machineID"], machine_utilization(with_usage(machine, usage)))
+
+        # Replaces any drifted aggregate; pending changes are already in this scan
+        _pending.pop(user_id, None)
+        summary = await save_aggregate(user_id, aggregate)
+        if summary["scored_machines"]:
+            machine_ids = [m for m, u in aggregate["machines"].items() if u is not None]
+            await apply_score_update(user_id, summary["average_utilization"], machine_ids, BATCH_UPDATER)
+            scored += 1
+
+    print(f"Nightly health scoring updated {scored} users")
+    return scored
+
+def register():
+    """Subscribe the scorer to machine change events"""
+    events.subscribe(events.MACHINE_CHANGED, handle_machine_change)
@@ -0,0 +1,24 @@
+"""
+Indexes on the core collections the routers share.
+
+Services with their own collections create those indexes themselves; this
+covers the lookups the dashboards and write paths make on `machines` and
+`requests`.
+"""
+import motor.motor_asyncio
+from decouple import config
+from pymongo import ASCENDING
+
+# MongoDB connection
+MONGODB_URL = config("MONGODB_URL")
+client = motor.motor_asyncio.AsyncIOMotorClient(MONGODB_URL)
+db = client.caterpillar_db
+
+async def ensure_indexes():
+    # A dealer's machine IDs (pending request facets) come from the index alone
+    await db.machines.create_index([("dealerID", ASCENDING), ("machineID", ASCENDING)])
+    # Pending requests on a set of machines
+    await db.requests.create_index([("machineID", ASCENDING), ("status", ASCENDING)])
+    # Machine lookups by ID on every write path and in telemetry ingestion;
+    # last, so duplicate IDs in old data cannot block the indexes above
+    await db.machines.create_index("machineID", unique=True)
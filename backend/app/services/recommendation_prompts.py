@@ -0,0 +1,89 @@
+"""
+Gemini prompt builders for fleet and customer recommendations.
+"""
+
+def build_usage_prompt(machine_data: dict, utilization_stats: dict) -> str:
+    """Fleet usage optimization prompt"""
+    return f"""
+    As an expert in construction equipment management, analyze this machine usage data and provide actionable optimization recommendations:
+
+    Machine Data:
+    - Total Machines: {machine_data.get('total_machines', 0)}
+    - Active Machines: {machine_data.get('active_machines', 0)}
+    - Average Utilization: {utilization_stats.get('avg_utilization', 0):.1f}%
+    - Machine Types: {', '.join(machine_data.get('machine_types', []))}
+    - Idle Hours: {utilization_stats.get('total_idle_hours', 0)} hours/week
+    - Operating Days: {utilization_stats.get('avg_operating_days', 0)} days/week
+
+    Performance Metrics:
+    - Machines over 80% utilization: {utilization_stats.get('overutilized_count', 0)}
+    - Machines under 30% utilization: {utilization_stats.get('underutilized_count', 0)}
+    - Total engine hours: {utilization_stats.get('total_engine_hours', 0)} hours
+
+    Provide specific, actionable recommendations for:
+    1. Optimizing machine utilization
+    2. Reducing idle time and costs
+    3. Preventing equipment overuse
+    4. Improving operational efficiency
+
+    Keep recommendations concise, practical, and focused on ROI. Format as a JSON object with 'recommendation', 'priority', 'potential_savings', and 'action_steps' fields.
+    """
+
+def build_transfer_prompt(machine_data: dict, utilization_stats: dict) -> str:
+    """Fleet transfer optimization prompt"""
+    return f"""
+    Analyze this construction fleet data to identify transfer optimization opportunities:
+
+    Fleet Overview:
+    - Total Machines: {machine_data.get('total_machines', 0)}
+    - Geographic Distribution: {machine_data.get('locations', [])}
+    - Machine Utilization Variance: {utilization_stats.get('utilization_variance', 0):.2f}
+    - Average Transport Cost: ${utilization_stats.get('avg_transport_cost', 50)}/km
+
+    Identify opportunities to:
+    1. Reduce transportation costs
+    2. Balance machine utilization across sites
+    3. Minimize idle time through strategic transfers
+    4. Optimize equipment placement
+    5. Mention as specific details like equipment condition, maintenance history, and usage patterns along with the machine name / type they are referring to
+
+    Provide specific transfer recommendations with estimated cost savings. Format as JSON with 'recommendation', 'estimated_savings', 'affected_machines', and 'implementation_steps'.
+    """
+
+def build_customer_prompt(customer_data: dict, utilization_stats: dict) -> str:
+    """Personalized customer recommendation prompt"""
+    return f"""
+    As a construction equipment optimization expert, analyze this customer's machine usage and provide personalized recommendations:
+
+    Customer Fleet Analysis:
+    - Total Machines: {customer_data.get('total_machines', 0)}
+    - Active Machines: {customer_data.get('active_machines', 0)}
+    - Ready Machines: {customer_data.get('ready_machines', 0)}
+    - In Maintenance: {customer_data.get('maintenance_machines', 0)}
+    - Machine Types: {', '.join(customer_data.get('machine_types', []))}
+
+    Usage Metrics:
+    - Average Utilization: {customer_data.get('avg_utilization', 0):.1f}%
+    - Overutilized Machines (>80%): {customer_data.get('overutilized_machines', 0)}
+    - Underutilized Machines (<30%): {customer_data.get('underutilized_machines', 0)}
+    - Average Operating Days: {customer_data.get('avg_operating_days', 0)} days/week
+    - Total Idle Hours: {utilization_stats.get('total_idle_hours', 0)} hours/month
+
+    Performance & Costs:
+    - Current Health Score: {customer_data.get('current_health_score', 700)}/850
+    - Estimated Monthly Costs: ${customer_data.get('estimated_monthly_costs', 0):,.2f}
+
+    Provide specific, actionable recommendations to help this customer:
+    1. Optimize machine utilization and reduce costs
+    2. Improve their health score
+    3. Prevent equipment overuse or underuse
+    4. Maximize ROI on their equipment investment
+
+    Focus on practical steps they can take immediately. Consider both operational efficiency and cost savings.
+
+    Format as JSON with:
+    - "recommendation": Main recommendation title
+    - "priority": "High", "Medium", or "Low" 
+    - "potential_savings": Specific savings description
+    - "action_steps": Array of 3-5 specific actionable steps
+    """
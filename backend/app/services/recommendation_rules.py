@@ -0,0 +1,252 @@
+"""
+Deterministic recommendation rules.
+
+Rules are plain data: each has conditions over named fleet metrics, the
+scopes it applies to ("customer" for one customer's machines, "fleet" for a
+dealership), a priority and text templates filled from the metrics. All
+conditions of all rules are evaluated at once as NumPy comparisons over a
+(fleets x metrics) matrix, so one customer or a whole dealership's
+customers are scored in a single pass without any model call.
+"""
+from collections import Counter
+from functools import lru_cache
+
+from .utilization import fleet_stats, SHIFT
+
+
+# Hourly rate used for cost estimates
+COST_PER_HOUR = 25
+MONTH_DAYS = 30
+# Estimated monthly saving per returned underutilized machine
+RETURN_SAVINGS_PER_MACHINE = 500
+
+PRIORITY_ORDER = {"high": 0, "medium": 1, "low": 2}
+
+RULES = [
+    {
+        "id": "maintenance_pending",
+        "type": "maintenance",
+        "scopes": ["customer", "fleet"],
+        "priority": "high",
+        "when": [("maintenance_count", ">", 0)],
+        "title": "Schedule Maintenance",
+        "description": "You have {maintenance_count:.0f} machine(s) requiring maintenance attention.",
+        "suggested_action": "Contact support to schedule maintenance"
+    },
+    {
+        "id": "overutilized",
+        "type": "usage",
+        "scopes": ["customer", "fleet"],
+        "priority": "high",
+        "when": [("overutilized_count", ">=", 1)],
+        "title": "Prevent Equipment Overuse",
+        "description": "{overutilized_count:.0f} machine(s) run more than 80% of an 8-hour shift, which raises breakdown risk.",
+        "suggested_action": "Request additional machines or spread work across the fleet"
+    },
+    {
+        "id": "underutilized",
+        "type": "usage",
+        "scopes": ["customer", "fleet"],
+        "priority": "medium",
+        "when": [("underutilized_count", ">=", 2)],
+        "title": "Return Underutilized Machines",
+        "description": "{underutilized_count:.0f} machines run less than 30% of a shift (average utilization {avg_utilization:.1f}%).",
+        "suggested_action": "Consider returning or reassigning underutilized machines",
+        "potential_savings": "About ${return_savings:,.0f} per month"
+    },
+    {
+        "id": "ready_machines_idle",
+        "type": "efficiency",
+        "scopes": ["customer"],
+        "priority": "medium",
+        "when": [("ready_count", ">", 2)],
+        "title": "Optimize Machine Usage",
+        "description": "You have {ready_count:.0f} machines in ready state that could be utilized.",
+        "suggested_action": "Consider creating new work orders"
+    },
+    {
+        "id": "high_idle_time",
+        "type": "cost_saving",
+        "scopes": ["customer", "fleet"],
+        "priority": "medium",
+        "when": [("idle_share", ">", 0.25), ("occupied_count", ">", 0)],
+        "title": "Cut Idle Running Time",
+        "description": "Engines idle for {idle_share:.0%} of running time, about ${idle_monthly_cost:,.0f} a month.",
+        "suggested_action": "Shut engines down during breaks and waiting time",
+        "potential_savings": "Up to ${idle_monthly_cost:,.0f} per month"
+    },
+    {
+        "id": "optimal_usage",
+        "type": "usage",
+        "scopes": ["customer", "fleet"],
+        "priority": "low",
+        "when": [("avg_utilization", ">=", 40), ("avg_utilization", "<=", 60), ("overutilized_count", "==", 0)],
+        "title": "Utilization On Target",
+        "description": "Average utilization of {avg_utilization:.1f}% is in the optimal range.",
+        "suggested_action": "Keep current scheduling and review usage monthly"
+    },
+    {
+        "id": "low_health_score",
+        "type": "health_score",
+        "scopes": ["customer"],
+        "priority": "medium",
+        "when": [("health_score", "<", 600)],
+        "title": "Improve Your Health Score",
+        "description": "Your health score is {health_score:.0f}/850; utilization between 10% and 80% raises it over time.",
+        "suggested_action": "Balance work so no machine is overused or left idle"
+    },
+    {
+        "id": "transport_costs",
+        "type": "cost_saving",
+        "scopes": ["customer"],
+        "priority": "low",
+        "when": [("machine_count", ">", 0)],
+        "title": "Reduce Transportation Costs",
+        "description": "Optimize your machine locations to reduce transportation costs by up to 15%.",
+        "suggested_action": "Review machine deployment locations"
+    },
+    {
+        "id": "getting_started",
+        "type": "getting_started",
+        "scopes": ["customer"],
+        "priority": "medium",
+        "when": [("machine_count", "==", 0)],
+        "title": "Get Started with CatRental",
+        "description": "Create your first request to get machines assigned to your projects.",
+        "suggested_action": "Create a new request"
+    },
+    {
+        "id": "training",
+        "type": "training",
+        "scopes": ["customer"],
+        "priority": "low",
+        "when": [("machine_count", "==", 0)],
+        "title": "Training Resources",
+        "description": "Access our training materials to maximize equipment efficiency.",
+        "suggested_action": "Visit the help center"
+    }
+]
+
+OPERATORS = [">", ">=", "<", "<=", "=="]
+
+def _status(machine: dict) -> str:
+    status = machine.get("status")
+    return str(getattr(status, "value", status))
+
+def occupied_stats(machines: list) -> dict:
+    """Shift utilization of the occupied machines, flagged at the rule thresholds"""
+    occupied = [machine for machine in machines if _status(machine) == "Occupied"]
+    return fleet_stats(occupied, SHIFT, over=80, under=30)
+
+def fleet_metrics(machines: list, health_score=None) -> dict:
+    """Named metrics the rules are written against, for one set of machines"""
+    statuses = Counter(_status(machine) for machine in machines)
+    stats = occupied_stats(machines)
+
+    engine_per_day = stats["total_engine_hours_per_day"]
+    idle_per_day = stats["total_idle_hours"]
+    running = engine_per_day + idle_per_day
+    return {
+        "machine_count": len(machines),
+        "occupied_count": statuses.get("Occupied", 0),
+        "ready_count": statuses.get("Ready", 0),
+        "maintenance_count": statuses.get("Maintenance", 0),
+        "scored_count": stats["scored_count"],
+        "avg_utilization": stats["mean"] if stats["scored_count"] else float("nan"),
+        "overutilized_count": stats["overutilized_count"],
+        "underutilized_count": stats["underutilized_count"],
+        "avg_operating_days": stats["avg_operating_days"],
+        "total_engine_hours": stats["total_engine_hours"],
+        "total_idle_hours": idle_per_day,
+        "idle_share": idle_per_day / running if running else 0.0,
+        "estimated_monthly_cost": engine_per_day * MONTH_DAYS * COST_PER_HOUR,
+        "idle_monthly_cost": idle_per_day * MONTH_DAYS * COST_PER_HOUR,
+        "return_savings": stats["underutilized_count"] * RETURN_SAVINGS_PER_MACHINE,
+        "health_score": float("nan") if health_score is None else health_score
+    }
+
+@lru_cache(maxsize=None)
+def _compile(scope: str) -> tuple:
+    import numpy as np
+
+    rules = [rule for rule in RULES if scope in rule["scopes"]]
+    metric_names = sorted({metric for rule in rules for metric, _, _ in rule["when"]})
+    clause_rule, clause_metric, clause_op, clause_value = [], [], [], []
+    for rule_index, rule in enumerate(rules):
+        for metric, op, value in rule["when"]:
+            clause_rule.append(rule_index)
+            clause_metric.append(metric_names.index(metric))
+            clause_op.append(OPERATORS.index(op))
+            clause_value.append(value)
+
+    # One-hot (clauses x rules) to count failed clauses per rule with a matmul
+    membership = np.zeros((len(clause_rule), len(rules)))
+    membership[np.arange(len(clause_rule)), clause_rule] = 1
+    return rules, metric_names, np.array(clause_metric), np.array(clause_op), np.array(clause_value, dtype=float), membership
+
+def _fired(rows: list, scope: str) -> tuple:
+    """(rules, boolean fleets x rules matrix of rules whose conditions all hold)"""
+    import numpy as np
+
+    rules, metric_names, clause_metric, clause_op, clause_value, membership = _compile(scope)
+    matrix = np.array(
+        [[float(row.get(name, np.nan)) for name in metric_names] for row in rows],
+        dtype=float
+    ).reshape(len(rows), len(metric_names))
+    values = matrix[:, clause_metric]
+
+    # Comparisons with NaN (missing metrics) are False, so those rules never fire
+    with np.errstate(invalid="ignore"):
+        passed = np.select(
+            [clause_op == i for i in range(len(OPERATORS))],
+            [values > clause_value, values >= clause_value, values < clause_value,
+             values <= clause_value, values == clause_value],
+            default=False
+        )
+    return rules, (~passed).astype(float) @ membership == 0
+
+def _render(rule: dict, metrics: dict) -> dict:
+    recommendation = {
+        "rule_id": rule["id"],
+        "type": rule["type"],
+        "title": rule["title"],
+        "description": rule["description"].format(**metrics),
+        "priority": rule["priority"],
+        "suggested_action": rule["suggested_action"]
+    }
+    if rule.get("potential_savings"):
+        recommendation["potential_savings"] = rule["potential_savings"].format(**metrics)
+    return recommendation
+
+def evaluate(rows: list, scope: str = "customer") -> list:
+    """Recommendations for each metrics row, highest priority first"""
+    if not rows:
+        return []
+    rules, fired = _fired(rows, scope)
+    results = []
+    for metrics, row_fired in zip(rows, fired):
+        recommendations = [_render(rule, metrics) for rule, hit in zip(rules, row_fired) if hit]
+        recommendations.sort(key=lambda rec: PRIORITY_ORDER[rec["priority"]])
+        results.append(recommendations)
+    return results
+
+def recommend(metrics: dict, scope: str = "customer") -> list:
+    return evaluate([metrics], scope)[0]
+
+def summarize(recommendations: list) -> dict:
+    """Fields of a stored recommendation document built from rule output"""
+    if not recommendations:
+        return {
+            "recommendation": "No issues found - keep monitoring machine usage",
+            "priority": "low",
+            "potential_savings": "Not specified",
+            "action_steps": []
+        }
+    top = recommendations[0]
+    savings = [rec["potential_savings"] for rec in recommendations if rec.get("potential_savings")]
+    return {
+        "recommendation": f"{top['title']}: {top['description']}",
+        "priority": top["priority"],
+        "potential_savings": "; ".join(savings) if savings else "Not specified",
+        "action_steps": [rec["suggested_action"] for rec in recommendations]
+    }
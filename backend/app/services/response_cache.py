@@ -0,0 +1,227 @@
+"""
+In-process response cache for read-heavy GET endpoints.
+
+Entries are keyed by (path, role, dealer/user ID, query params) and hold the
+serialized JSON body plus a strong ETag. Each entry carries tags such as
+`dealer:{id}:machines`; write paths invalidate tags (directly or through
+inline change-event handlers, before the write's response is sent) so a
+cached dashboard is served until something it depends on changes, bounded
+by a TTL for time-dependent values like revenue.
+
+Every tag has a generation counter in the `response_cache_generations`
+collection, bumped on invalidation. An entry remembers the generations it
+was built under and is only served while they are current, so a write in
+one worker invalidates the cache of every worker, and a body built while
+an invalidation happened is returned to its caller but never stored.
+"""
+import asyncio
+import hashlib
+import time
+import motor.motor_asyncio
+from collections import OrderedDict, defaultdict
+from decouple import config
+from fastapi import HTTPException, Request, Response
+from pymongo import UpdateOne
+
+from . import events, single_flight
+from .serialization import dumps
+
+# MongoDB connection
+MONGODB_URL = config("MONGODB_URL")
+client = motor.motor_asyncio.AsyncIOMotorClient(MONGODB_URL)
+db = client.caterpillar_db
+
+RESPONSE_CACHE_TTL_SECONDS = float(config("RESPONSE_CACHE_TTL_SECONDS", default="60"))
+RESPONSE_CACHE_MAX_ENTRIES = int(config("RESPONSE_CACHE_MAX_ENTRIES", default="2000"))
+
+# Tag for data shared by every user (e.g. the set of machine types)
+MACHINE_TYPES_TAG = "machines:types"
+
+_entries = OrderedDict()
+_tag_index = defaultdict(set)
+_stats = {"hits": 0, "misses": 0, "not_modified": 0, "invalidations": 0, "stale_builds": 0}
+
+def dealer_tag(dealer_id: str, resource: str) -> str:
+    return f"dealer:{dealer_id}:{resource}"
+
+def user_tag(user_id: str, resource: str) -> str:
+    return f"user:{user_id}:{resource}"
+
+def cache_key(request: Request, current_user: dict, shared: bool = False) -> tuple:
+    """Route, role, owning dealer/user (None for shared views) and normalized query params"""
+    role = current_user.get("role")
+    if shared:
+        owner = None
+    else:
+        owner = current_user.get("dealershipID") if role == "admin" else current_user.get("userID")
+    params = tuple(sorted(request.query_params.multi_items()))
+    return (request.url.path, role, owner, params)
+
+def _drop(key):
+    entry = _entries.pop(key, None)
+    if not entry:
+        return
+    for tag in entry["tags"]:
+        keys = _tag_index.get(tag)
+        if keys:
+            keys.discard(key)
+            if not keys:
+                del _tag_index[tag]
+
+async def _generations(tags: list):
+    """Current generation of each tag (0 if never invalidated); None when unavailable"""
+    try:
+        docs = await db.response_cache_generations.find({"_id": {"$in": tags}}).to_list(length=None)
+    except Exception as e:
+        print(f"Response cache generations unavailable: {str(e)}")
+        return None
+    generations = {tag: 0 for tag in tags}
+    generations.update((doc["_id"], doc.get("generation", 0)) for doc in docs)
+    return generations
+
+def _store(key, body: bytes, etag: str, tags: list, generations: dict, ttl_seconds: float):
+    _drop(key)
+    _entries[key] = {
+        "body": body,
+        "etag": etag,
+        "tags": tags,
+        "generations": generations,
+        "expires": time.monotonic() + ttl_seconds
+    }
+    for tag in tags:
+        _tag_index[tag].add(key)
+    while len(_entries) > RESPONSE_CACHE_MAX_ENTRIES:
+        _drop(next(iter(_entries)))
+
+def _opaque_tag(etag: str) -> str:
+    return etag[2:] if etag.startswith("W/") else etag
+
+def _etag_matches(request: Request, etag: str) -> bool:
+    """Weak comparison, as If-None-Match requires: compression marks ETags weak"""
+    header = request.headers.get("if-none-match")
+    if not header:
+        return False
+    candidates = [candidate.strip() for candidate in header.split(",")]
+    return "*" in candidates or _opaque_tag(etag) in {_opaque_tag(candidate) for candidate in candidates}
+
+def _response(request: Request, body: bytes, etag: str) -> Response:
+    headers = {"ETag": etag, "Cache-Control": "private, no-cache"}
+    if _etag_matches(request, etag):
+        _stats["not_modified"] += 1
+        return Response(status_code=304, headers=headers)
+    return Response(content=body, media_type="application/json", headers=headers)
+
+async def cached_response(
+    request: Request,
+    current_user: dict,
+    tags: list,
+    build,
+    ttl_seconds: float = RESPONSE_CACHE_TTL_SECONDS,
+    shared: bool = False
+) -> Response:
+    """
+    Serve a cached body (or 304) for this caller, building it with `build`
+    on a miss; a shared view is cached once for every caller with the role
+    """
+    key = cache_key(request, current_user, shared)
+    tags = list(tags)
+    generations = await _generations(tags)
+    entry = _entries.get(key)
+    if entry and entry["expires"] > time.monotonic() and generations is not None and entry["generations"] == generations:
+        _entries.move_to_end(key)
+        _stats["hits"] += 1
+        return _response(request, entry["body"], entry["etag"])
+
+    _stats["misses"] += 1
+
+    async def build_entry():
+        body = dumps(await build())
+        etag = f'"{hashlib.sha256(body).hexdigest()[:32]}"'
+        # A tag invalidated while building may mean the body is already stale
+        if generations is not None and await _generations(tags) == generations:
+            _store(key, body, etag, tags, generations, ttl_seconds)
+        else:
+            _stats["stale_builds"] += 1
+        return body, etag
+
+    # Concurrent misses for the same caller scope share one build; a request
+    # that sees a newer generation never joins a build started before a write
+    flight_params = {
+        "role": key[1],
+        "params": key[3],
+        "generations": tuple(sorted(generations.items())) if generations is not None else None
+    }
+    try:
+        body, etag = await single_flight.run("response:" + key[0], key[2], flight_params, build_entry)
+    except asyncio.TimeoutError:
+        raise HTTPException(status_code=504, detail="Timed out building response")
+    return _response(request, body, etag)
+
+async def invalidate(*tags: str):
+    """Drop every cached response carrying any of the tags, in every worker"""
+    tags = sorted(set(tags))
+    if not tags:
+        return
+    for tag in tags:
+        for key in list(_tag_index.get(tag, ())):
+            _drop(key)
+            _stats["invalidations"] += 1
+    try:
+        await db.response_cache_generations.bulk_write(
+            [UpdateOne({"_id": tag}, {"$inc": {"generation": 1}}, upsert=True) for tag in tags],
+            ordered=False
+        )
+    except Exception as e:
+        # The write itself succeeded; other workers fall back to the TTL
+        print(f"Error broadcasting response cache invalidation: {str(e)}")
+
+def clear():
+    _entries.clear()
+    _tag_index.clear()
+
+def get_stats() -> dict:
+    return {**_stats, "entries": len(_entries), "tags": len(_tag_index)}
+
+async def handle_machine_changes(changes: list):
+    """Invalidate fleet views of the dealers and customers machines moved between"""
+    tags = set()
+    for event in changes:
+        for machine in (event.get("before"), event.get("after")):
+            if not machine:
+                continue
+            if machine.get("dealerID"):
+                tags.add(dealer_tag(machine["dealerID"], "machines"))
+            if machine.get("userID"):
+                tags.add(user_tag(machine["userID"], "machines"))
+
+        before_type = (event.get("before") or {}).get("machineType")
+        after_type = (event.get("after") or {}).get("machineType")
+        if before_type != after_type:
+            tags.add(MACHINE_TYPES_TAG)
+
+    await invalidate(*tags)
+
+async def handle_request_changes(changes: list):
+    """Invalidate request counts of the machines' dealers and the requesting customers"""
+    tags = set()
+    for event in changes:
+        machine = await db.machines.find_one(
+            {"machineID": event.get("machineID")},
+            {"dealerID": 1, "userID": 1}
+        )
+        if machine and machine.get("dealerID"):
+            tags.add(dealer_tag(machine["dealerID"], "requests"))
+        if machine and machine.get("userID"):
+            tags.add(user_tag(machine["userID"], "requests"))
+
+        if event.get("requestID"):
+            request_doc = await db.requests.find_one({"requestID": event["requestID"]}, {"userID": 1})
+            if request_doc and request_doc.get("userID"):
+                tags.add(user_tag(request_doc["userID"], "requests"))
+
+    await invalidate(*tags)
+
+def register():
+    """Invalidate the cache inline, before a write's response, on machine and request changes"""
+    events.subscribe_inline(events.MACHINE_CHANGED, handle_machine_changes)
+    events.subscribe_inline(events.REQUEST_CHANGED, handle_request_changes)
@@ -0,0 +1,289 @@
+import time
+import motor.motor_asyncio
+import math
+from decouple import config
+from datetime import datetime
+from typing import Optional
+from pymongo import ASCENDING
+from pymongo.errors import DuplicateKeyError
+
+from . import events
+
+MACHINE_TYPES = {
+    'Excavator': {'hourlyRate': 150, 'dailyRate': 1200, 'category': 'Heavy Construction'},
+    'Bulldozer': {'hourlyRate': 180, 'dailyRate': 1440, 'category': 'Heavy Construction'},
+    'Loader': {'hourlyRate': 120, 'dailyRate': 960, 'category': 'Material Handling'},
+    'Grader': {'hourlyRate': 140, 'dailyRate': 1120, 'category': 'Road Construction'},
+    'Compactor': {'hourlyRate': 100, 'dailyRate': 800, 'category': 'Compaction'},
+    'Crane': {'hourlyRate': 220, 'dailyRate': 1760, 'category': 'Heavy Lifting'},
+    'Dump Truck': {'hourlyRate': 80, 'dailyRate': 640, 'category': 'Transportation'},
+    'Backhoe': {'hourlyRate': 130, 'dailyRate': 1040, 'category': 'General Construction'}
+}
+
+# Hourly rate for machine types missing from the rate table
+DEFAULT_HOURLY_RATE = 100
+
+REVENUE_CACHE_TTL_SECONDS = float(config("REVENUE_CACHE_TTL_SECONDS", default="60"))
+
+# MongoDB connection
+MONGODB_URL = config("MONGODB_URL")
+client = motor.motor_asyncio.AsyncIOMotorClient(MONGODB_URL)
+db = client.caterpillar_db
+
+_snapshots = {}
+
+def calculate_machine_revenue(machine_type: str, duration_hours: float, billing_type: str = 'hourly') -> float:
+    """Calculate revenue for a single machine based on type and duration"""
+    machine = MACHINE_TYPES.get(machine_type)
+
+    if not machine:
+        return duration_hours * DEFAULT_HOURLY_RATE  # Default fallback rate
+
+    if billing_type == 'daily':
+        days = math.ceil(duration_hours / 24)
+        return days * machine['dailyRate']
+    else:
+        return duration_hours * machine['hourlyRate']
+
+def calculate_occupied_duration(start_time: datetime, end_time: datetime = None) -> float:
+    """Calculate duration in hours for occupied machines"""
+    if end_time is None:
+        end_time = datetime.utcnow()
+
+    duration = end_time - start_time
+    return duration.total_seconds() / 3600
+
+def _rate_switch(rate_field: str) -> dict:
+    """$switch over the rate table; null for unknown machine types"""
+    return {
+        "$switch": {
+            "branches": [
+                {"case": {"$eq": ["$machineType", machine_type]}, "then": rates[rate_field]}
+                for machine_type, rates in MACHINE_TYPES.items()
+            ],
+            "default": None
+        }
+    }
+
+def occupied_revenue_pipeline(dealer_id: str) -> list:
+    """Price every occupied machine of a dealer server-side, grouped by machine type"""
+    return [
+        {"$match": {"dealerID": dealer_id, "status": "Occupied"}},
+        {
+            "$project": {
+                "_id": 0,
+                "machineType": 1,
+                "billingType": {"$ifNull": ["$billingType", "hourly"]},
+                # When the machine became occupied, falling back to updatedAt
+                "startTime": {"$ifNull": ["$occupiedSince", "$updatedAt"]},
+                "hourlyRate": _rate_switch("hourlyRate"),
+                "dailyRate": _rate_switch("dailyRate")
+            }
+        },
+        {"$match": {"startTime": {"$ne": None}}},
+        {
+            "$addFields": {
+                "hours": {"$divide": [{"$subtract": ["$$NOW", "$startTime"]}, 3600000]}
+            }
+        },
+        {
+            "$addFields": {
+                "revenue": {
+                    "$cond": [
+                        {"$eq": ["$hourlyRate", None]},
+                        {"$multiply": ["$hours", DEFAULT_HOURLY_RATE]},
+                        {
+                            "$cond": [
+                                {"$eq": ["$billingType", "daily"]},
+                                {"$multiply": [{"$ceil": {"$divide": ["$hours", 24]}}, "$dailyRate"]},
+                                {"$multiply": ["$hours", "$hourlyRate"]}
+                            ]
+                        }
+                    ]
+                }
+            }
+        },
+        {
+            "$group": {
+                "_id": "$machineType",
+                "revenue": {"$sum": "$revenue"},
+                "machines": {"$sum": 1}
+            }
+        }
+    ]
+
+async def compute_revenue_snapshot(dealer_id: str) -> dict:
+    """Occupied-machine revenue for a dealer, computed in one aggregation"""
+    groups = await db.machines.aggregate(occupied_revenue_pipeline(dealer_id)).to_list(length=None)
+
+    by_type = sorted(
+        (
+            {
+                "machine_type": group["_id"] or "Unknown",
+                "revenue": round(group["revenue"], 2),
+                "machines": group["machines"]
+            }
+            for group in groups
+        ),
+        key=lambda entry: entry["revenue"],
+        reverse=True
+    )
+    return {
+        "dealer_id": dealer_id,
+        "occupied_revenue": round(sum(group["revenue"] for group in groups), 2),
+        "occupied_machines": sum(group["machines"] for group in groups),
+        "by_machine_type": by_type,
+        "computed_at": datetime.utcnow(),
+        "ttl_seconds": REVENUE_CACHE_TTL_SECONDS
+    }
+
+async def get_revenue_snapshot(dealer_id: str, refresh: bool = False) -> dict:
+    """Cached revenue snapshot for a dealer, recomputed after the TTL expires"""
+    cached = _snapshots.get(dealer_id)
+    if cached and not refresh and cached[0] > time.monotonic():
+        return cached[1]
+
+    snapshot = await compute_revenue_snapshot(dealer_id)
+    _snapshots[dealer_id] = (time.monotonic() + REVENUE_CACHE_TTL_SECONDS, snapshot)
+    return snapshot
+
+async def ensure_indexes():
+    """Unique rollup key doubling as the index for dealer date-range scans"""
+    await db.revenue_daily.create_index(
+        [("dealerID", ASCENDING), ("day", ASCENDING), ("machineType", ASCENDING)],
+        unique=True
+    )
+
+def revenue_day(timestamp: datetime) -> datetime:
+    """UTC midnight of the day a timestamp falls on"""
+    return timestamp.replace(hour=0, minute=0, second=0, microsecond=0)
+
+async def record_completed_order(order: dict):
+    """Add a completed order's revenue to its (dealer, day, machine type) bucket"""
+    if not order.get("dealerID"):
+        return
+    key = {
+        "dealerID": order["dealerID"],
+        "day": revenue_day(order.get("completedAt") or order["updatedAt"]),
+        "machineType": order.get("machineType") or "Unknown"
+    }
+    update = {
+        "$inc": {"revenue": order.get("estimatedCost") or 0.0, "orders": 1},
+        "$set": {"updatedAt": datetime.utcnow()}
+    }
+    try:
+        await db.revenue_daily.update_one(key, update, upsert=True)
+    except DuplicateKeyError:
+        # Lost an upsert race with another completion for the same bucket
+        await db.revenue_daily.update_one(key, update)
+
+async def backfill_revenue_daily(since: Optional[datetime] = None) -> int:
+    """Rebuild revenue_daily buckets from completed orders (optionally from a date on)"""
+    match = {"status": "Completed"}
+    if since:
+        match["$or"] = [
+            {"completedAt": {"$gte": revenue_day(since)}},
+            {"completedAt": None, "updatedAt": {"$gte": revenue_day(since)}}
+        ]
+
+    pipeline = [
+        {"$match": match},
+        {
+            "$addFields": {
+                "completedOn": {"$ifNull": ["$completedAt", "$updatedAt"]},
+                "rentedMachineID": {"$ifNull": ["$assignedMachineID", "$machineID"]}
+            }
+        },
+        # Orders completed before dealerID was stamped on them need the machine join
+        {
+            "$lookup": {
+                "from": "machines",
+                "localField": "rentedMachineID",
+                "foreignField": "machineID",
+                "as": "machine"
+            }
+        },
+        {
+            "$addFields": {
+                "dealerID": {"$ifNull": ["$dealerID", {"$first": "$machine.dealerID"}]}
+            }
+        },
+        {"$match": {"dealerID": {"$ne": None}}},
+        {
+            "$group": {
+                "_id": {
+                    "dealerID": "$dealerID",
+                    "day": {
+                        "$dateFromParts": {
+                            "year": {"$year": "$completedOn"},
+                            "month": {"$month": "$completedOn"},
+                            "day": {"$dayOfMonth": "$completedOn"}
+                        }
+                    },
+                    "machineType": {"$ifNull": ["$machineType", "Unknown"]}
+                },
+                "revenue": {"$sum": {"$ifNull": ["$estimatedCost", 0]}},
+                "orders": {"$sum": 1}
+            }
+        },
+        {
+            "$project": {
+                "_id": 0,
+                "dealerID": "$_id.dealerID",
+                "day": "$_id.day",
+                "machineType": "$_id.machineType",
+                "revenue": 1,
+                "orders": 1,
+                "updatedAt": "$$NOW"
+            }
+        },
+        {
+            "$merge": {
+                "into": "revenue_daily",
+                "on": ["dealerID", "day", "machineType"],
+                "whenMatched": "replace",
+                "whenNotMatched": "insert"
+            }
+        }
+    ]
+    await db.neworders.aggregate(pipeline).to_list(length=None)
+
+    bucket_filter = {"day": {"$gte": revenue_day(since)}} if since else {}
+    return await db.revenue_daily.count_documents(bucket_filter)
+
+async def get_daily_revenue(dealer_id: str, start: datetime, end: Optional[datetime] = None) -> list:
+    """Per-day revenue and order counts for a dealer from the rollup"""
+    day_range = {"$gte": revenue_day(start)}
+    if end:
+        day_range["$lte"] = end
+
+    pipeline = [
+        {"$match": {"dealerID": dealer_id, "day": day_range}},
+        {
+            "$group": {
+                "_id": "$day",
+                "daily_revenue": {"$sum": "$revenue"},
+                "orders_count": {"$sum": "$orders"}
+            }
+        },
+        {"$sort": {"_id": 1}}
+    ]
+    return await db.revenue_daily.aggregate(pipeline).to_list(length=None)
+
+def invalidate(dealer_id: Optional[str] = None):
+    """Drop the cached snapshot for a dealer (or for every dealer)"""
+    if dealer_id is None:
+        _snapshots.clear()
+    else:
+        _snapshots.pop(dealer_id, None)
+
+async def handle_machine_change(event: dict):
+    """Expire snapshots of dealers whose occupied fleet changed"""
+    for side in ("before", "after"):
+        machine = event.get(side)
+        if machine and machine.get("status") == "Occupied":
+            invalidate(machine.get("dealerID"))
+
+def register():
+    """Subscribe snapshot invalidation to machine change events"""
+    events.subscribe(events.MACHINE_CHANGED, handle_machine_change)
@@ -0,0 +1,130 @@
+"""
+Incremental parsing of batch barcode uploads.
+
+Images are yielded one by one while the request body is still arriving:
+multipart/form-data is fed chunk by chunk to python-multipart's streaming
+parser and each file part is yielded as soon as its closing boundary is
+seen, so decoding of early images overlaps the upload of later ones. A zip
+archive can only be read once its central directory (at the end) has
+arrived, so it is spooled to a temporary file first and its images are
+then yielded in archive order.
+"""
+import os
+import tempfile
+import zipfile
+from decouple import config
+from multipart.exceptions import MultipartParseError
+from multipart.multipart import MultipartParser, parse_options_header
+
+from .barcode import BARCODE_MAX_BYTES
+
+BARCODE_BATCH_MAX_IMAGES = int(config("BARCODE_BATCH_MAX_IMAGES", default="100"))
+# Zip uploads up to this size stay in memory, larger ones go to disk
+ZIP_SPOOL_BYTES = int(config("ZIP_SPOOL_BYTES", default=str(16 * 1024 * 1024)))
+
+ZIP_CONTENT_TYPES = ("application/zip", "application/x-zip-compressed")
+IMAGE_EXTENSIONS = {".png": "image/png", ".jpg": "image/jpeg", ".jpeg": "image/jpeg",
+                    ".bmp": "image/bmp", ".tif": "image/tiff", ".tiff": "image/tiff", ".webp": "image/webp"}
+
+class UploadError(ValueError):
+    """The batch upload is malformed or over its limits"""
+
+def _check_count(count: int):
+    if count > BARCODE_BATCH_MAX_IMAGES:
+        raise UploadError(f"At most {BARCODE_BATCH_MAX_IMAGES} images per batch")
+
+async def multipart_images(stream, content_type: str):
+    """Yield (filename, content_type, data) for each file part as it completes"""
+    _, options = parse_options_header(content_type)
+    boundary = options.get(b"boundary")
+    if not boundary:
+        raise UploadError("Missing multipart boundary")
+
+    completed = []
+    part = {}
+    header = {"field": b"", "value": b""}
+
+    def on_part_begin():
+        part.clear()
+        part.update({"headers": {}, "chunks": [], "size": 0})
+
+    def on_part_data(data, start, end):
+        part["size"] += end - start
+        if part["size"] > BARCODE_MAX_BYTES:
+            raise UploadError("Image is too large")
+        part["chunks"].append(data[start:end])
+
+    def on_header_field(data, start, end):
+        header["field"] += data[start:end]
+
+    def on_header_value(data, start, end):
+        header["value"] += data[start:end]
+
+    def on_header_end():
+        part["headers"][header["field"].lower()] = header["value"]
+        header["field"], header["value"] = b"", b""
+
+    def on_part_end():
+        _, disposition = parse_options_header(part["headers"].get(b"content-disposition", b""))
+        filename = disposition.get(b"filename")
+        # Plain form fields are not images
+        if filename is None:
+            return
+        completed.append((
+            filename.decode("utf-8", errors="replace"),
+            part["headers"].get(b"content-type", b"application/octet-stream").decode("latin-1"),
+            b"".join(part["chunks"])
+        ))
+
+    parser = MultipartParser(boundary, {
+        "on_part_begin": on_part_begin,
+        "on_part_data": on_part_data,
+        "on_part_end": on_part_end,
+        "on_header_field": on_header_field,
+        "on_header_value": on_header_value,
+        "on_header_end": on_header_end
+    })
+
+    count = 0
+    try:
+        async for chunk in stream:
+            parser.write(chunk)
+            for image in completed:
+                count += 1
+                _check_count(count)
+                yield image
+            completed.clear()
+        parser.finalize()
+    except MultipartParseError as e:
+        raise UploadError(f"Malformed multipart body: {str(e)}")
+
+async def zip_images(stream):
+    """Yield (filename, content_type, data) for each image in an uploaded zip"""
+    with tempfile.SpooledTemporaryFile(max_size=ZIP_SPOOL_BYTES) as spool:
+        size = 0
+        async for chunk in stream:
+            size += len(chunk)
+            if size > BARCODE_MAX_BYTES * BARCODE_BATCH_MAX_IMAGES:
+                raise UploadError("Archive is too large")
+            spool.write(chunk)
+        spool.seek(0)
+
+        try:
+            archive = zipfile.ZipFile(spool)
+        except zipfile.BadZipFile:
+            raise UploadError("File is not a valid zip archive")
+
+        entries = [
+            entry for entry in archive.infolist()
+            if not entry.is_dir() and not os.path.basename(entry.filename).startswith(".")
+        ]
+        _check_count(len(entries))
+        for entry in entries:
+            extension = os.path.splitext(entry.filename)[1].lower()
+            if entry.file_size > BARCODE_MAX_BYTES:
+                raise UploadError(f"{entry.filename} is too large")
+            yield (
+                entry.filename,
+                IMAGE_EXTENSIONS.get(extension, "application/octet-stream"),
+                archive.read(entry)
+            )
@@ -0,0 +1,204 @@
+"""
+In-process periodic task scheduler.
+
+Tasks use five-field cron specs (minute hour day-of-month month day-of-week,
+UTC). Every worker runs the same timers; before running a slot each one
+sleeps a random jitter and then tries to take the task's lease document in
+Mongo, so exactly one worker or replica runs each scheduled slot.
+"""
+import asyncio
+import os
+import random
+import socket
+import uuid
+import motor.motor_asyncio
+from decouple import config
+from datetime import datetime, timedelta
+from typing import Optional
+from pymongo import ReturnDocument
+from pymongo.errors import DuplicateKeyError
+
+# MongoDB connection
+MONGODB_URL = config("MONGODB_URL")
+client = motor.motor_asyncio.AsyncIOMotorClient(MONGODB_URL)
+db = client.caterpillar_db
+
+SCHEDULER_ENABLED = config("SCHEDULER_ENABLED", default=True, cast=bool)
+INSTANCE_ID = f"{socket.gethostname()}:{os.getpid()}:{uuid.uuid4().hex[:8]}"
+
+# Extra time a lease outlives a task's timeout
+LEASE_MARGIN_SECONDS = 60
+
+CRON_FIELDS = [
+    ("minute", 0, 59),
+    ("hour", 0, 23),
+    ("day", 1, 31),
+    ("month", 1, 12),
+    ("weekday", 0, 6),
+]
+
+_tasks = {}
+_runners = []
+
+def _parse_cron_field(field: str, low: int, high: int) -> set:
+    values = set()
+    for part in field.split(","):
+        step = 1
+        if "/" in part:
+            part, step_text = part.split("/", 1)
+            step = int(step_text)
+        if part == "*":
+            start, end = low, high
+        elif "-" in part:
+            start_text, end_text = part.split("-", 1)
+            start, end = int(start_text), int(end_text)
+        else:
+            start = int(part)
+            end = high if step > 1 else start
+        if step < 1 or start < low or end > high + (1 if high == 6 else 0) or start > end:
+            raise ValueError(f"Invalid cron field '{field}'")
+        values.update(range(start, end + 1, step))
+    return values
+
+def parse_cron(expression: str) -> dict:
+    """Parse a five-field cron expression into sets of allowed values"""
+    fields = expression.split()
+    if len(fields) != 5:
+        raise ValueError(f"Cron expression must have 5 fields: '{expression}'")
+
+    spec = {}
+    for text, (name, low, high) in zip(fields, CRON_FIELDS):
+        spec[name] = _parse_cron_field(text, low, high)
+        spec[f"{name}_any"] = text == "*"
+
+    # Both 0 and 7 mean Sunday
+    if 7 in spec["weekday"]:
+        spec["weekday"].discard(7)
+        spec["weekday"].add(0)
+    return spec
+
+def _day_matches(spec: dict, moment: datetime) -> bool:
+    day_ok = moment.day in spec["day"]
+    weekday_ok = (moment.weekday() + 1) % 7 in spec["weekday"]
+    # Standard cron: when both day fields are restricted, either may match
+    if not spec["day_any"] and not spec["weekday_any"]:
+        return day_ok or weekday_ok
+    return day_ok and weekday_ok
+
+def next_run(spec: dict, after: datetime) -> datetime:
+    """First time strictly after `after` that matches the spec"""
+    moment = after.replace(second=0, microsecond=0) + timedelta(minutes=1)
+    limit = moment + timedelta(days=366 * 5)
+
+    while moment < limit:
+        if moment.month not in spec["month"]:
+            year = moment.year + (1 if moment.month == 12 else 0)
+            month = 1 if moment.month == 12 else moment.month + 1
+            moment = moment.replace(year=year, month=month, day=1, hour=0, minute=0)
+            continue
+        if not _day_matches(spec, moment):
+            moment = moment.replace(hour=0, minute=0) + timedelta(days=1)
+            continue
+        if moment.hour not in spec["hour"]:
+            moment = moment.replace(minute=0) + timedelta(hours=1)
+            continue
+        if moment.minute not in spec["minute"]:
+            moment += timedelta(minutes=1)
+            continue
+        return moment
+
+    raise ValueError("Cron expression never matches")
+
+def register_task(
+    name: str,
+    cron: str,
+    func,
+    timeout_seconds: float = 1800,
+    jitter_seconds: float = 30
+):
+    """Register an async callable to run on a cron schedule"""
+    _tasks[name] = {
+        "name": name,
+        "cron": cron,
+        "spec": parse_cron(cron),
+        "func": func,
+        "timeout": timeout_seconds,
+        "jitter": jitter_seconds
+    }
+
+async def acquire_lease(name: str, slot: datetime, ttl_seconds: float) -> bool:
+    """Claim a task's slot; only one instance can win each slot"""
+    now = datetime.utcnow()
+    try:
+        lease = await db.scheduler_leases.find_one_and_update(
+            {
+                "_id": name,
+                "slot": {"$lt": slot},
+                "$or": [{"expiresAt": {"$lte": now}}, {"holder": INSTANCE_ID}]
+            },
+            {
+                "$set": {
+                    "holder": INSTANCE_ID,
+                    "slot": slot,
+                    "acquiredAt": now,
+                    "expiresAt": now + timedelta(seconds=ttl_seconds)
+                }
+            },
+            upsert=True,
+            return_document=ReturnDocument.AFTER
+        )
+    except DuplicateKeyError:
+        # Another instance holds the lease or already ran this slot
+        return False
+    return lease is not None
+
+async def release_lease(name: str, status: str):
+    await db.scheduler_leases.update_one(
+        {"_id": name, "holder": INSTANCE_ID},
+        {"$set": {"expiresAt": datetime.utcnow(), "lastStatus": status, "finishedAt": datetime.utcnow()}}
+    )
+
+async def run_task_once(task: dict, slot: datetime) -> Optional[str]:
+    """Run one slot of a task if this instance wins the lease"""
+    if not await acquire_lease(task["name"], slot, task["timeout"] + LEASE_MARGIN_SECONDS):
+        return None
+
+    status = "success"
+    try:
+        await asyncio.wait_for(task["func"](), timeout=task["timeout"])
+    except asyncio.TimeoutError:
+        status = "timeout"
+        print(f"Scheduled task {task['name']} timed out after {task['timeout']}s")
+    except Exception as e:
+        status = "error"
+        print(f"Scheduled task {task['name']} failed: {str(e)}")
+    finally:
+        await release_lease(task["name"], status)
+    return status
+
+async def _run_forever(task: dict):
+    while True:
+        slot = next_run(task["spec"], datetime.utcnow())
+        delay = (slot - datetime.utcnow()).total_seconds() + random.uniform(0, task["jitter"])
+        await asyncio.sleep(max(delay, 0))
+        try:
+            await run_task_once(task, slot)
+        except Exception as e:
+            print(f"Scheduler error for {task['name']}: {str(e)}")
+
+def start():
+    """Start a timer loop for every registered task"""
+    if not SCHEDULER_ENABLED or _runners:
+        return
+    for task in _tasks.values():
+        _runners.append(asyncio.create_task(_run_forever(task)))
+
+async def stop():
+    for runner in _runners:
+        runner.cancel()
+    for runner in _runners:
+        try:
+            await runner
+        except asyncio.CancelledError:
+            pass
+    _runners.clear()
@@ -0,0 +1,39 @@
+"""
+orjson-backed JSON encoding for API responses.
+
+orjson serializes datetime, enums, dataclasses and numpy arrays natively;
+`_default` covers the Mongo and pydantic types it does not know about, so
+handlers can return documents straight from a cursor.
+"""
+import orjson
+from decimal import Decimal
+from typing import Any
+from bson import ObjectId
+from pydantic import BaseModel
+from fastapi.responses import JSONResponse
+
+DUMPS_OPTIONS = orjson.OPT_NON_STR_KEYS | orjson.OPT_SERIALIZE_NUMPY
+
+def _default(value: Any):
+    if isinstance(value, ObjectId):
+        return str(value)
+    if isinstance(value, BaseModel):
+        return value.model_dump()
+    if isinstance(value, Decimal):
+        return float(value)
+    if isinstance(value, (set, frozenset)):
+        return list(value)
+    raise TypeError(f"Type is not JSON serializable: {type(value).__name__}")
+
+def dumps(content: Any) -> bytes:
+    """Encode content to JSON bytes"""
+    return orjson.dumps(content, default=_default, option=DUMPS_OPTIONS)
+
+class FastJSONResponse(JSONResponse):
+    """JSONResponse rendered with orjson, including ObjectId and BaseModel values"""
+    def render(self, content: Any) -> bytes:
+        return dumps(content)
+
+def api_response(success: bool, message: str, data: dict = None) -> FastJSONResponse:
+    """APIResponse envelope rendered directly, skipping response_model re-validation"""
+    return FastJSONResponse({"success": success, "message": message, "data": data})
@@ -0,0 +1,85 @@
+"""
+Single-flight coalescing for expensive computations.
+
+Concurrent calls with the same (operation, dealer/owner, params) key await
+one shared task instead of each running the work: the first caller starts
+it, later callers join it, and everyone receives its result or exception.
+The key is released as soon as the task finishes, so this only merges
+overlapping calls and never serves stale results. The shared task is
+bounded by the starting caller's timeout; every caller also waits at most
+its own timeout, and a caller that gives up or disconnects does not cancel
+the work for the others.
+"""
+import asyncio
+from collections import defaultdict
+from decouple import config
+from typing import Awaitable, Callable, Optional
+
+SINGLE_FLIGHT_TIMEOUT_SECONDS = float(config("SINGLE_FLIGHT_TIMEOUT_SECONDS", default="120"))
+
+_inflight = {}
+_stats = defaultdict(lambda: {"calls": 0, "executions": 0, "coalesced": 0, "timeouts": 0, "abandoned": 0, "errors": 0, "max_waiters": 0})
+_waiters = defaultdict(int)
+
+def flight_key(operation: str, owner: Optional[str], params: Optional[dict] = None) -> tuple:
+    return (operation, owner, tuple(sorted((params or {}).items())))
+
+def _release(key: tuple, task: asyncio.Task):
+    if _inflight.get(key) is task:
+        del _inflight[key]
+    if task.cancelled():
+        return
+    error = task.exception()
+    if isinstance(error, asyncio.TimeoutError):
+        _stats[key[0]]["timeouts"] += 1
+    elif error is not None:
+        _stats[key[0]]["errors"] += 1
+
+async def run(
+    operation: str,
+    owner: Optional[str],
+    params: Optional[dict],
+    func: Callable[[], Awaitable],
+    timeout_seconds: float = SINGLE_FLIGHT_TIMEOUT_SECONDS
+):
+    """
+    Result of `func()`, shared with every concurrent call for the same key;
+    raises asyncio.TimeoutError when the shared computation overruns or this
+    caller has waited `timeout_seconds`
+    """
+    key = flight_key(operation, owner, params)
+    stats = _stats[operation]
+    stats["calls"] += 1
+
+    task = _inflight.get(key)
+    if task is None:
+        stats["executions"] += 1
+        task = asyncio.create_task(asyncio.wait_for(func(), timeout_seconds))
+        _inflight[key] = task
+        task.add_done_callback(lambda done: _release(key, done))
+    else:
+        stats["coalesced"] += 1
+
+    _waiters[key] += 1
+    stats["max_waiters"] = max(stats["max_waiters"], _waiters[key])
+    try:
+        # Shielded so one caller timing out or going away does not cancel the shared work
+        return await asyncio.wait_for(asyncio.shield(task), timeout_seconds)
+    except asyncio.TimeoutError:
+        if not task.done():
+            stats["abandoned"] += 1
+        raise
+    finally:
+        _waiters[key] -= 1
+        if not _waiters[key]:
+            del _waiters[key]
+
+def get_stats() -> dict:
+    operations = {}
+    for operation, stats in _stats.items():
+        operations[operation] = {
+            **stats,
+            "in_flight": sum(1 for key in _inflight if key[0] == operation),
+            "coalesced_ratio": round(stats["coalesced"] / stats["calls"], 4) if stats["calls"] else 0.0
+        }
+    return {"timeout_seconds": SINGLE_FLIGHT_TIMEOUT_SECONDS, "operations": operations}
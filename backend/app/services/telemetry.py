@@ -0,0 +1,187 @@
+"""
+Bulk telemetry ingestion.
+
+A batch is validated reading by reading, appended in full to the
+`telemetry_readings` time-series collection, then collapsed to the newest
+stored reading per machine and applied with one unordered bulk_write.
+Readings older than the one a machine already holds never overwrite it.
+"""
+import motor.motor_asyncio
+from decouple import config
+from datetime import datetime, timedelta, timezone
+from typing import Optional
+from pydantic import ValidationError
+from pymongo import ASCENDING, UpdateOne
+from pymongo.errors import BulkWriteError, CollectionInvalid, OperationFailure
+
+from ..models.database import TelemetryReading
+from .events import emit_machine_changes, MACHINE_EVENT_FIELDS
+
+# MongoDB connection
+MONGODB_URL = config("MONGODB_URL")
+client = motor.motor_asyncio.AsyncIOMotorClient(MONGODB_URL)
+db = client.caterpillar_db
+
+TELEMETRY_MAX_BATCH = int(config("TELEMETRY_MAX_BATCH", default="10000"))
+TELEMETRY_RETENTION_DAYS = int(config("TELEMETRY_RETENTION_DAYS", default="400"))
+
+# Clock skew tolerated on gateway timestamps
+MAX_FUTURE_SKEW = timedelta(minutes=5)
+
+async def ensure_collections():
+    """Create the raw readings time-series collection"""
+    try:
+        await db.create_collection(
+            "telemetry_readings",
+            timeseries={"timeField": "timestamp", "metaField": "meta", "granularity": "minutes"},
+            expireAfterSeconds=TELEMETRY_RETENTION_DAYS * 86400
+        )
+    except CollectionInvalid:
+        pass  # Already exists
+    except OperationFailure:
+        # Server without time-series support: plain collection with a TTL index
+        await db.telemetry_readings.create_index(
+            [("meta.machineID", ASCENDING), ("timestamp", ASCENDING)]
+        )
+        await db.telemetry_readings.create_index(
+            "timestamp", expireAfterSeconds=TELEMETRY_RETENTION_DAYS * 86400
+        )
+
+def _utc(timestamp: Optional[datetime], received_at: datetime) -> datetime:
+    if timestamp is None:
+        return received_at
+    if timestamp.tzinfo is not None:
+        timestamp = timestamp.astimezone(timezone.utc).replace(tzinfo=None)
+    return timestamp
+
+def validate_readings(raw_readings: list, received_at: datetime) -> tuple:
+    """Split a batch into valid readings and per-item errors (by index)"""
+    readings, errors = [], []
+    for index, raw in enumerate(raw_readings):
+        try:
+            reading = TelemetryReading.model_validate(raw)
+        except ValidationError as e:
+            errors.append({
+                "index": index,
+                "machineID": raw.get("machine_id") if isinstance(raw, dict) else None,
+                "error": "; ".join(f"{'.'.join(map(str, err['loc']))}: {err['msg']}" for err in e.errors())
+            })
+            continue
+
+        timestamp = _utc(reading.timestamp, received_at)
+        if timestamp > received_at + MAX_FUTURE_SKEW:
+            errors.append({"index": index, "machineID": reading.machine_id, "error": "timestamp is in the future"})
+            continue
+        if reading.engine_hours_per_day + reading.idle_hours > 24:
+            errors.append({"index": index, "machineID": reading.machine_id, "error": "engine and idle hours exceed 24"})
+            continue
+
+        readings.append((index, reading, timestamp))
+    return readings, errors
+
+async def ingest_readings(raw_readings: list, dealer_id: Optional[str] = None) -> dict:
+    """Validate and apply a batch; dealer_id restricts it to one dealership's fleet"""
+    received_at = datetime.utcnow()
+    readings, errors = validate_readings(raw_readings, received_at)
+
+    machine_ids = {reading.machine_id for _, reading, _ in readings}
+    machine_query = {"machineID": {"$in": list(machine_ids)}}
+    if dealer_id:
+        machine_query["dealerID"] = dealer_id
+    projection = {field: 1 for field in MACHINE_EVENT_FIELDS + ["telemetryAt"]}
+    before_docs = {
+        machine["machineID"]: machine
+        for machine in await db.machines.find(machine_query, projection).to_list(length=None)
+    } if machine_ids else {}
+
+    known = []
+    for index, reading, timestamp in readings:
+        if reading.machine_id in before_docs:
+            known.append((index, reading, timestamp))
+        else:
+            errors.append({"index": index, "machineID": reading.machine_id, "error": "Unknown machine"})
+
+    # Raw readings are stored first: a failed insert leaves the machines
+    # untouched, and readings the insert rejected never update a machine
+    raw_docs = [
+        {
+            "timestamp": timestamp,
+            "meta": {
+                "machineID": reading.machine_id,
+                "dealerID": before_docs[reading.machine_id].get("dealerID"),
+                "userID": before_docs[reading.machine_id].get("userID")
+            },
+            "engineHoursPerDay": reading.engine_hours_per_day,
+            "idleHours": reading.idle_hours,
+            "operatingDays": reading.operating_days,
+            "receivedAt": received_at
+        }
+        for _, reading, timestamp in known
+    ]
+    stored = known
+    if raw_docs:
+        try:
+            await db.telemetry_readings.insert_many(raw_docs, ordered=False)
+        except BulkWriteError as e:
+            failed = {write_error["index"] for write_error in e.details.get("writeErrors", [])}
+            for write_error in e.details.get("writeErrors", []):
+                index, reading, _ = known[write_error["index"]]
+                errors.append({"index": index, "machineID": reading.machine_id, "error": write_error.get("errmsg")})
+            stored = [entry for position, entry in enumerate(known) if position not in failed]
+
+    # Newest stored reading per machine updates the machine
+    latest = {}
+    for index, reading, timestamp in stored:
+        current = latest.get(reading.machine_id)
+        if current is None or timestamp >= current[2]:
+            latest[reading.machine_id] = (index, reading, timestamp)
+
+    operations, applied = [], []
+    for machine_id, (_, reading, timestamp) in latest.items():
+        fields = {
+            "engineHoursPerDay": reading.engine_hours_per_day,
+            "idleHours": reading.idle_hours,
+            "telemetryAt": timestamp,
+            "updatedAt": received_at
+        }
+        if reading.operating_days is not None:
+            fields["operatingDays"] = reading.operating_days
+        operations.append(UpdateOne(
+            {
+                "machineID": machine_id,
+                "$or": [{"telemetryAt": {"$lt": timestamp}}, {"telemetryAt": {"$exists": False}}]
+            },
+            {"$set": fields}
+        ))
+        applied.append((machine_id, fields))
+
+    modified, unapplied = 0, set()
+    if operations:
+        try:
+            result = await db.machines.bulk_write(operations, ordered=False)
+            modified = result.modified_count
+        except BulkWriteError as e:
+            modified = e.details.get("nModified", 0)
+            for write_error in e.details.get("writeErrors", []):
+                machine_id, _ = applied[write_error["index"]]
+                unapplied.add(machine_id)
+                errors.append({"index": latest[machine_id][0], "machineID": machine_id, "error": write_error.get("errmsg")})
+
+    changes = []
+    for machine_id, fields in applied:
+        if machine_id in unapplied:
+            continue
+        before = before_docs[machine_id]
+        # Skip machines that already hold a newer reading
+        if before.get("telemetryAt") is None or before["telemetryAt"] < fields["telemetryAt"]:
+            changes.append((before, {**before, **fields}))
+    await emit_machine_changes(changes)
+
+    errors.sort(key=lambda error: error["index"])
+    return {
+        "received": len(raw_readings),
+        "accepted": len(stored),
+        "machines_updated": modified,
+        "rejected": len(errors),
+        "errors": errors
+    }
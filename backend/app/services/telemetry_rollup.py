@@ -0,0 +1,281 @@
+"""
+Daily and weekly utilization buckets rolled up from raw telemetry.
+
+Buckets live in `telemetry_rollups`, one document per (scope, key, period,
+bucketStart) where scope is "machine" (key = machineID) or "user" (key =
+userID) and period is "day" or "week" (ISO weeks starting Monday). Each
+bucket holds summed engine and idle hours and the number of operating days
+(machine-days for user buckets).
+
+The rollup is incremental: each run picks up readings received since the
+stored watermark and recomputes only the machine-days, machine-weeks and
+user buckets those readings touch, so reruns and late readings are safe.
+A machine's hours for a day are the mean of that day's readings, since
+every reading reports hours per day rather than an increment.
+"""
+import motor.motor_asyncio
+from decouple import config
+from datetime import datetime, timedelta
+from typing import Iterable, Optional
+from pymongo import ASCENDING
+from pymongo.errors import OperationFailure
+
+from .health_history import bucket_start
+
+# MongoDB connection
+MONGODB_URL = config("MONGODB_URL")
+client = motor.motor_asyncio.AsyncIOMotorClient(MONGODB_URL)
+db = client.caterpillar_db
+
+# Readings received in the last few seconds may still be in flight
+ROLLUP_LAG_SECONDS = int(config("TELEMETRY_ROLLUP_LAG_SECONDS", default="60"))
+# Trailing window consumers read when summarising current utilization
+USAGE_WINDOW_DAYS = int(config("TELEMETRY_USAGE_WINDOW_DAYS", default="7"))
+
+WATERMARK_ID = "telemetry_rollups"
+MERGE_ON = ["scope", "key", "period", "bucketStart"]
+
+async def ensure_indexes():
+    await db.telemetry_rollups.create_index(
+        [("scope", ASCENDING), ("key", ASCENDING), ("period", ASCENDING), ("bucketStart", ASCENDING)],
+        unique=True
+    )
+    await db.telemetry_rollups.create_index(
+        [("scope", ASCENDING), ("period", ASCENDING), ("userID", ASCENDING), ("bucketStart", ASCENDING)]
+    )
+    try:
+        await db.telemetry_readings.create_index("receivedAt")
+    except OperationFailure as e:
+        # Older servers cannot index time-series measurements
+        print(f"Telemetry receivedAt index unavailable: {str(e)}")
+
+MERGE_STAGE = {
+    "$merge": {
+        "into": "telemetry_rollups",
+        "on": MERGE_ON,
+        "whenMatched": "replace",
+        "whenNotMatched": "insert"
+    }
+}
+
+# Date arithmetic avoids $dateTrunc/$dateSubtract (MongoDB 5.0+) so the
+# rollup runs on the pre-5.0 servers that the time-series fallbacks in
+# services.telemetry and services.health_history support ($merge needs 4.2)
+
+def _day_expression(date_field: str) -> dict:
+    """UTC midnight of the day containing a date"""
+    return {
+        "$dateFromParts": {
+            "year": {"$year": date_field},
+            "month": {"$month": date_field},
+            "day": {"$dayOfMonth": date_field}
+        }
+    }
+
+def _week_expression(date_field: str) -> dict:
+    """Monday of the ISO week containing a UTC midnight date"""
+    return {
+        "$subtract": [
+            date_field,
+            {"$multiply": [{"$subtract": [{"$isoDayOfWeek": date_field}, 1]}, 86400000]}
+        ]
+    }
+
+async def _rollup_machine_days(machine_ids: list, start: datetime, end: datetime, now: datetime):
+    """Recompute machine/day buckets from raw readings"""
+    await db.telemetry_readings.aggregate([
+        {
+            "$match": {
+                "meta.machineID": {"$in": machine_ids},
+                "timestamp": {"$gte": start, "$lt": end}
+            }
+        },
+        {"$sort": {"timestamp": 1}},
+        {
+            "$group": {
+                "_id": {
+                    "machineID": "$meta.machineID",
+                    "day": _day_expression("$timestamp")
+                },
+                "engineHours": {"$avg": "$engineHoursPerDay"},
+                "idleHours": {"$avg": "$idleHours"},
+                "readings": {"$sum": 1},
+                "userID": {"$last": "$meta.userID"},
+                "dealerID": {"$last": "$meta.dealerID"}
+            }
+        },
+        {
+            "$project": {
+                "_id": 0,
+                "scope": "machine",
+                "key": "$_id.machineID",
+                "period": "day",
+                "bucketStart": "$_id.day",
+                "engineHours": 1,
+                "idleHours": 1,
+                "operatingDays": {"$cond": [{"$gt": ["$engineHours", 0]}, 1, 0]},
+                "readings": 1,
+                "userID": 1,
+                "dealerID": 1,
+                "updatedAt": {"$literal": now}
+            }
+        },
+        MERGE_STAGE
+    ]).to_list(length=None)
+
+async def _rollup_from_machine_days(match: dict, scope: str, period: str, now: datetime):
+    """Sum machine/day buckets into machine/week, user/day or user/week buckets"""
+    key = "$key" if scope == "machine" else "$userID"
+    bucket = "$bucketStart" if period == "day" else _week_expression("$bucketStart")
+    await db.telemetry_rollups.aggregate([
+        {"$match": {"scope": "machine", "period": "day", **match}},
+        {"$sort": {"bucketStart": 1}},
+        {
+            "$group": {
+                "_id": {"key": key, "bucketStart": bucket},
+                "engineHours": {"$sum": "$engineHours"},
+                "idleHours": {"$sum": "$idleHours"},
+                "operatingDays": {"$sum": "$operatingDays"},
+                "readings": {"$sum": "$readings"},
+                "userID": {"$last": "$userID"},
+                "dealerID": {"$last": "$dealerID"}
+            }
+        },
+        {"$match": {"_id.key": {"$ne": None}}},
+        {
+            "$project": {
+                "_id": 0,
+                "scope": scope,
+                "key": "$_id.key",
+                "period": period,
+                "bucketStart": "$_id.bucketStart",
+                "engineHours": 1,
+                "idleHours": 1,
+                "operatingDays": 1,
+                "readings": 1,
+                "userID": 1,
+                "dealerID": 1,
+                "updatedAt": {"$literal": now}
+            }
+        },
+        MERGE_STAGE
+    ]).to_list(length=None)
+
+async def run_rollup(until: Optional[datetime] = None) -> dict:
+    """Roll up readings received since the watermark and advance it"""
+    now = datetime.utcnow()
+    until = until or now - timedelta(seconds=ROLLUP_LAG_SECONDS)
+    state = await db.rollup_watermarks.find_one({"_id": WATERMARK_ID}) or {}
+    watermark = state.get("watermark", datetime(1970, 1, 1))
+    if until <= watermark:
+        return {"watermark": watermark, "readings": 0, "machines": 0, "users": 0}
+
+    touched = await db.telemetry_readings.aggregate([
+        {"$match": {"receivedAt": {"$gt": watermark, "$lte": until}}},
+        {
+            "$group": {
+                "_id": None,
+                "readings": {"$sum": 1},
+                "machineIDs": {"$addToSet": "$meta.machineID"},
+                "userIDs": {"$addToSet": "$meta.userID"},
+                "first": {"$min": "$timestamp"},
+                "last": {"$max": "$timestamp"}
+            }
+        }
+    ]).to_list(length=1)
+
+    summary = {"watermark": until, "readings": 0, "machines": 0, "users": 0}
+    if touched:
+        touched = touched[0]
+        machine_ids = touched["machineIDs"]
+        first_day = bucket_start(touched["first"], "day")
+        last_day = bucket_start(touched["last"], "day") + timedelta(days=1)
+        first_week = bucket_start(first_day, "week")
+        last_week = bucket_start(touched["last"], "week") + timedelta(days=7)
+
+        week_range = {"bucketStart": {"$gte": first_week, "$lt": last_week}}
+
+        # Users whose buckets include these machine-days before or after the rerun
+        previous_users = await db.telemetry_rollups.distinct(
+            "userID", {"scope": "machine", "period": "day", "key": {"$in": machine_ids}, **week_range}
+        )
+        await _rollup_machine_days(machine_ids, first_day, last_day, now)
+        user_ids = [user_id for user_id in set(touched["userIDs"]) | set(previous_users) if user_id]
+
+        await _rollup_from_machine_days({"key": {"$in": machine_ids}, **week_range}, "machine", "week", now)
+        if user_ids:
+            user_match = {"userID": {"$in": user_ids}, **week_range}
+            await _rollup_from_machine_days(user_match, "user", "day", now)
+            await _rollup_from_machine_days(user_match, "user", "week", now)
+            # A user bucket not rewritten by this run has lost all its machine-days
+            await db.telemetry_rollups.delete_many({
+                "scope": "user",
+                "key": {"$in": user_ids},
+                "updatedAt": {"$lt": now},
+                **week_range
+            })
+
+        summary.update(readings=touched["readings"], machines=len(machine_ids), users=len(user_ids))
+
+    await db.rollup_watermarks.update_one(
+        {"_id": WATERMARK_ID},
+        {"$set": {"watermark": until, "lastRunAt": now, "lastRun": summary}},
+        upsert=True
+    )
+    print(f"Telemetry rollup processed {summary['readings']} readings for {summary['machines']} machines")
+    return summary
+
+async def get_buckets(scope: str, key: str, period: str, start: datetime, end: Optional[datetime] = None) -> list:
+    """Buckets for one machine or user, oldest first"""
+    query = {
+        "scope": scope,
+        "key": key,
+        "period": period,
+        "bucketStart": {"$gte": bucket_start(start, period), "$lte": end or datetime.utcnow()}
+    }
+    return await db.telemetry_rollups.find(
+        query, {"_id": 0, "scope": 0, "key": 0, "period": 0}
+    ).sort("bucketStart", 1).to_list(length=None)
+
+async def get_machine_usage(machine_ids: Iterable[str], days: int = USAGE_WINDOW_DAYS) -> dict:
+    """Summed engine/idle hours and operating days per machine over a trailing window"""
+    machine_ids = list({machine_id for machine_id in machine_ids if machine_id})
+    if not machine_ids:
+        return {}
+    since = bucket_start(datetime.utcnow() - timedelta(days=days - 1), "day")
+    totals = await db.telemetry_rollups.aggregate([
+        {
+            "$match": {
+                "scope": "machine",
+                "period": "day",
+                "key": {"$in": machine_ids},
+                "bucketStart": {"$gte": since}
+            }
+        },
+        {
+            "$group": {
+                "_id": "$key",
+                "engineHours": {"$sum": "$engineHours"},
+                "idleHours": {"$sum": "$idleHours"},
+                "operatingDays": {"$sum": "$operatingDays"},
+                "reportingDays": {"$sum": 1}
+            }
+        }
+    ]).to_list(length=None)
+    return {total.pop("_id"): total for total in totals}
+
+def with_usage(machine: dict, usage: dict) -> dict:
+    """
+    A machine with its snapshot hours replaced by per-day averages from the
+    rollup window; machines without rolled-up telemetry are returned as is
+    """
+    window = usage.get(machine.get("machineID"))
+    if not window or not window["reportingDays"]:
+        return machine
+    return {
+        **machine,
+        "engineHoursPerDay": window["engineHours"] / window["reportingDays"],
+        "idleHours": window["idleHours"] / window["reportingDays"],
+        "operatingDays": window["operatingDays"],
+        "windowEngineHours": window["engineHours"]
+    }
@@ -0,0 +1,159 @@
+"""
+Vectorized fleet utilization statistics.
+
+Two utilization metrics are in use:
+
+- RATIO: engine hours / (engine + idle hours), how much of the time a
+  machine is running it is actually working (health scoring, usage
+  optimization). Machines with no hours have no utilization.
+- SHIFT: engine hours per day / SHIFT_HOURS, how much of a working day a
+  machine runs (fleet and customer AI recommendations). Machines missing
+  engine hours or operating days have no utilization.
+
+`fleet_stats` turns a list of machine documents into column arrays once and
+derives every statistic the routers need from them in one pass. NumPy is
+imported on first use so workers that never compute statistics skip it.
+"""
+from typing import TYPE_CHECKING
+
+if TYPE_CHECKING:
+    import numpy as np
+
+RATIO = "ratio"
+SHIFT = "shift"
+SHIFT_HOURS = 8.0
+
+# Fields fleet_stats reads; pass as the find() projection
+UTILIZATION_PROJECTION = {
+    "_id": 0,
+    "machineID": 1,
+    "machineType": 1,
+    "status": 1,
+    "userID": 1,
+    "location": 1,
+    "engineHoursPerDay": 1,
+    "idleHours": 1,
+    "operatingDays": 1
+}
+
+PERCENTILES = (10, 25, 50, 75, 90)
+
+def _column(machines: list, field: str) -> "np.ndarray":
+    """Float column with NaN for missing values"""
+    import numpy as np
+    values = (machine.get(field) for machine in machines)
+    return np.fromiter(
+        (np.nan if value is None else value for value in values),
+        dtype=np.float64,
+        count=len(machines)
+    )
+
+def utilization_array(engine: "np.ndarray", idle: "np.ndarray", operating_days: "np.ndarray", metric: str) -> "np.ndarray":
+    """Per-machine utilization percentages, NaN where the metric is undefined"""
+    import numpy as np
+    if metric == RATIO:
+        engine = np.nan_to_num(engine)
+        total = engine + np.nan_to_num(idle)
+        with np.errstate(divide="ignore", invalid="ignore"):
+            return np.where(total > 0, engine / total * 100, np.nan)
+    if metric == SHIFT:
+        return np.where(np.isnan(operating_days), np.nan, engine / SHIFT_HOURS * 100)
+    raise ValueError(f"Unknown utilization metric: {metric}")
+
+def _flagged(machines: list, indexes: "np.ndarray", utilization: "np.ndarray") -> list:
+    return [
+        {
+            "machine_id": machines[i].get("machineID"),
+            "machine_type": machines[i].get("machineType", "Unknown"),
+            "utilization": round(float(utilization[i]), 2)
+        }
+        for i in indexes
+    ]
+
+def fleet_stats(
+    machines: list,
+    metric: str = RATIO,
+    over: float = 80,
+    under: float = 30
+) -> dict:
+    """
+    Mean, percentiles, variance, over/under-utilized machines and per-type
+    breakdown for a fleet; totals and averages cover scored machines only
+    """
+    import numpy as np
+
+    engine = _column(machines, "engineHoursPerDay")
+    idle = _column(machines, "idleHours")
+    operating_days = _column(machines, "operatingDays")
+    # Rolled-up telemetry carries exact window totals; otherwise estimate
+    window_engine = _column(machines, "windowEngineHours")
+
+    utilization = utilization_array(engine, idle, operating_days, metric)
+    scored = ~np.isnan(utilization)
+    scored_utilization = utilization[scored]
+    over_mask = scored & (np.nan_to_num(utilization) > over)
+    under_mask = scored & (np.nan_to_num(utilization, nan=np.inf) < under)
+
+    engine_totals = np.where(
+        np.isnan(window_engine),
+        np.nan_to_num(engine) * np.nan_to_num(operating_days),
+        window_engine
+    )
+
+    stats = {
+        "metric": metric,
+        "machine_count": len(machines),
+        "scored_count": int(scored.sum()),
+        "mean": 0.0,
+        "min": 0.0,
+        "max": 0.0,
+        "range": 0.0,
+        "variance": 0.0,
+        "std": 0.0,
+        "percentiles": {f"p{p}": 0.0 for p in PERCENTILES},
+        "overutilized_count": int(over_mask.sum()),
+        "underutilized_count": int(under_mask.sum()),
+        "overutilized": _flagged(machines, np.flatnonzero(over_mask), utilization),
+        "underutilized": _flagged(machines, np.flatnonzero(under_mask), utilization),
+        "total_engine_hours": float(engine_totals[scored].sum()),
+        "total_engine_hours_per_day": float(np.nan_to_num(engine[scored]).sum()),
+        "total_idle_hours": float(np.nan_to_num(idle[scored]).sum()),
+        "avg_operating_days": float(np.nan_to_num(operating_days[scored]).mean()) if scored.any() else 0.0,
+        "by_type": {},
+        "per_machine": {
+            machine.get("machineID"): (None if np.isnan(value) else float(value))
+            for machine, value in zip(machines, utilization)
+        }
+    }
+    if not scored.any():
+        return stats
+
+    stats.update(
+        mean=float(scored_utilization.mean()),
+        min=float(scored_utilization.min()),
+        max=float(scored_utilization.max()),
+        range=float(np.ptp(scored_utilization)),
+        variance=float(scored_utilization.var()),
+        std=float(scored_utilization.std()),
+        percentiles={
+            f"p{p}": float(value)
+            for p, value in zip(PERCENTILES, np.percentile(scored_utilization, PERCENTILES))
+        }
+    )
+
+    types = np.array([machine.get("machineType") or "Unknown" for machine in machines], dtype=object)
+    type_names, type_index = np.unique(types[scored].astype(str), return_inverse=True)
+    counts = np.bincount(type_index)
+    sums = np.bincount(type_index, weights=scored_utilization)
+    over_counts = np.bincount(type_index, weights=over_mask[scored])
+    under_counts = np.bincount(type_index, weights=under_mask[scored])
+    stats["by_type"] = {
+        str(name): {
+            "count": int(counts[i]),
+            "mean": float(sums[i] / counts[i]),
+            "overutilized_count": int(over_counts[i]),
+            "underutilized_count": int(under_counts[i])
+        }
+        for i, name in enumerate(type_names)
+    }
+    return stats
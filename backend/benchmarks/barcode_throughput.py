@@ -0,0 +1,209 @@
+"""
+Barcode decoding throughput through services.barcode.
+
+Generates a corpus of machine barcode images (QR codes with machine
+payloads and EAN-13 part numbers, clean and degraded: rotated, low
+contrast, blurred, noisy, photographed-size and 12 MP phone photos), then
+decodes it inline with the coarse-to-fine pyramid off and on, and once
+through the process pool. Reports latency percentiles, the decode rate per
+variant and per-stage timings for each mode, pool throughput and the
+worst event-loop stall while the pool works.
+
+    cd backend && python -m benchmarks.barcode_throughput --images 420 --concurrency 8
+"""
+import argparse
+import asyncio
+import random
+import statistics
+import time
+from collections import Counter, defaultdict
+
+import cv2
+import numpy as np
+
+from app.services import barcode
+
+EAN_L = ["0001101", "0011001", "0010011", "0111101", "0100011", "0110001", "0101111", "0111011", "0110111", "0001011"]
+EAN_G = ["0100111", "0110011", "0011011", "0100001", "0011101", "0111001", "0000101", "0010001", "0001001", "0010111"]
+EAN_R = ["1110010", "1100110", "1101100", "1000010", "1011100", "1001110", "1010000", "1000100", "1001000", "1110100"]
+EAN_PARITY = ["LLLLLL", "LLGLGG", "LLGGLG", "LLGGGL", "LGLLGG", "LGGLLG", "LGGGLL", "LGLGLG", "LGLGGL", "LGGLGL"]
+
+def ean13(digits: str) -> str:
+    """12 digits plus check digit"""
+    total = sum(int(d) * (3 if i % 2 else 1) for i, d in enumerate(digits))
+    return digits + str((10 - total % 10) % 10)
+
+def ean13_image(code: str, module: int = 2) -> np.ndarray:
+    parity = EAN_PARITY[int(code[0])]
+    bits = "101"
+    for i, digit in enumerate(code[1:7]):
+        bits += (EAN_L if parity[i] == "L" else EAN_G)[int(digit)]
+    bits += "01010"
+    for digit in code[7:]:
+        bits += EAN_R[int(digit)]
+    bits += "101"
+    row = np.array([0 if bit == "1" else 255 for bit in bits], dtype=np.uint8)
+    # Printed labels are about 0.7 times as tall as they are wide
+    bars = np.tile(np.repeat(row, module), (int(len(bits) * module * 0.7), 1))
+    return cv2.copyMakeBorder(bars, 30, 30, 12 * module, 12 * module, cv2.BORDER_CONSTANT, value=255)
+
+def qr_image(payload: str, module: int = 6) -> np.ndarray:
+    matrix = cv2.QRCodeEncoder.create().encode(payload)
+    image = cv2.resize(matrix, None, fx=module, fy=module, interpolation=cv2.INTER_NEAREST)
+    return cv2.copyMakeBorder(image, 8 * module, 8 * module, 8 * module, 8 * module, cv2.BORDER_CONSTANT, value=255)
+
+def degrade(image: np.ndarray, variant: str, rng: random.Random) -> np.ndarray:
+    if variant == "rotated":
+        return cv2.rotate(image, cv2.ROTATE_90_CLOCKWISE)
+    if variant == "low_contrast":
+        return (image.astype(np.float32) * 0.25 + 150).astype(np.uint8)
+    if variant == "blurred":
+        return cv2.GaussianBlur(image, (5, 5), 0)
+    if variant == "noisy":
+        noise = np.random.default_rng(rng.randrange(1 << 30)).normal(0, 25, image.shape)
+        return np.clip(image + noise, 0, 255).astype(np.uint8)
+    if variant == "photo":
+        # Barcode label on a larger, uneven background as from a phone camera
+        height, width = image.shape
+        canvas = np.full((height * 3, width * 3), 200, dtype=np.uint8)
+        gradient = np.linspace(-40, 40, canvas.shape[1], dtype=np.float32)
+        canvas = np.clip(canvas + gradient, 0, 255).astype(np.uint8)
+        y, x = rng.randrange(height * 2), rng.randrange(width * 2)
+        canvas[y:y + height, x:x + width] = image
+        return canvas
+    if variant == "phone_12mp":
+        return phone_photo(image, rng)
+    return image
+
+def phone_photo(image: np.ndarray, rng: random.Random) -> np.ndarray:
+    """A 4000x3000 shot with the label at a few times print size among clutter"""
+    noise_rng = np.random.default_rng(rng.randrange(1 << 30))
+    shade = np.linspace(90, 170, 4000, dtype=np.float32)
+    canvas = np.tile(shade, (3000, 1)) + noise_rng.normal(0, 4, (3000, 4000)).astype(np.float32)
+    canvas = np.clip(canvas, 0, 255).astype(np.uint8)
+    for _ in range(6):
+        # Stenciled text and panel edges compete with the label for attention
+        cv2.putText(canvas, "CAT 320 GC  SERVICE 250H", (rng.randrange(3000), rng.randrange(200, 2900)),
+                    cv2.FONT_HERSHEY_SIMPLEX, rng.uniform(2, 4), int(rng.uniform(20, 60)), rng.randrange(4, 12))
+    label = cv2.resize(image, None, fx=3.5, fy=3.5, interpolation=cv2.INTER_LINEAR)
+    height, width = label.shape
+    y, x = rng.randrange(3000 - height), rng.randrange(4000 - width)
+    canvas[y:y + height, x:x + width] = label
+    return cv2.GaussianBlur(canvas, (3, 3), 0)
+
+VARIANTS = ["clean", "rotated", "low_contrast", "blurred", "noisy", "photo", "phone_12mp"]
+
+def build_corpus(count: int, seed: int) -> list:
+    """(variant, expected payload, PNG bytes)"""
+    rng = random.Random(seed)
+    corpus = []
+    for i in range(count):
+        variant = VARIANTS[i % len(VARIANTS)]
+        if (i // len(VARIANTS)) % 2:
+            payload = ean13(f"{rng.randrange(10 ** 12):012d}")
+            image = ean13_image(payload)
+        else:
+            machine_id = f"CAT-{rng.randrange(16 ** 6):06X}"
+            payload = machine_id if (i // len(VARIANTS)) % 4 else f"id={machine_id};type=Excavator;mfr=CAT;model=320;year=2024"
+            image = qr_image(payload)
+        degraded = degrade(image, variant, rng)
+        # Phones deliver JPEG; synthetic labels stay lossless
+        extension = ".jpg" if variant == "phone_12mp" else ".png"
+        ok, encoded = cv2.imencode(extension, degraded)
+        corpus.append((variant, payload, encoded.tobytes()))
+    return corpus
+
+def run_inline(corpus: list, pyramid: bool) -> tuple:
+    results = []
+    began = time.perf_counter()
+    for _, _, data in corpus:
+        results.append(barcode.decode_image(data, pyramid=pyramid))
+    return results, time.perf_counter() - began
+
+def percentile(values: list, q: int) -> float:
+    return statistics.quantiles(values, n=100)[q - 1] if len(values) > 1 else values[0]
+
+def report_mode(name: str, corpus: list, results: list, elapsed: float):
+    latencies = [result["timings_ms"]["total"] for result in results]
+    decoded = tally(corpus, results)
+    found = sum(counts["found"] for counts in decoded.values())
+    print(f"\n{name}: {len(corpus) / elapsed:.1f} images/sec, read {found}/{len(corpus)}, "
+          f"latency p50 {statistics.median(latencies):.1f} ms, p95 {percentile(latencies, 95):.1f} ms")
+
+    print(f"{'variant':>14}  decoded  p50 ms")
+    for variant in VARIANTS:
+        counts = decoded[variant]
+        variant_latencies = [r["timings_ms"]["total"] for (v, _, _), r in zip(corpus, results) if v == variant]
+        if variant_latencies:
+            print(f"{variant:>14}  {counts['found']:>3}/{counts['found'] + counts['missed']:<3}  "
+                  f"{statistics.median(variant_latencies):7.1f}")
+
+    stages = defaultdict(list)
+    for result in results:
+        for stage, ms in result["timings_ms"].items():
+            stages[stage].append(ms)
+    print("stage ms (runs, p50, p95): " + ", ".join(
+        f"{stage} {len(values)}/{statistics.median(values):.1f}/{percentile(values, 95):.1f}"
+        for stage, values in stages.items()
+    ))
+    winners = Counter(result["stage"] for result in results if result["symbols"])
+    print("decoded at stage: " + ", ".join(f"{stage} {count}" for stage, count in winners.most_common()))
+
+def tally(corpus: list, results: list) -> dict:
+    decoded = defaultdict(Counter)
+    for (variant, payload, _), result in zip(corpus, results):
+        found = any(symbol["data"] == payload for symbol in result["symbols"])
+        decoded[variant]["found" if found else "missed"] += 1
+    return decoded
+
+async def run_pool(corpus: list, concurrency: int) -> tuple:
+    semaphore = asyncio.Semaphore(concurrency)
+    worst_stall = 0.0
+    done = False
+
+    async def heartbeat():
+        nonlocal worst_stall
+        while not done:
+            before = time.perf_counter()
+            await asyncio.sleep(0.005)
+            worst_stall = max(worst_stall, time.perf_counter() - before - 0.005)
+
+    async def decode(data):
+        async with semaphore:
+            return await barcode.decode(data)
+
+    # Start the workers before timing so process spawn is not counted
+    await asyncio.gather(*(barcode.decode(corpus[0][2]) for _ in range(barcode.BARCODE_WORKERS)))
+
+    monitor = asyncio.create_task(heartbeat())
+    began = time.perf_counter()
+    results = await asyncio.gather(*(decode(data) for _, _, data in corpus))
+    elapsed = time.perf_counter() - began
+    done = True
+    await monitor
+    return results, elapsed, worst_stall
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument("--images", type=int, default=420)
+    parser.add_argument("--concurrency", type=int, default=8)
+    parser.add_argument("--seed", type=int, default=7)
+    args = parser.parse_args()
+
+    corpus = build_corpus(args.images, args.seed)
+    print(f"corpus: {len(corpus)} images, {sum(len(data) for _, _, data in corpus) / 1e6:.1f} MB")
+
+    full_frame, full_frame_elapsed = run_inline(corpus, pyramid=False)
+    pyramid, pyramid_elapsed = run_inline(corpus, pyramid=True)
+    print(f"decoder: {pyramid[0]['decoder']}")
+    report_mode("full frame", corpus, full_frame, full_frame_elapsed)
+    report_mode("pyramid", corpus, pyramid, pyramid_elapsed)
+
+    results, pool_elapsed, worst_stall = asyncio.run(run_pool(corpus, args.concurrency))
+    barcode.stop()
+    found = sum(counts["found"] for counts in tally(corpus, results).values())
+    print(f"\npool: {len(corpus) / pool_elapsed:.1f} images/sec with {barcode.BARCODE_WORKERS} workers, "
+          f"read {found}/{len(corpus)}, worst event-loop stall {worst_stall * 1000:.1f} ms")
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,130 @@
+"""
+Admin dashboard latency: sequential count queries vs. dealer_stats counters.
+
+Seeds a throwaway database on the Mongo server in MONGODB_URL (default
+mongodb://localhost:27017) with only the indexes the app creates at
+startup, reconciles the counters once and times both strategies for the
+stats endpoint, then the pending-request $facet against the sequential
+machine ID lookup and count it replaced.
+
+    cd backend && python -m benchmarks.dashboard_latency --machines 5000 --runs 50
+"""
+import argparse
+import asyncio
+import os
+import random
+import statistics
+import time
+from datetime import datetime, timedelta
+
+os.environ.setdefault("MONGODB_URL", "mongodb://localhost:27017")
+os.environ.setdefault("SECRET_KEY", "benchmark")
+
+import motor.motor_asyncio
+
+from app.routers import admin
+from app.services import dealer_stats, indexes
+
+BENCH_DB = "catrental_benchmark"
+DEALER_ID = "DEALER-BENCH"
+STATUSES = ["Ready", "Occupied", "In-transit", "Maintenance"]
+
+async def seed(db, machine_count: int, request_count: int):
+    await db.machines.drop()
+    await db.requests.drop()
+    now = datetime.utcnow()
+    machines = [
+        {
+            "machineID": f"BENCH-{i:06d}",
+            "machineType": random.choice(list(admin.MACHINE_TYPES)),
+            "dealerID": DEALER_ID if i % 4 else "DEALER-OTHER",
+            "status": random.choice(STATUSES),
+            "updatedAt": now - timedelta(hours=random.randint(1, 500))
+        }
+        for i in range(machine_count)
+    ]
+    await db.machines.insert_many(machines)
+    await db.requests.insert_many([
+        {
+            "requestID": f"REQ-{i:06d}",
+            "machineID": random.choice(machines)["machineID"],
+            "requestType": "Support",
+            "status": random.choice(["In-Progress", "Approved", "Denied"]),
+            "requestDate": now - timedelta(hours=random.randint(1, 500))
+        }
+        for i in range(request_count)
+    ])
+    await indexes.ensure_indexes()
+
+async def sequential_stats(db, dealer_id: str) -> dict:
+    """The pre-$facet implementation: one round trip per count"""
+    total = await db.machines.count_documents({"dealerID": dealer_id})
+    active = await db.machines.count_documents({"dealerID": dealer_id, "status": {"$in": ["Occupied", "In-transit"]}})
+    maintenance = await db.machines.count_documents({"dealerID": dealer_id, "status": "Maintenance"})
+    ready = await db.machines.count_documents({"dealerID": dealer_id, "status": "Ready"})
+    dealer_machines = await db.machines.find({"dealerID": dealer_id}, {"machineID": 1}).to_list(length=None)
+    machine_ids = [m["machineID"] for m in dealer_machines]
+    pending = await db.requests.count_documents({"machineID": {"$in": machine_ids}, "status": "In-Progress"})
+    return {"total": total, "active": active, "maintenance": maintenance, "ready": ready, "pending": pending}
+
+async def sequential_pending(db, dealer_id: str) -> dict:
+    dealer_machines = await db.machines.find({"dealerID": dealer_id}, {"machineID": 1}).to_list(length=None)
+    machine_ids = [m["machineID"] for m in dealer_machines]
+    total = await db.requests.count_documents({"machineID": {"$in": machine_ids}, "status": "In-Progress"})
+    recent = await db.requests.find(
+        {"machineID": {"$in": machine_ids}, "status": "In-Progress"},
+        {"_id": 0, "requestType": 1, "requestDate": 1}
+    ).sort("requestDate", -1).to_list(length=5)
+    return {"total": total, "recent": recent}
+
+async def counter_stats(dealer_id: str) -> dict:
+    stats = await dealer_stats.get_dealer_stats(dealer_id)
+    return {
+        "total": stats["total"],
+        "active": stats["active"],
+        "maintenance": stats["machines"].get("Maintenance", 0),
+        "ready": stats["machines"].get("Ready", 0),
+        "pending": stats["pending_requests"]
+    }
+
+async def time_runs(label: str, runs: int, func):
+    timings = []
+    for _ in range(runs):
+        start = time.perf_counter()
+        result = await func()
+        timings.append((time.perf_counter() - start) * 1000)
+    timings.sort()
+    print(
+        f"{label:<14} median {statistics.median(timings):8.2f} ms   "
+        f"p95 {timings[int(len(timings) * 0.95) - 1]:8.2f} ms"
+    )
+    return result
+
+async def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument("--machines", type=int, default=5000)
+    parser.add_argument("--requests", type=int, default=2000)
+    parser.add_argument("--runs", type=int, default=50)
+    args = parser.parse_args()
+
+    client = motor.motor_asyncio.AsyncIOMotorClient(os.environ["MONGODB_URL"])
+    db = client[BENCH_DB]
+    admin.db = db
+    dealer_stats.db = db
+    indexes.db = db
+
+    await seed(db, args.machines, args.requests)
+    await db.dealer_stats.drop()
+    await dealer_stats.reconcile(DEALER_ID)
+    before = await time_runs("sequential", args.runs, lambda: sequential_stats(db, DEALER_ID))
+    after = await time_runs("counters", args.runs, lambda: counter_stats(DEALER_ID))
+    assert before == after, f"Results differ: {before} != {after}"
+
+    before = await time_runs("pending seq", args.runs, lambda: sequential_pending(db, DEALER_ID))
+    after = await time_runs("pending facet", args.runs, lambda: admin.get_pending_request_facets(DEALER_ID))
+    assert before["total"] == after["total"], f"Pending counts differ: {before['total']} != {after['total']}"
+
+    await client.drop_database(BENCH_DB)
+
+if __name__ == "__main__":
+    asyncio.run(main())
@@ -0,0 +1,78 @@
+"""
+Import-time budget for app startup.
+
+Imports app.main in a fresh interpreter under `python -X importtime`, prints
+the slowest modules and exits non-zero when the total import time exceeds
+the budget or a heavy optional dependency is imported at startup. Run it in
+CI to catch startup regressions.
+
+    cd backend && python -m benchmarks.import_time --budget-ms 2000 --runs 3
+"""
+import argparse
+import os
+import re
+import subprocess
+import sys
+
+# Only loaded on first use (AI calls, statistics, barcode scanning)
+LAZY_MODULES = ["google.generativeai", "numpy", "cv2", "pyzbar", "PIL"]
+
+LINE = re.compile(r"import time:\s+(\d+)\s+\|\s+(\d+)\s+\|(\s*)(\S+)")
+
+def measure(target: str) -> list:
+    """(self_us, cumulative_us, depth, module) for every import of one run"""
+    # Settings app.main reads at import time; nothing connects during the check
+    env = {
+        **os.environ,
+        "MONGODB_URL": os.environ.get("MONGODB_URL", "mongodb://localhost:27017"),
+        "SECRET_KEY": os.environ.get("SECRET_KEY", "import-time-check")
+    }
+    completed = subprocess.run(
+        [sys.executable, "-X", "importtime", "-c", f"import {target}"],
+        capture_output=True, text=True, env=env, cwd=os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+    )
+    if completed.returncode != 0:
+        sys.exit(f"import {target} failed:\n{completed.stderr[-2000:]}")
+
+    imports = []
+    for line in completed.stderr.splitlines():
+        match = LINE.match(line)
+        if match:
+            self_us, cumulative_us, indent, module = match.groups()
+            imports.append((int(self_us), int(cumulative_us), len(indent) // 2, module))
+    return imports
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument("--target", default="app.main")
+    parser.add_argument("--budget-ms", type=float, default=float(os.environ.get("IMPORT_BUDGET_MS", "2000")))
+    parser.add_argument("--runs", type=int, default=3)
+    parser.add_argument("--top", type=int, default=15)
+    args = parser.parse_args()
+
+    # Best of several runs filters out disk-cache and scheduling noise
+    runs = [measure(args.target) for _ in range(args.runs)]
+    totals = [sum(self_us for self_us, _, _, _ in imports) / 1000 for imports in runs]
+    best = runs[totals.index(min(totals))]
+
+    print(f"import {args.target}: best {min(totals):.1f} ms, worst {max(totals):.1f} ms over {args.runs} runs")
+    print(f"{'cumulative ms':>14}  module")
+    top_level = sorted((imp for imp in best if imp[2] <= 1), key=lambda imp: imp[1], reverse=True)
+    for _, cumulative_us, _, module in top_level[:args.top]:
+        print(f"{cumulative_us / 1000:14.1f}  {module}")
+
+    failures = []
+    if min(totals) > args.budget_ms:
+        failures.append(f"startup imports took {min(totals):.1f} ms (budget {args.budget_ms:.0f} ms)")
+    loaded = {module for _, _, _, module in best}
+    for module in LAZY_MODULES:
+        if module in loaded:
+            failures.append(f"{module} is imported at startup; import it on first use")
+
+    if failures:
+        print("\nFAILED:\n  " + "\n  ".join(failures))
+        sys.exit(1)
+    print("\nOK: within budget and no heavy optional imports at startup")
+
+if __name__ == "__main__":
+    main()
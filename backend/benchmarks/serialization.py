@@ -0,0 +1,93 @@
+"""
+Response serialization: per-row conversion + stdlib JSON vs. orjson.
+
+Builds machine-location style documents in memory (no database needed) and
+times the old FastAPI path (str(_id)/isoformat loop, APIResponse validation,
+jsonable_encoder, json.dumps) against services.serialization.dumps.
+
+    cd backend && python -m benchmarks.serialization --rows 5000 --runs 30
+"""
+import argparse
+import copy
+import json
+import random
+import statistics
+import time
+from datetime import datetime, timedelta
+
+from bson import ObjectId
+from fastapi.encoders import jsonable_encoder
+
+from app.models.database import APIResponse, MachineStatus
+from app.services.serialization import dumps
+
+STATUSES = list(MachineStatus)
+
+def make_rows(count: int) -> list:
+    now = datetime.utcnow()
+    return [
+        {
+            "_id": ObjectId(),
+            "machineID": f"BENCH-{i:06d}",
+            "machineType": random.choice(["Excavator", "Loader", "Crane", "Backhoe"]),
+            "status": random.choice(STATUSES),
+            "dealerID": "DEALER-BENCH",
+            "userID": f"USER-{i % 200:04d}",
+            "location": f"{random.uniform(-60, 60):.5f}, {random.uniform(-180, 180):.5f}",
+            "engineHoursPerDay": round(random.uniform(0, 12), 2),
+            "idleHours": round(random.uniform(0, 6), 2),
+            "operatingDays": random.randint(0, 300),
+            "checkInDate": now - timedelta(days=random.randint(1, 60)),
+            "checkOutDate": now + timedelta(days=random.randint(1, 60)),
+            "createdAt": now - timedelta(days=random.randint(60, 600)),
+            "updatedAt": now - timedelta(hours=random.randint(1, 500))
+        }
+        for i in range(count)
+    ]
+
+def legacy_encode(rows: list) -> bytes:
+    """The pre-orjson path: convert every row, validate, encode, json.dumps"""
+    for row in rows:
+        row["_id"] = str(row["_id"])
+        for field in ("createdAt", "updatedAt"):
+            if isinstance(row.get(field), datetime):
+                row[field] = row[field].isoformat()
+    response = APIResponse(success=True, message=f"Found {len(rows)} machines", data={"machines": rows})
+    return json.dumps(jsonable_encoder(response)).encode()
+
+def orjson_encode(rows: list) -> bytes:
+    return dumps({"success": True, "message": f"Found {len(rows)} machines", "data": {"machines": rows}})
+
+def time_runs(label: str, runs: int, rows: list, func) -> float:
+    timings = []
+    for _ in range(runs):
+        # Both paths get fresh documents, as they would from a cursor
+        batch = copy.deepcopy(rows)
+        start = time.perf_counter()
+        func(batch)
+        timings.append((time.perf_counter() - start) * 1000)
+    timings.sort()
+    median = statistics.median(timings)
+    print(
+        f"{label:<8} median {median:8.2f} ms   "
+        f"p95 {timings[int(len(timings) * 0.95) - 1]:8.2f} ms"
+    )
+    return median
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument("--rows", type=int, default=5000)
+    parser.add_argument("--runs", type=int, default=30)
+    args = parser.parse_args()
+
+    rows = make_rows(args.rows)
+    before = json.loads(legacy_encode(copy.deepcopy(rows)))
+    after = json.loads(orjson_encode(copy.deepcopy(rows)))
+    assert before == after, "Encoders produce different JSON"
+
+    legacy = time_runs("stdlib", args.runs, rows, legacy_encode)
+    fast = time_runs("orjson", args.runs, rows, orjson_encode)
+    print(f"speedup  {legacy / fast:.1f}x for {args.rows} rows")
+
+if __name__ == "__main__":
+    main()
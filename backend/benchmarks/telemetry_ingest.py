@@ -0,0 +1,124 @@
+"""
+Telemetry ingestion throughput through services.telemetry.ingest_readings.
+
+Seeds a throwaway database on the Mongo server in MONGODB_URL (default
+mongodb://localhost:27017) with machines and only the indexes the app
+creates at startup, then pushes batches of readings twice: with the event
+bus stopped, and with it running the same subscribers as the app (health
+scoring, dealer counters, revenue and response cache invalidation),
+reporting sustained readings per second and the time to drain the events.
+
+    cd backend && python -m benchmarks.telemetry_ingest --machines 5000 --readings 200000 --batch 5000
+"""
+import argparse
+import asyncio
+import os
+import random
+import time
+from datetime import datetime, timedelta
+
+os.environ.setdefault("MONGODB_URL", "mongodb://localhost:27017")
+os.environ.setdefault("SECRET_KEY", "benchmark")
+
+import motor.motor_asyncio
+
+from app.services import (
+    events, indexes, telemetry, telemetry_rollup, health_scoring, health_history,
+    dealer_stats, revenue, response_cache
+)
+
+BENCH_DB = "catrental_benchmark"
+# Modules whose Mongo handle is pointed at the benchmark database
+SERVICES = [indexes, telemetry, telemetry_rollup, health_scoring, health_history, dealer_stats, revenue, response_cache]
+
+async def seed(db, machine_count: int):
+    for name in await db.list_collection_names():
+        await db.drop_collection(name)
+    await db.machines.insert_many([
+        {
+            "machineID": f"TEL-{i:06d}",
+            "machineType": "Excavator",
+            "dealerID": f"DEALER-{i % 10}",
+            "userID": f"USER-{i % 500:04d}",
+            "status": "Occupied",
+            "engineHoursPerDay": 0.0,
+            "idleHours": 0.0,
+            "operatingDays": 0,
+            "updatedAt": datetime.utcnow()
+        }
+        for i in range(machine_count)
+    ])
+    await indexes.ensure_indexes()
+    await telemetry.ensure_collections()
+
+def make_batch(machine_count: int, size: int, start: datetime) -> list:
+    return [
+        {
+            "machine_id": f"TEL-{random.randrange(machine_count):06d}",
+            "engine_hours_per_day": round(random.uniform(0, 14), 2),
+            "idle_hours": round(random.uniform(0, 6), 2),
+            "operating_days": random.randint(0, 30),
+            "timestamp": (start + timedelta(milliseconds=i)).isoformat()
+        }
+        for i in range(size)
+    ]
+
+async def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument("--machines", type=int, default=5000)
+    parser.add_argument("--readings", type=int, default=200000)
+    parser.add_argument("--batch", type=int, default=5000)
+    parser.add_argument("--concurrency", type=int, default=4)
+    args = parser.parse_args()
+
+    client = motor.motor_asyncio.AsyncIOMotorClient(os.environ["MONGODB_URL"])
+    db = client[BENCH_DB]
+    for service in SERVICES:
+        service.db = db
+
+    start = datetime.utcnow() - timedelta(hours=1)
+    batches = [
+        make_batch(args.machines, args.batch, start + timedelta(seconds=i))
+        for i in range(args.readings // args.batch)
+    ]
+
+    await seed(db, args.machines)
+    await run(db, "events off", batches, args)
+
+    health_scoring.register()
+    dealer_stats.register()
+    revenue.register()
+    response_cache.register()
+    events.start()
+    await seed(db, args.machines)
+    await dealer_stats.reconcile()
+    await run(db, "events on", batches, args)
+    await events.stop()
+
+    await client.drop_database(BENCH_DB)
+
+async def run(db, label: str, batches: list, args):
+    semaphore = asyncio.Semaphore(args.concurrency)
+    rejected = 0
+
+    async def push(batch):
+        nonlocal rejected
+        async with semaphore:
+            result = await telemetry.ingest_readings(batch)
+            rejected += result["rejected"]
+
+    began = time.perf_counter()
+    await asyncio.gather(*(push(batch) for batch in batches))
+    elapsed = time.perf_counter() - began
+
+    total = len(batches) * args.batch
+    print(f"{label}: {total} readings in {elapsed:.2f}s: {total / elapsed:,.0f} readings/sec ({rejected} rejected)")
+    if events._queue is not None:
+        drain_began = time.perf_counter()
+        await events._queue.join()
+        drained = time.perf_counter() - drain_began
+        print(f"{label}: event queue drained {drained:.2f}s after ingest ({total / (elapsed + drained):,.0f} readings/sec end to end)")
+    print(f"{label}: stored raw readings: {await db.telemetry_readings.count_documents({})}")
+
+if __name__ == "__main__":
+    asyncio.run(main())
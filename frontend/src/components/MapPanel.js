@@ -66,6 +66,7 @@ export default function MapPanel({ isOpen, onClose }) {
     const [statusFilter, setStatusFilter] = useState("all");
     const [leafletLoaded, setLeafletLoaded] = useState(false); // keep same name used in UI
     const [is3D, setIs3D] = useState(true);
+    const [streamGeneration, setStreamGeneration] = useState(0); // bumped to reopen the live feed
 
     const mapRef = useRef(null); // container (keeps class name 'leaflet-map')
     const viewerRef = useRef(null); // Cesium.Viewer
@@ -171,29 +172,80 @@ export default function MapPanel({ isOpen, onClose }) {
         return () => ro.disconnect();
     }, [leafletLoaded]);
 
-    // Fetch machines when opening (with timeout guard)
+    // Live machine locations while open: a snapshot, then per-machine deltas (with timeout guard).
+    // EventSource cannot send an Authorization header, so each connection uses a short-lived stream ticket.
     useEffect(() => {
         if (!isOpen || !session) return;
-        const run = async () => {
+        let source = null;
+        let retryTimer = null;
+        let cancelled = false;
+        setLoading(true);
+        loadingTimeoutRef.current = setTimeout(() => setLoading(false), 8000);
+        const stopLoading = () => {
+            if (loadingTimeoutRef.current) clearTimeout(loadingTimeoutRef.current);
+            setLoading(false);
+        };
+        const reopen = () => setStreamGeneration((n) => n + 1);
+
+        const open = async () => {
+            let ticket;
             try {
-                setLoading(true);
-                loadingTimeoutRef.current = setTimeout(() => setLoading(false), 8000);
-                const res = await fetch(`${process.env.NEXT_PUBLIC_API_URL}/api/recommendations/machine-locations`, {
+                const res = await fetch(`${process.env.NEXT_PUBLIC_API_URL}/api/auth/stream-ticket`, {
+                    method: "POST",
                     headers: { Authorization: `Bearer ${session.accessToken}` },
                 });
-                if (res.ok) {
-                    const json = await res.json();
-                    setMachines(json.data?.locations || []);
-                }
-            } catch (e) {
-                console.error("Error fetching machine locations", e);
-            } finally {
-                if (loadingTimeoutRef.current) clearTimeout(loadingTimeoutRef.current);
-                setLoading(false);
+                if (!res.ok) throw new Error(`HTTP ${res.status}`);
+                ticket = (await res.json()).data.ticket;
+            } catch (err) {
+                console.error("Could not open machine location stream:", err);
+                stopLoading();
+                return;
             }
+            if (cancelled) return;
+
+            source = new EventSource(
+                `${process.env.NEXT_PUBLIC_API_URL}/api/recommendations/machine-locations/stream?ticket=${encodeURIComponent(ticket)}`
+            );
+            source.addEventListener("snapshot", (e) => {
+                setMachines(JSON.parse(e.data).locations || []);
+                stopLoading();
+            });
+            source.addEventListener("upsert", (e) => {
+                const { location } = JSON.parse(e.data);
+                setMachines((prev) => {
+                    const index = prev.findIndex((m) => m.machineID === location.machineID);
+                    if (index === -1) return [...prev, location];
+                    const next = [...prev];
+                    next[index] = location;
+                    return next;
+                });
+            });
+            source.addEventListener("remove", (e) => {
+                const { machineID } = JSON.parse(e.data);
+                setMachines((prev) => prev.filter((m) => m.machineID !== machineID));
+            });
+            // Server dropped deltas for us, or the login behind the stream expired; reopen with a new ticket
+            source.addEventListener("resync", reopen);
+            source.addEventListener("expired", () => {
+                source.close();
+                reopen();
+            });
+            source.onerror = () => {
+                // A ticket is only good for a minute, so never let EventSource retry with the old one
+                source.close();
+                stopLoading();
+                retryTimer = setTimeout(reopen, 5000);
+            };
+        };
+        open();
+
+        return () => {
+            cancelled = true;
+            if (source) source.close();
+            if (retryTimer) clearTimeout(retryTimer);
+            stopLoading();
         };
-        run();
-    }, [isOpen, session]);
+    }, [isOpen, session, streamGeneration]);
 
     const filteredMachines = useMemo(
         () => machines.filter((m) => (statusFilter === "all" ? true : m.status === statusFilter)),